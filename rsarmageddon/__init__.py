@@ -30,6 +30,7 @@ import sys
 
 from functools import partial
 from itertools import compress
+from importlib import import_module
 
 from . import attacks
 from .utils import output
@@ -41,7 +42,20 @@ from .banner import (
         print_attacks_short,
         print_encodings,
         version)
-from .commands import pem, ciphertool, attack, misc
+
+
+# Command modules (and the dependencies they pull in) are imported only
+# when their command is run
+commands = {
+    "pem": "pem",
+    "encrypt": "ciphertool",
+    "decrypt": "ciphertool",
+    "attack": "attack",
+    "profile": "profile",
+    "benchmark": "benchmark",
+    "worker": "worker",
+    "serve": "serve"
+}
 
 
 def rsarmageddon():
@@ -75,17 +89,10 @@ def rsarmageddon():
     if not args.command:
         return
 
-    commands = {
-        "pem": pem.run,
-        "encrypt": ciphertool.run,
-        "decrypt": ciphertool.run,
-        "attack": attack.run
-    }
-
-    command = commands.get(args.command, misc.run)
+    module = commands.get(args.command, "misc")
 
     try:
-        command()
+        import_module(f".commands.{module}", __name__).run()
     except (ValueError, OSError) as e:
         output.error(e)
 
@@ -26,13 +26,16 @@ from functools import partial
 from pathlib import Path
 from argparse import ArgumentParser, Action, Namespace, SUPPRESS, RawDescriptionHelpFormatter
 
-from .certs import load_key
 from .parsing import (
         parse_int_arg,
         parse_time,
         parse_list,
+        parse_int_list,
         parse_std_list,
-        path_or_stdout)
+        parse_fraction_list,
+        parse_address,
+        path_or_stdout,
+        path_or_stdin)
 
 
 help_formatter = partial(RawDescriptionHelpFormatter, max_help_position=30)
@@ -48,7 +51,11 @@ main_description = dedent("""\
           factor                      factorize a number with PARI factorization
           ecm                         factorize a number with ellyptic curve method
           isprime                     primality test
-          eulerphi                    calculate euler phi of a number""")
+          eulerphi                    calculate euler phi of a number
+          profile                     summarize attack profiles
+          benchmark                   benchmark attacks against synthetic weak keys
+          worker                      run attacks for a coordinator (attack --coordinate)
+          serve                       run attacks submitted through a JSON API""")
 
 attack_description = dedent("""\
         Attack weak public keys and recover private keys""")
@@ -57,10 +64,14 @@ pem_description = dedent("""\
         Manage keys and key files""")
 
 cipher_description = dedent("""\
-        Encrypt data and files using different encryption standards""")
+        Encrypt data and files using different encryption standards.
+        With --key-dir and --input-manifest, encrypt every input to every
+        key in a pool of worker processes""")
 
 uncipher_description = dedent("""\
-        Decrypt data and files using different encryption standards""")
+        Decrypt data and files using different encryption standards.
+        With --key-dir and --input-manifest, decrypt every input with every
+        key (or the key named by the input) in a pool of worker processes""")
 
 factor_description = dedent("""\
         Factorize a number using PARI factorization""")
@@ -74,6 +85,28 @@ isprime_description = dedent("""\
 eulerphi_description = dedent("""\
         Calculate Euler's phi function of a number""")
 
+benchmark_description = dedent("""\
+        Generate keys vulnerable to each attack at increasing sizes, run the
+        attacks against them and record wall time and success rate. Results
+        can be saved as a baseline and compared against a previous one.
+        With --micro, time the Python side hot paths (key loading, integer
+        parsing, decryption, key completion) instead""")
+
+worker_description = dedent("""\
+        Connect to a coordinator started with attack --coordinate, and run
+        the attacks it requests on the shards of keys it hands out until
+        there are none left""")
+
+serve_description = dedent("""\
+        Run as a daemon serving a JSON API over HTTP or a unix socket, to
+        submit keys and ciphertexts with a list of attacks and retrieve the
+        results. Jobs are queued by priority and can be cancelled; Sage
+        discovery and attack staging are done once for all jobs""")
+
+profile_description = dedent("""\
+        Merge attack profiles saved with attack --profile and show the
+        functions where most time was spent""")
+
 epilog = dedent("""\
         Number format:
             All numbers can be input in a variety of formats and bases.
@@ -86,10 +119,13 @@ epilog = dedent("""\
 
 class ReadKeyFile(Action):
     def __call__(self, parser, namespace, path, option_string=None):
+        from .certs import load_key # imports pycryptodome
         key = load_key(path)
         for k, v in zip(("n", "e", "d", "p", "q"), key):
             if getattr(namespace, k, None) is None:
                 setattr(namespace, k, v)
+        if len(key) > 5 and not getattr(namespace, "other_primes", None):
+            namespace.other_primes = key[5:]
 
 
 key_parser = ArgumentParser(add_help=False)
@@ -100,6 +136,7 @@ key_parser.add_argument("-d",          action="store",     type=parse_int_arg, m
 key_parser.add_argument("-p",          action="store",     type=parse_int_arg, metavar="NUMBER", help="RSA first prime factor")
 key_parser.add_argument("-q",          action="store",     type=parse_int_arg, metavar="NUMBER", help="RSA second prime factor")
 key_parser.add_argument("--phi",       action="store",     type=parse_int_arg, metavar="NUMBER", help="Euler's phi of RSA public modulus")
+key_parser.add_argument("--other-primes", "--op", action="store", type=parse_int_list, metavar="NUMBERS_LIST", help="Comma-separated list of RSA additional prime factors of a multi-prime key")
 
 format_parser = ArgumentParser(add_help=False)
 format_parser.add_argument("--file-format", "--ff", choices=["pem", "der", "openssh", "json"], default="pem", help="Set output key file format")
@@ -135,6 +172,16 @@ ciphertext_parser.add_argument("--ciphertext-raw",  "--ctr", "--decrypt-raw",  a
 ciphertext_parser.add_argument("--ciphertext-file", "--ctf", "--decrypt-file", action=Input,  type=Path,           metavar="FILE",          help="Use file as ciphertext")
 ciphertext_parser.add_argument("--output",          "-o",                      action=Output, type=path_or_stdout, metavar="FILE",          help="Output plaintext to file or stdout (applies to previous input)")
 
+batch_parser = ArgumentParser(add_help=False)
+batch_parser.add_argument("--key-dir", "--kd",        action="store",      type=Path,           metavar="DIRECTORY",  help="Batch mode: use every key file found in DIRECTORY")
+batch_parser.add_argument("--input-manifest", "--im", action="store",      type=Path,           metavar="FILE",       help="Batch mode: read inputs from JSON lines FILE, one {\"name\": ..., \"text\": ... or \"file\": ..., \"key\": ...} object per line. When \"key\" is given, the input is only processed with the key file of that name")
+batch_parser.add_argument("--output-dir", "--od",     action="store",      type=Path,           metavar="DIRECTORY",  help="Batch mode: write each result to DIRECTORY/KEY.INPUT[.STD]")
+batch_parser.add_argument("--output-jsonl", "--oj",   action="store",      type=path_or_stdout, metavar="FILE",       help="Batch mode: write results to JSON lines FILE")
+batch_parser.add_argument("--exts", "-x",             action="store",      default=["pem", "pub"], type=parse_list, metavar="EXTENSIONS", help="Comma-separated list of file extensions. Selects which files are picked up by --key-dir")
+batch_parser.add_argument("--recursive", "-r",        action="store_true",                                            help="Descend recursively inside --key-dir")
+batch_parser.add_argument("--stream",                 action="store_true",                                            help="Process input files of any size in modulus sized blocks, encrypting to (or decrypting from) a framed output file")
+batch_parser.add_argument("--jobs", "-j",             action="store",      type=int,            metavar="NUMBER",     help="Batch and stream modes: number of worker processes (default: number of CPUs)")
+
 commons_parser = ArgumentParser(argument_default=SUPPRESS, add_help=False)
 commons_parser.add_argument("--show-attacks",            action="store_const", const=True, help="Show all available attacks")
 commons_parser.add_argument("--show-attacks-short",      action="store_const", const=True, help="Show all available attacks (short form)")
@@ -150,22 +197,62 @@ commons_parser.add_argument("--no-system-attacks",       action="store_const", c
 main_parser = ArgumentParser(parents=[commons_parser], formatter_class=help_formatter, description=main_description)
 
 scripts_parser = ArgumentParser(add_help=False)
-scripts_parser.add_argument("n", action="store", type=parse_int_arg, metavar="NUMBER", help="Input number")
+scripts_parser.add_argument("n",            action="store", nargs="?", type=parse_int_arg, metavar="NUMBER", help="Input number")
+scripts_parser.add_argument("--batch", "-b", action="store",            type=path_or_stdin, metavar="FILE",   help="Read numbers from FILE (- for standard input), one per line, and write a JSON object per number to standard output")
+scripts_parser.add_argument("--jobs", "-j",  action="store", default=1, type=int,           metavar="NUMBER", help="Batch mode: number of Sage sessions numbers are spread over; results are written as they are computed, so with more than one session they may come out of order (default: 1)")
 
 command_subparsers = main_parser.add_subparsers(dest="command")
 attack_parser   = command_subparsers.add_parser("attack",  parents=[commons_parser, format_parser, ciphertext_parser], formatter_class=help_formatter, description=attack_description,   epilog=epilog)
 pem_parser      = command_subparsers.add_parser("pem",     parents=[commons_parser, format_parser, key_parser],        formatter_class=help_formatter, description=pem_description,      epilog=epilog)
-cipher_parser   = command_subparsers.add_parser("encrypt", parents=[commons_parser, key_parser, plaintext_parser],     formatter_class=help_formatter, description=cipher_description,   epilog=epilog)
-uncipher_parser = command_subparsers.add_parser("decrypt", parents=[commons_parser, key_parser, ciphertext_parser],    formatter_class=help_formatter, description=uncipher_description, epilog=epilog)
+cipher_parser   = command_subparsers.add_parser("encrypt", parents=[commons_parser, key_parser, plaintext_parser, batch_parser],  formatter_class=help_formatter, description=cipher_description,   epilog=epilog)
+uncipher_parser = command_subparsers.add_parser("decrypt", parents=[commons_parser, key_parser, ciphertext_parser, batch_parser], formatter_class=help_formatter, description=uncipher_description, epilog=epilog)
 command_subparsers.add_parser("factor",                    parents=[commons_parser, scripts_parser],                   formatter_class=help_formatter, description=factor_description,   epilog=epilog)
 command_subparsers.add_parser("ecm",                       parents=[commons_parser, scripts_parser],                   formatter_class=help_formatter, description=ecm_description,      epilog=epilog)
 command_subparsers.add_parser("isprime",                   parents=[commons_parser, scripts_parser],                   formatter_class=help_formatter, description=isprime_description,  epilog=epilog)
 command_subparsers.add_parser("eulerphi",                  parents=[commons_parser, scripts_parser],                   formatter_class=help_formatter, description=eulerphi_description, epilog=epilog)
+benchmark_parser = command_subparsers.add_parser("benchmark", parents=[commons_parser],                              formatter_class=help_formatter, description=benchmark_description)
+profile_parser  = command_subparsers.add_parser("profile", parents=[commons_parser],                                   formatter_class=help_formatter, description=profile_description)
+worker_parser   = command_subparsers.add_parser("worker",  parents=[commons_parser],                                   formatter_class=help_formatter, description=worker_description)
+serve_parser    = command_subparsers.add_parser("serve",   parents=[commons_parser],                                   formatter_class=help_formatter, description=serve_description)
 
 pem_parser.add_argument("--generate", "-g",                      action="store_true",                                      help="Generate a new 2048 bit key pair")
 pem_parser.add_argument("--dump-values", "--dumpvalues", "--dv", action="store_true",                                      help="Dump key values to standard output")
 pem_parser.add_argument("--create-public", "--cpu",              action="store", type=path_or_stdout, metavar="FILE",      help="Output public key to file")
 pem_parser.add_argument("--create-private", "--cpr",             action="store", type=path_or_stdout, metavar="FILE",      help="Output private key to file")
+pem_parser.add_argument("--generate-corpus",                     action="store", type=int,            metavar="NUMBER",    help="Generate a corpus of NUMBER public keys as a PEM bundle, with a JSON lines manifest of their private values")
+pem_parser.add_argument("--bits",                                action="store", type=int, default=2048, metavar="NUMBER", help="Modulus bit length of corpus keys (default: 2048)")
+pem_parser.add_argument("--weaknesses",                          action="store", type=parse_fraction_list, default={}, metavar="LIST", help="Comma-separated list of weakness=fraction items injected in the corpus, weaknesses are: shared (shared prime), close (close primes), small_d (small private exponent), smooth (smooth p-1), reused (reused modulus)")
+pem_parser.add_argument("--corpus-output",                       action="store", type=Path, default=Path("corpus.pem"), metavar="FILE", help="Corpus bundle path, the manifest is written next to it with a .jsonl extension (default: corpus.pem)")
+pem_parser.add_argument("--seed",                                action="store", type=int,            metavar="NUMBER",    help="Seed for corpus generation, for reproducible corpora")
+pem_parser.add_argument("--jobs", "-j",                          action="store", type=int,            metavar="NUMBER",    help="Number of worker processes generating the corpus (default: number of CPUs)")
+
+
+profile_parser.add_argument("profiles", action="store", nargs="+", type=Path, metavar="PATH",   help="Profile files, or directories containing them")
+profile_parser.add_argument("--top",    action="store", default=20,  type=int,  metavar="NUMBER", help="Number of functions to show (default: 20)")
+profile_parser.add_argument("--sort",   action="store", default="cumulative", choices=["cumulative", "tottime", "calls"], help="Sort functions by cumulative time, internal time or number of calls (default: cumulative)")
+
+
+benchmark_parser.add_argument("--attacks",       action="store", dest="benchmark_attacks", type=parse_list, metavar="ATTACKS_LIST", help="Comma-separated list of attacks to benchmark (default: all)")
+benchmark_parser.add_argument("--sizes",         action="store", default=[512, 1024, 2048, 4096], type=parse_int_list, metavar="BITS_LIST", help="Comma-separated list of key sizes in bits (default: 512,1024,2048,4096)")
+benchmark_parser.add_argument("--trials",        action="store", default=3,    type=int,        metavar="NUMBER", help="Number of keys generated for each attack and size (default: 3)")
+benchmark_parser.add_argument("--timeout", "-t", action="store", default=300,  dest="benchmark_timeout", type=parse_time, metavar="TIME",   help="Maximum run time allowed for each attack (default: 5m)")
+benchmark_parser.add_argument("--seed",          action="store",               type=int,        metavar="NUMBER", help="Seed for key generation, for reproducible runs")
+benchmark_parser.add_argument("--save-baseline", action="store",               type=Path,       metavar="FILE",   help="Save results to FILE as JSON")
+benchmark_parser.add_argument("--baseline",      action="store",               type=Path,       metavar="FILE",   help="Compare results against a baseline saved with --save-baseline, failing on regressions")
+benchmark_parser.add_argument("--tolerance",     action="store", default=1.5,  type=float,      metavar="FACTOR", help="Slowdown factor over the baseline mean wall time considered a regression (default: 1.5)")
+benchmark_parser.add_argument("--micro",         action="store", nargs="?", const=[], type=parse_list, metavar="BENCHMARKS_LIST", help="Run micro-benchmarks of the Python code paths instead of attacks, optionally only the comma-separated BENCHMARKS_LIST")
+benchmark_parser.add_argument("--scale",         action="store", default=1.0,  type=float,      metavar="FACTOR", help="Scale the number of operations of each micro-benchmark (default: 1.0)")
+
+
+worker_parser.add_argument("coordinator", action="store", type=parse_address, metavar="[HOST:]PORT", help="Address of the coordinator (default host: localhost)")
+worker_parser.add_argument("--name",      action="store", dest="worker_name",  metavar="NAME", help="Name reported to the coordinator (default: HOSTNAME-PID)")
+worker_parser.add_argument("--wait",      action="store", default=60, dest="connect_wait", type=parse_time, metavar="TIME", help="Keep trying to connect to the coordinator for TIME (default: 1m)")
+
+
+serve_parser.add_argument("--listen",      action="store", default=("localhost", 8733), type=parse_address, metavar="[HOST:]PORT", help="Address to serve HTTP on (default: localhost:8733)")
+serve_parser.add_argument("--unix-socket", action="store", type=Path,      metavar="PATH",   help="Serve on a unix socket at PATH instead of HTTP over TCP")
+serve_parser.add_argument("--concurrency", action="store", default=1,      type=int,         metavar="NUMBER", help="Maximum number of jobs run at once (default: 1)")
+serve_parser.add_argument("--timeout", "-t", action="store",               type=parse_time,  metavar="TIME",   help="Default maximum run time allowed for each attack of a job")
 
 
 class NewKey(Action):
@@ -186,12 +273,24 @@ attack_parser.add_argument("-n",                         action=NewKey,
 attack_parser.add_argument("-e",                         action=SetE,                                   type=parse_int_arg,  metavar="NUMBER",       help="Target key RSA public exponent (applies to preceding -n)")
 attack_parser.add_argument("--n-e-file", "--nef",        action="append", dest="n_e_files", default=[], type=Path,           metavar="FILE",         help="Read target public keys from text FILE, one comma-separated n,e pair per line")
 attack_parser.add_argument("--key", "-k",                action="append", dest="key_paths", default=[], type=Path,           metavar="PATH",         help="Read target public keys from PATH. PATH can either be a single key file or a directory containing key files")
+attack_parser.add_argument("--bundle", "-b",             action="append", dest="bundles",   default=[], type=Path,           metavar="FILE",         help="Read target public keys from FILE, a bundle of concatenated PEM public keys, private keys and X.509 certificates")
+attack_parser.add_argument("--authorized-keys", "--ak",  action="append", dest="authorized_keys", default=[], type=Path,     metavar="FILE",         help="Read target public keys from the ssh-rsa entries of an OpenSSH authorized_keys or known_hosts FILE")
+attack_parser.add_argument("--jsonl",                    action="append", dest="jsonl_files", default=[], type=Path,         metavar="FILE",         help="Read target public keys from JSON lines FILE, one {\"n\": ..., \"e\": ..., \"name\": ...} object per line")
 attack_parser.add_argument("--exts", "-x",               action="store",  default=["pem", "pub"],       type=parse_list,     metavar="EXTENSIONS",   help="Comma-separated list of file extensions. Selects which files are picked up by -k when PATH is a directory")
 attack_parser.add_argument("--recursive", "-r",          action="store_true",                                                                        help="Descend recursively inside directories when looking for key files (-k only looks into the first level by default)")
-attack_parser.add_argument("--output-key", "--ok",       action="store_true",                                                                        help="Output first cracked key to standard output")
-attack_parser.add_argument("--output-key-file", "--okf", action="store",                                type=path_or_stdout, metavar="FILE",         help="Output first cracked key to FILE")
+attack_parser.add_argument("--output-key", "--ok",       action="store_true",                                                                        help="Output the cracked key to standard output (single target key only)")
+attack_parser.add_argument("--output-key-file", "--okf", action="store",                                type=path_or_stdout, metavar="FILE",         help="Output the cracked key to FILE (single target key only)")
 attack_parser.add_argument("--output-key-dir", "--okd",  action="store",                                type=Path,           metavar="DIRECTORY",    help="Output all cracked keys to this directory")
+attack_parser.add_argument("--output-key-bundle", "--okb", action="store",                              type=Path,           metavar="FILE",         help="Output all cracked keys to FILE as a bundle of concatenated PEM private keys")
+attack_parser.add_argument("--output-key-jsonl", "--okj", action="store",                               type=path_or_stdout, metavar="FILE",         help="Output all cracked keys to JSON lines FILE, one {\"name\": ..., \"n\": ..., \"e\": ..., \"d\": ..., \"p\": ..., \"q\": ...} object per line")
 attack_parser.add_argument("--timeout", "-t",            action="store",                                type=parse_time,     metavar="TIME",         help="Set maximum run time allowed for each attack")
+attack_parser.add_argument("--non-interactive", "--ni",  action="store_true",                                                                        help="Never prompt for attack parameters, use their default values instead")
+attack_parser.add_argument("--state-dir",                action="store",                                type=Path,           metavar="DIRECTORY",    help="Periodically save the progress of long running attacks to DIRECTORY, and resume them from there on the next run")
+attack_parser.add_argument("--metrics",                  action="store",                                type=path_or_stdout, metavar="FILE",         help="Append a JSON lines record with timing, resource usage and attack reported counters of every attack run to FILE")
+attack_parser.add_argument("--profile",                  action="store",                                type=Path,           metavar="DIRECTORY",    help="Run attacks under cProfile and save their stats to DIRECTORY, one file per attack and key set (see the profile command)")
+attack_parser.add_argument("--jobs", "-j",               action="store",                                type=int,            metavar="NUMBER",       help="Number of worker processes used to load key files and bundles and to complete cracked keys (default: number of CPUs)")
+attack_parser.add_argument("--coordinate",               action="store",                                type=parse_address,  metavar="[HOST:]PORT",  help="Instead of running attacks, listen on HOST:PORT (default host: localhost) and hand out shards of the target keys to workers started with the worker command, then merge their results")
+attack_parser.add_argument("--shard-size",               action="store", default=1,                     type=int,            metavar="NUMBER",       help="Number of keys handed to a worker at once with --coordinate; single key attacks are run on every key of a shard, attacks on more than one key only relate keys of the same shard (default: 1)")
 attack_parser.set_defaults(keys=[])
 
 
@@ -205,6 +304,7 @@ class RSArmageddonNamespace(Namespace):
         self.p = None
         self.q = None
         self.phi = None
+        self.other_primes = ()
         self.encryption_standard = ["pkcs"]
         self.plaintext = None
         self.plaintext_raw = None
@@ -214,6 +314,11 @@ class RSArmageddonNamespace(Namespace):
         self.ciphertext = None
         self.ciphertext_raw = None
         self.ciphertext_file = None
+        self.key_dir = None
+        self.input_manifest = None
+        self.output_dir = None
+        self.output_jsonl = None
+        self.stream = False
         self.show_attacks = False
         self.show_attacks_short = False
         self.show_encodings = False
@@ -228,15 +333,51 @@ class RSArmageddonNamespace(Namespace):
         self.dump_values = False
         self.create_public = None
         self.create_private = None
+        self.generate_corpus = None
+        self.bits = 2048
+        self.weaknesses = {}
+        self.corpus_output = Path("corpus.pem")
         self.file_format = "pem"
         self.attacks = None
         self.n_e_file = []
+        self.bundles = []
+        self.authorized_keys = []
+        self.jsonl_files = []
         self.exts = ["pem", "pub"]
         self.recursive = False
         self.output_key = False
         self.output_key_file = None
         self.output_key_dir = None
+        self.output_key_bundle = None
+        self.output_key_jsonl = None
         self.timeout = None
+        self.non_interactive = False
+        self.state_dir = None
+        self.metrics = None
+        self.profile = None
+        self.jobs = None
+        self.benchmark_attacks = None
+        self.sizes = [512, 1024, 2048, 4096]
+        self.trials = 3
+        self.benchmark_timeout = 300
+        self.seed = None
+        self.save_baseline = None
+        self.baseline = None
+        self.micro = None
+        self.scale = 1.0
+        self.tolerance = 1.5
+        self.coordinate = None
+        self.shard_size = 1
+        self.coordinator = None
+        self.worker_name = None
+        self.connect_wait = 60
+        self.listen = ("localhost", 8733)
+        self.unix_socket = None
+        self.concurrency = 1
+        self.batch = None
+        self.profiles = []
+        self.top = 20
+        self.sort = "cumulative"
         self.inputs=[]
         self.keys=[]
 
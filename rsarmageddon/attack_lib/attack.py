@@ -18,8 +18,13 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>. #
 ##########################################################################
 
+import os
 import sys
+import json
+import time
+import atexit
 import signal
+import hashlib
 import multiprocessing
 
 from operator import itemgetter
@@ -32,10 +37,40 @@ import output
 
 name = None
 _default_key_name = None
+_state_dir = None
+_interactive = True
 
 
-def init(attack_name, default_key_name, *, min_keys=1, min_ciphertexts=0, deduplicate=None):
-    global name, _default_key_name
+def _parse_key(line):
+    n, e, keyname = line.split(",", maxsplit=2)
+    return int(n), int(e), keyname or None
+
+
+class KeyFile:
+    """Keys of the input file, parsed again at each iteration instead of
+    being kept in memory
+    """
+
+    def __init__(self, path, count):
+        self.path = path
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        with open(self.path, "r", encoding="ascii") as f:
+            for line in f:
+                kind, _, line = line.strip().partition(":")
+                if kind == "k":
+                    yield _parse_key(line)
+
+
+def init(attack_name, default_key_name, *, min_keys=1, min_ciphertexts=0, deduplicate=None, stream_keys=False, single_key=None):
+    global name, _default_key_name, _state_dir, _interactive
+
+    if stream_keys and deduplicate:
+        raise ValueError("Streamed keys cannot be deduplicated")
 
     name = attack_name
     _default_key_name = default_key_name
@@ -49,6 +84,7 @@ def init(attack_name, default_key_name, *, min_keys=1, min_ciphertexts=0, dedupl
 
     ciphertexts = []
     keys = []
+    key_count = 0
     color = "auto"
 
     with open(sys.argv[1], "r", encoding="ascii") as f:
@@ -58,18 +94,32 @@ def init(attack_name, default_key_name, *, min_keys=1, min_ciphertexts=0, dedupl
                 continue
             kind, _, line = line.partition(":")
             if kind == "k":
-                n, e, keyname = line.split(",", maxsplit=2)
-                keys.append((int(n), int(e), keyname or None))
+                if stream_keys:
+                    key_count += 1
+                else:
+                    keys.append(_parse_key(line))
             elif kind == "c":
                 text, textname = line.split(",", maxsplit=1)
                 ciphertexts.append((int(text), textname))
             elif kind == "C":
                 color = line.strip()
+            elif kind == "S":
+                _state_dir = line.strip()
+            elif kind == "N":
+                _interactive = False
             else:
                 raise ValueError("Unexpected input type '{}' from input file".input(kind))
 
     output.init(color)
 
+    if stream_keys:
+        keys = KeyFile(sys.argv[1], key_count)
+
+    # Exit cleanly when terminated, so that checkpoints and profiles are saved
+    signal.signal(signal.SIGTERM, _terminate)
+    if _state_dir is not None:
+        atexit.register(_flush_states)
+
     if deduplicate:
         if deduplicate in ("n", "ns"):
             cmp_key = itemgetter(0)
@@ -89,6 +139,12 @@ def init(attack_name, default_key_name, *, min_keys=1, min_ciphertexts=0, dedupl
     if len(ciphertexts) < min_ciphertexts:
         fail("This attack needs at least {} ciphertexts".format(min_ciphertexts))
 
+    # Attacks working on the first key only are run once per key
+    if single_key is None:
+        single_key = min_keys == 1 and not stream_keys
+    if single_key:
+        metric("single_key", 1)
+    metric("keys", len(keys))
     output.success("{} attack started".format(name))
     return ciphertexts, keys
 
@@ -115,7 +171,12 @@ _keys = []
 def keys(*keys):
     _keys.extend(keys)
     for _, _, d, p, q, *_ in keys:
-        for name, value in (("d", d), ("p", p), ("q", q)):
+        if isinstance(p, (tuple, list)):
+            # Multi-prime key: all factors are passed in place of p
+            values = (("d", d), ("primes", ", ".join(map(str, p))))
+        else:
+            values = (("d", d), ("p", p), ("q", q))
+        for name, value in values:
             if value is not None:
                 info("{}: {}".format(name, value))
 
@@ -136,6 +197,11 @@ def success():
             raise ValueError("Bad key '{}'".format(key))
         if len(key) == 5 or key[-1] is None:
             key = (*key[:5], next(auto_name))
+        n, e, d, p, q, key_name = key
+        if isinstance(p, (tuple, list)):
+            if q is not None or len(p) < 2:
+                raise ValueError("Bad key '{}'".format(key))
+            key = (n, e, d, *p, key_name)
         print("k:{}".format(",".join(str(x) if x is not None else "" for x in key)))
     for cleartext in _cleartexts:
         if isinstance(cleartext, int):
@@ -151,6 +217,13 @@ def success():
     sys.exit(0)
 
 
+@with_name_set
+def metric(metric_name, value):
+    if "," in metric_name or "\n" in metric_name:
+        raise ValueError("Bad metric name '{}'".format(metric_name))
+    print("m:{},{}".format(metric_name, value), flush=True)
+
+
 @with_name_set
 def fail(*s, bad_key=False):
     if s:
@@ -174,6 +247,77 @@ def positive_int(s):
     return i
 
 
+CHECKPOINT_INTERVAL = 30
+
+_main_pid = os.getpid()
+_pending_states = {}
+_last_flush = time.monotonic()
+
+
+def _state_path(n):
+    digest = hashlib.sha256("{}:{}".format(name, n).encode("ascii")).hexdigest()
+    return os.path.join(_state_dir, "{}.json".format(digest))
+
+
+def _normalize(obj):
+    return json.loads(json.dumps(obj, default=int))
+
+
+def _flush_states():
+    global _last_flush
+    if os.getpid() != _main_pid:
+        return
+    for n, (state, params) in _pending_states.items():
+        path = _state_path(n)
+        tmp_path = "{}.tmp".format(path)
+        with open(tmp_path, "w") as f:
+            json.dump({"params": params, "state": state}, f, default=int)
+        os.replace(tmp_path, path)
+    _pending_states.clear()
+    _last_flush = time.monotonic()
+
+
+def _terminate(signum, frame):
+    if os.getpid() != _main_pid:
+        os._exit(1)
+    sys.exit(1)
+
+
+@with_name_set
+def load_state(n, **params):
+    if _state_dir is None:
+        return None
+    try:
+        with open(_state_path(n), "r") as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if checkpoint.get("params") != _normalize(params):
+        return None
+    info("Resuming {} from checkpoint".format(name))
+    return checkpoint.get("state")
+
+
+@with_name_set
+def save_state(n, state, **params):
+    if _state_dir is None:
+        return
+    _pending_states[n] = (state, _normalize(params))
+    if time.monotonic() - _last_flush >= CHECKPOINT_INTERVAL:
+        _flush_states()
+
+
+@with_name_set
+def clear_state(n):
+    if _state_dir is None:
+        return
+    _pending_states.pop(n, None)
+    try:
+        os.remove(_state_path(n))
+    except FileNotFoundError:
+        pass
+
+
 _input = input
 @with_name_set
 def input(prompt=None, *, default=None, validator=None):
@@ -184,6 +328,11 @@ def input(prompt=None, *, default=None, validator=None):
     if validator is None:
         validator = lambda x: x
 
+    if not _interactive:
+        if default is None:
+            fail("{} is required but the attack is running non-interactively".format(prompt or "Input"))
+        return default
+
     while True:
         if prompt is not None:
             output.info(prompt, newline=False)
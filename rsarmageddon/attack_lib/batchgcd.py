@@ -0,0 +1,362 @@
+##########################################################################
+# RSArmageddon - RSA cryptography and cryptoanalysis toolkit             #
+# Copyright (C) 2020,2021                                                #
+# Vittorio Mignini a.k.a. M1gnus <vittorio.mignini@gmail.com>            #
+# Simone Cimarelli a.k.a. Aquilairreale <aquilairreale@ymail.com>        #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <https://www.gnu.org/licenses/>. #
+##########################################################################
+
+# Disk-backed batch GCD (D. J. Bernstein, "How to find smooth parts of
+# integers"), as used by Heninger et al. on internet-wide scans.
+#
+# Moduli are split into chunks small enough for their product to fit in
+# the memory budget. The product tree of every chunk is built level by
+# level, each level being a file of gmpy2 binary encoded integers that
+# is only accessed through short-lived memory maps. Then, for every pair
+# of chunks (i, j), the product of chunk j is reduced down the tree of
+# chunk i, and the leaf remainders are multiplied into an accumulator
+# holding P mod N^2, P being the product of all moduli. Finally
+# gcd((P mod N^2) / N, N) is the part of N shared with other moduli.
+#
+# Nodes of a level are processed in parallel; since the nodes being
+# processed at once never span more than one chunk, peak memory is a
+# small multiple of the chunk size whatever the number of processes.
+#
+# Disk usage is about (tree depth + 6) times the size of the moduli.
+#
+# Repeated moduli would all come out entirely shared, so they are found
+# beforehand with duplicates: digests of the moduli are hash partitioned
+# into bucket files small enough to be checked in memory one at a time.
+
+import os
+import mmap
+import hashlib
+
+from array import array
+from pathlib import Path
+from gmpy2 import mpz, gcd, to_binary, from_binary
+
+from attack import Pool
+
+
+DEFAULT_BUDGET = 1 << 30
+MEMORY_FACTOR = 8
+TASKS_PER_JOB = 4
+DIGEST_SIZE = 16
+DIGEST_MEMORY = 128
+MAX_BUCKETS = 256
+
+_UINT64 = array("Q").itemsize
+
+
+def _read(f, offset, length):
+    start = offset - offset % mmap.ALLOCATIONGRANULARITY
+    with mmap.mmap(f.fileno(), offset + length - start, offset=start, access=mmap.ACCESS_READ) as m:
+        return from_binary(m[offset-start:])
+
+
+def _write(f, offset, cap, value):
+    data = to_binary(value)
+    if len(data) > cap:
+        raise ValueError("Tree node does not fit in its slot")
+    start = offset - offset % mmap.ALLOCATIONGRANULARITY
+    with mmap.mmap(f.fileno(), offset + len(data) - start, offset=start, access=mmap.ACCESS_WRITE) as m:
+        m[offset-start:offset-start+len(data)] = data
+    return len(data)
+
+
+def _depth(count):
+    return (count - 1).bit_length()
+
+
+def _level_count(count, level):
+    return ((count - 1) >> level) + 1
+
+
+class _Tree:
+    """On-disk product tree of a chunk of moduli, plus the files holding
+    remainders and accumulators
+
+    Node j of level L covers leaves j*2^L to (j+1)*2^L - 1, so its slot in
+    every level file is found from the offsets of the leaves. Remainder
+    and accumulator slots are twice as large, as they hold values modulo
+    squares of nodes
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.offsets = array("Q")
+        with open(self.path/"offsets", "rb") as f:
+            self.offsets.frombytes(f.read())
+        self.count = len(self.offsets) - 1
+        self.depth = _depth(self.count)
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for f in self._files.values():
+            f.close()
+
+    def _file(self, name):
+        try:
+            return self._files[name]
+        except KeyError:
+            f = self._files[name] = open(self.path/name, "r+b")
+            return f
+
+    def level_count(self, level):
+        return _level_count(self.count, level)
+
+    def slot(self, level, j, scale=1):
+        lo = self.offsets[j << level]
+        hi = self.offsets[min((j + 1) << level, self.count)]
+        return scale*lo, scale*(hi - lo)
+
+    def read(self, name, level, j, scale=1):
+        lengths = self._file(f"{name}.len")
+        lengths.seek(_UINT64*j)
+        length = array("Q", lengths.read(_UINT64))[0]
+        offset, _ = self.slot(level, j, scale)
+        return _read(self._file(f"{name}.dat"), offset, length)
+
+    def write(self, name, level, j, value, scale=1):
+        offset, cap = self.slot(level, j, scale)
+        length = _write(self._file(f"{name}.dat"), offset, cap, value)
+        lengths = self._file(f"{name}.len")
+        lengths.seek(_UINT64*j)
+        lengths.write(array("Q", [length]).tobytes())
+
+    def product(self, level, j):
+        return self.read(f"prod{level}", level, j)
+
+    def root(self):
+        return self.product(self.depth, 0)
+
+
+def _allocate(path, size):
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+def _finish_chunk(path, offsets):
+    with open(path/"offsets", "wb") as f:
+        offsets.tofile(f)
+    count = len(offsets) - 1
+    total = offsets[-1]
+    for level in range(1, _depth(count) + 1):
+        _allocate(path/f"prod{level}.dat", total)
+        _allocate(path/f"prod{level}.len", _UINT64*_level_count(count, level))
+    for name in ("rem0", "rem1", "acc"):
+        _allocate(path/f"{name}.dat", 2*total)
+        _allocate(path/f"{name}.len", _UINT64*count)
+
+
+def _write_chunks(moduli, workdir, chunk_bytes):
+    """Write moduli to chunk directories as level 0 of their product
+    trees, and return a list of (directory, count) pairs
+    """
+    chunks = []
+    path = offsets = data = lengths = None
+    for n in moduli:
+        if data is None:
+            path = Path(workdir)/f"chunk{len(chunks)}"
+            path.mkdir()
+            offsets = array("Q", [0])
+            data = open(path/"prod0.dat", "wb")
+            lengths = open(path/"prod0.len", "wb")
+        n = to_binary(mpz(n))
+        data.write(n)
+        lengths.write(array("Q", [len(n)]).tobytes())
+        offsets.append(offsets[-1] + len(n))
+        if offsets[-1] >= chunk_bytes:
+            data.close()
+            lengths.close()
+            _finish_chunk(path, offsets)
+            chunks.append((path, len(offsets) - 1))
+            data = None
+    if data is not None:
+        data.close()
+        lengths.close()
+        _finish_chunk(path, offsets)
+        chunks.append((path, len(offsets) - 1))
+    return chunks
+
+
+def _product_task(task):
+    path, level, start, stop = task
+    with _Tree(path) as tree:
+        below = tree.level_count(level - 1)
+        for j in range(start, stop):
+            value = tree.product(level - 1, 2*j)
+            if 2*j + 1 < below:
+                value *= tree.product(level - 1, 2*j + 1)
+            tree.write(f"prod{level}", level, j, value)
+
+
+def _remainder_task(task):
+    path, other, level, start, stop, first = task
+    with _Tree(path) as tree:
+        if level == tree.depth:
+            with _Tree(other) as other_tree:
+                parents = [other_tree.root()]
+        for j in range(start, stop):
+            if level == tree.depth:
+                parent = parents[0]
+            else:
+                parent = tree.read(f"rem{(level + 1) % 2}", level + 1, j//2, scale=2)
+            node = tree.product(level, j)
+            square = node*node
+            rem = parent % square
+            if level == 0:
+                if not first:
+                    rem = rem*tree.read("acc", 0, j, scale=2) % square
+                tree.write("acc", 0, j, rem, scale=2)
+            else:
+                tree.write(f"rem{level % 2}", level, j, rem, scale=2)
+
+
+def _gcd_task(task):
+    path, start, stop = task
+    found = []
+    with _Tree(path) as tree:
+        for j in range(start, stop):
+            n = tree.product(0, j)
+            g = gcd(tree.read("acc", 0, j, scale=2) // n, n)
+            if g != 1:
+                found.append((j, int(g)))
+    return found
+
+
+def _slices(count, jobs):
+    tasks = min(count, jobs*TASKS_PER_JOB)
+    bounds = [count*i//tasks for i in range(tasks + 1)]
+    return zip(bounds, bounds[1:])
+
+
+def batch_gcd(moduli, workdir, budget=DEFAULT_BUDGET, jobs=None):
+    """Find moduli sharing a factor with other moduli
+
+    Yields (index, g) pairs, g being the product of the factors that the
+    index-th modulus shares with the others. g is equal to the modulus
+    when all of its factors are shared (e.g. with duplicates, which are
+    best left out beforehand, see duplicates), see shared_factor
+
+    Arguments:
+    moduli -- iterable of integers, read only once
+    workdir -- empty directory for tree files
+
+    Keyword arguments:
+    budget -- approximate memory budget in bytes
+    jobs -- number of worker processes (default: number of CPUs)
+    """
+    jobs = jobs or os.cpu_count() or 1
+    chunks = _write_chunks(moduli, workdir, max(budget // MEMORY_FACTOR, 1))
+
+    with Pool(jobs) as pool:
+        for path, count in chunks:
+            for level in range(1, _depth(count) + 1):
+                pool.map(_product_task, [
+                    (path, level, start, stop)
+                    for start, stop in _slices(_level_count(count, level), jobs)])
+
+        base = 0
+        for path, count in chunks:
+            for i, (other, _) in enumerate(chunks):
+                for level in reversed(range(_depth(count) + 1)):
+                    pool.map(_remainder_task, [
+                        (path, other, level, start, stop, i == 0)
+                        for start, stop in _slices(_level_count(count, level), jobs)])
+            tasks = [(path, start, stop) for start, stop in _slices(count, jobs)]
+            for found in pool.imap(_gcd_task, tasks):
+                for j, g in found:
+                    yield base + j, g
+            base += count
+
+
+class Bitmap:
+    """Set of integers in range(size), one bit each"""
+
+    def __init__(self, size):
+        self._bits = bytearray((size + 7) // 8)
+
+    def add(self, i):
+        self._bits[i >> 3] |= 1 << (i & 7)
+
+    def __contains__(self, i):
+        return bool(self._bits[i >> 3] >> (i & 7) & 1)
+
+
+def duplicates(moduli, workdir, count, budget=DEFAULT_BUDGET):
+    """Find moduli equal to an earlier one
+
+    Returns a Bitmap of their indices. Moduli are told apart by a 128 bit
+    digest, so only the bucket files of the digests are kept on disk
+
+    Arguments:
+    moduli -- iterable of integers, read only once
+    workdir -- empty directory for bucket files
+    count -- number of moduli
+
+    Keyword arguments:
+    budget -- approximate memory budget in bytes
+    """
+    buckets = min(max(count*DIGEST_MEMORY // max(budget, 1) + 1, 1), MAX_BUCKETS)
+    paths = [Path(workdir)/f"bucket{i}" for i in range(buckets)]
+    files = [open(path, "wb") for path in paths]
+    try:
+        for i, n in enumerate(moduli):
+            digest = hashlib.blake2b(to_binary(mpz(n)), digest_size=DIGEST_SIZE).digest()
+            files[digest[0] % buckets].write(digest + array("Q", [i]).tobytes())
+    finally:
+        for f in files:
+            f.close()
+
+    # Records of a bucket are in index order, the first of a digest is kept
+    repeated = Bitmap(count)
+    record_size = DIGEST_SIZE + _UINT64
+    for path in paths:
+        seen = set()
+        with open(path, "rb") as f:
+            while True:
+                record = f.read(record_size)
+                if len(record) < record_size:
+                    break
+                digest = record[:DIGEST_SIZE]
+                if digest in seen:
+                    repeated.add(array("Q", record[DIGEST_SIZE:])[0])
+                else:
+                    seen.add(digest)
+        path.unlink()
+    return repeated
+
+
+def shared_factor(n, moduli):
+    """Return a nontrivial factor of n shared with one of moduli, or None
+
+    Meant for the moduli batch_gcd reports as entirely shared, which are
+    rare enough to be checked one by one
+
+    Arguments:
+    n -- modulus
+    moduli -- iterable of integers
+    """
+    n = mpz(n)
+    for m in moduli:
+        g = gcd(n, m)
+        if g != 1 and g != n:
+            return int(g)
+    return None
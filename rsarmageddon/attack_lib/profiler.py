@@ -0,0 +1,46 @@
+##########################################################################
+# RSArmageddon - RSA cryptography and cryptoanalysis toolkit             #
+# Copyright (C) 2020,2021                                                #
+# Vittorio Mignini a.k.a. M1gnus <vittorio.mignini@gmail.com>            #
+# Simone Cimarelli a.k.a. Aquilairreale <aquilairreale@ymail.com>        #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <https://www.gnu.org/licenses/>. #
+##########################################################################
+
+# Usage: sage -python profiler.py OUTPUT_FILE SCRIPT [ARGS...]
+#
+# Runs a preparsed Sage script under cProfile and dumps the collected
+# stats to OUTPUT_FILE, preserving the script's exit status (unlike
+# python -m cProfile, which always exits successfully)
+
+import os
+import sys
+import runpy
+import cProfile
+
+
+def main():
+    outfile, script, *args = sys.argv[1:]
+    sys.argv = [script, *args]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(runpy.run_path, script, run_name="__main__")
+    finally:
+        profiler.dump_stats(outfile)
+
+
+if __name__ == "__main__":
+    main()
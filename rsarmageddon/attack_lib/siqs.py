@@ -0,0 +1,467 @@
+##########################################################################
+# RSArmageddon - RSA cryptography and cryptoanalysis toolkit             #
+# Copyright (C) 2020,2021                                                #
+# Vittorio Mignini a.k.a. M1gnus <vittorio.mignini@gmail.com>            #
+# Simone Cimarelli a.k.a. Aquilairreale <aquilairreale@ymail.com>        #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <https://www.gnu.org/licenses/>. #
+##########################################################################
+
+# Self-initialising quadratic sieve (Contini, "Factoring integers with
+# the self-initializing quadratic sieve"), with the single large prime
+# variation.
+#
+# Worker processes each pick a polynomial leading coefficient A at
+# random, sieve every polynomial (Ax + B)^2 - n that can be derived from
+# it, and send back the relations they found. The parent process pools
+# the relations of all the workers, pairs partial relations sharing a
+# large prime, and reduces each new full relation against the ones
+# collected so far (Gaussian elimination over GF(2) on bit vectors), so
+# that every dependency is tried for a factor as soon as it appears.
+#
+# Sieving uses numpy when available (it comes with Sage), and falls back
+# to a pure Python loop on a bytearray otherwise.
+
+import os
+import math
+import queue
+import random
+
+from gmpy2 import mpz, gcd, invert, isqrt, is_prime, is_square, legendre, next_prime
+
+from attack import Pool
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# (max digits, factor base size, sieve half width)
+PARAMETERS = (
+    (24, 100, 4096),
+    (30, 150, 8192),
+    (34, 200, 16384),
+    (38, 400, 32768),
+    (42, 600, 32768),
+    (46, 900, 65536),
+    (50, 1200, 65536),
+    (56, 2000, 65536),
+    (60, 3000, 98304),
+    (66, 4500, 131072),
+    (74, 8000, 196608),
+    (80, 16000, 262144),
+    (88, 30000, 393216),
+    (None, 50000, 524288),
+)
+
+# Primes below this are not sieved, the threshold is lowered instead
+SMALL_PRIME = 16
+# Leftover cofactors up to this many times the largest factor base prime
+# make partial relations
+LARGE_PRIME_FACTOR = 64
+# Tasks queued for each worker process
+TASKS_PER_JOB = 2
+# Sieve locations are bytes, larger numbers could overflow them
+MAX_BITS = 400
+# Primes hitting the sieve interval at most this many times are sieved
+# together (numpy only)
+LARGE_HITS = 32
+
+
+def parameters(n):
+    """Return the factor base size and sieve half width for n"""
+    digits = len(str(n))
+    for max_digits, size, m in PARAMETERS:
+        if max_digits is None or digits <= max_digits:
+            return size, m
+
+
+def sqrt_mod(a, p):
+    """Return a square root of a quadratic residue a modulo an odd prime
+    p (Tonelli-Shanks)
+    """
+    a %= p
+    if p % 4 == 3:
+        return int(pow(a, (p + 1) // 4, p))
+    q, s = p - 1, 0
+    while q % 2 == 0:
+        q //= 2
+        s += 1
+    z = 2
+    while legendre(z, p) != -1:
+        z += 1
+    m, c, t, r = s, pow(z, q, p), pow(a, q, p), pow(a, (q + 1) // 2, p)
+    while t != 1:
+        i, t2 = 0, t
+        while t2 != 1:
+            t2 = t2*t2 % p
+            i += 1
+        b = pow(c, 1 << (m - i - 1), p)
+        m, c, t, r = i, b*b % p, t*b*b % p, r*b % p
+    return int(r)
+
+
+def factor_base(n, size):
+    """Return the primes p up to the size-th one such that n is a square
+    modulo p, with a square root of n modulo each of them
+
+    Returns a (primes, roots) tuple, or (p, None) if a prime p of the
+    search divides n
+    """
+    primes = [2]
+    roots = [int(n % 2)]
+    p = 2
+    while len(primes) < size:
+        p = int(next_prime(p))
+        residue = legendre(n, p)
+        if residue == 0:
+            return p, None
+        if residue == 1:
+            primes.append(p)
+            roots.append(sqrt_mod(n, p))
+    return primes, roots
+
+
+def product(values):
+    """Return the product of values, multiplying balanced halves so that
+    large products stay fast
+    """
+    values = [mpz(v) for v in values]
+    if not values:
+        return mpz(1)
+    while len(values) > 1:
+        values = [
+            values[i]*values[i+1] if i + 1 < len(values) else values[i]
+            for i in range(0, len(values), 2)
+        ]
+    return values[0]
+
+
+# Worker process state, set by _init
+_n = None
+_primes = None
+_roots = None
+_logs = None
+_m = None
+_threshold = None
+_large_bound = None
+_a_range = None
+_a_count = None
+_hit_table = None
+
+
+def _init(n, primes, roots, m):
+    global _n, _primes, _roots, _logs, _m, _threshold, _large_bound, _a_range, _a_count, _hit_table
+    _n = mpz(n)
+    _primes = primes
+    _roots = roots
+    _logs = [round(math.log2(p)) for p in primes]
+    _m = m
+    _large_bound = primes[-1]*LARGE_PRIME_FACTOR
+
+    # Polynomial values are about m*sqrt(n/2); keep the locations where
+    # enough of that was sieved out for the rest to be a large prime at
+    # most, allowing for the small primes that are not sieved
+    skipped = sum(_logs[i] for i, p in enumerate(primes) if p < SMALL_PRIME)
+    _threshold = max(round(math.log2(m*isqrt(n // 2)) - math.log2(_large_bound) - skipped), 1)
+    _hit_table = bytes(1 if v >= _threshold else 0 for v in range(256))
+
+    # A is the product of primes from the upper part of the factor base,
+    # about sqrt(2n)/m in total
+    target = isqrt(2*n) // m
+    lo = max(len(primes) // 3, 1)
+    mid = primes[(lo + len(primes)) // 2]
+    _a_count = max(round(math.log(max(target, 2)) / math.log(mid)), 1)
+    _a_range = (lo, len(primes))
+
+
+def _choose_a(rng):
+    """Return the factor base indices of a random A close to the target"""
+    target = isqrt(2*_n) // _m
+    lo, hi = _a_range
+    best = None
+    for _ in range(32):
+        indices = rng.sample(range(lo, hi), min(_a_count, hi - lo))
+        a = product(_primes[i] for i in indices)
+        if best is None or abs(math.log(a / target)) < abs(math.log(best[0] / target)):
+            best = (a, indices)
+    return sorted(best[1])
+
+
+class _PythonSieve:
+    """Sieve of the polynomials of one A, in pure Python"""
+
+    def __init__(self, a, sieved, size):
+        self.sieved = sieved
+        self.size = size
+        self.primes = [_primes[i] for i in sieved]
+        self.ainv = [int(invert(a, p)) for p in self.primes]
+
+    def run(self, b):
+        """Sieve the polynomial of B = b and yield the locations worth
+        trial dividing, with the factor base indices of the sieved
+        primes dividing the polynomial there
+        """
+        primes = self.primes
+        soln1 = []
+        soln2 = []
+        for i, p, ainv in zip(self.sieved, primes, self.ainv):
+            r = _roots[i]
+            soln1.append(int(ainv*(r - b) + _m) % p)
+            soln2.append(int(ainv*(-r - b) + _m) % p)
+
+        size = self.size
+        sieve = bytearray(size)
+        for k, p in enumerate(primes):
+            log = _logs[self.sieved[k]]
+            for j in range(soln1[k], size, p):
+                sieve[j] += log
+            if soln2[k] != soln1[k]:
+                for j in range(soln2[k], size, p):
+                    sieve[j] += log
+
+        hits = sieve.translate(_hit_table)
+        j = hits.find(1)
+        while j != -1:
+            yield j, [
+                i for i, p, r1, r2 in zip(self.sieved, primes, soln1, soln2)
+                if (j - r1) % p == 0 or (j - r2) % p == 0
+            ]
+            j = hits.find(1, j + 1)
+
+
+class _NumpySieve:
+    """Sieve of the polynomials of one A, with numpy arrays
+
+    Primes with few hits in the interval are sieved all at once, the
+    others one slice each
+    """
+
+    def __init__(self, a, sieved, size):
+        self.size = size
+        self.sieved = numpy.array(sieved, dtype=numpy.int64)
+        primes = [_primes[i] for i in sieved]
+        self.primes = numpy.array(primes, dtype=numpy.int64)
+        self.roots = numpy.array([_roots[i] for i in sieved], dtype=numpy.int64)
+        self.logs = numpy.array([_logs[i] for i in sieved], dtype=numpy.uint8)
+        self.ainv = numpy.array([int(invert(a, p)) for p in primes], dtype=numpy.int64)
+        self.prime_list = primes
+        self.log_list = [_logs[i] for i in sieved]
+        self.large = int(numpy.searchsorted(self.primes, size // LARGE_HITS))
+        self.steps = numpy.arange(LARGE_HITS + 1, dtype=numpy.int64)
+
+    def run(self, b):
+        """Sieve the polynomial of B = b, see _PythonSieve.run"""
+        p = self.primes
+        b_mod = numpy.array([int(b % pk) for pk in self.prime_list], dtype=numpy.int64)
+        soln1 = (self.ainv*((self.roots - b_mod) % p) + _m) % p
+        soln2 = (self.ainv*((-self.roots - b_mod) % p) + _m) % p
+
+        size = self.size
+        sieve = numpy.zeros(size, dtype=numpy.uint8)
+        large = self.large
+        for pk, log, r1, r2 in zip(self.prime_list[:large], self.log_list[:large], soln1[:large].tolist(), soln2[:large].tolist()):
+            sieve[r1::pk] += log
+            if r2 != r1:
+                sieve[r2::pk] += log
+        for soln in (soln1, soln2):
+            hits = soln[self.large:, None] + p[self.large:, None]*self.steps
+            logs = numpy.broadcast_to(self.logs[self.large:, None], hits.shape)
+            inside = hits < size
+            sieve += numpy.bincount(hits[inside], weights=logs[inside], minlength=size).astype(numpy.uint8)
+
+        for j in numpy.flatnonzero(sieve >= _threshold).tolist():
+            divides = ((j - soln1) % p == 0) | ((j - soln2) % p == 0)
+            yield j, self.sieved[divides].tolist()
+
+
+def _sieve_task(seed):
+    """Sieve every polynomial of a random A
+
+    Returns a list of (u, v, vector, large_prime) relations, where
+    u^2 = v mod n, v is smooth over the factor base except for
+    large_prime (1 for full relations), and bit i of vector is the
+    parity of the exponent of the i-th factor base prime in v, bit
+    len(primes) being the sign
+    """
+    rng = random.Random(seed)
+    n, primes, roots, m = _n, _primes, _roots, _m
+
+    a_indices = _choose_a(rng)
+    a = product(primes[i] for i in a_indices)
+
+    # B_l = (A/q_l) * gamma_l, so that B^2 = n mod A for every B below
+    bs = []
+    for i in a_indices:
+        q = primes[i]
+        a_q = a // q
+        gamma = roots[i]*invert(a_q, q) % q
+        if gamma > q // 2:
+            gamma = q - gamma
+        bs.append(a_q*gamma)
+
+    # Small primes and the primes of A are not sieved, they are tried
+    # on every location
+    a_set = set(a_indices)
+    sieved = [i for i, p in enumerate(primes) if i not in a_set and p >= SMALL_PRIME]
+    others = [i for i, p in enumerate(primes) if i in a_set or p < SMALL_PRIME]
+    sieve = (_NumpySieve if numpy is not None else _PythonSieve)(a, sieved, 2*m + 1)
+
+    relations = []
+    # The 2^(s-1) polynomials of A are given by B = B_1 +- B_2 ... +- B_s
+    for signs in range(1 << (len(bs) - 1)):
+        b = bs[0] + sum(-bj if signs >> j & 1 else bj for j, bj in enumerate(bs[1:]))
+        c = (b*b - n) // a
+        for j, divisors in sieve.run(b):
+            relation = _check(j - m, a, b, c, a_set, divisors + others)
+            if relation is not None:
+                relations.append(relation)
+    return relations
+
+
+def _check(x, a, b, c, a_set, divisors):
+    """Trial divide the polynomial value at x by the given factor base
+    primes
+
+    Arguments:
+    x -- location in [-m, m]
+    a, b, c -- polynomial coefficients
+    a_set -- factor base indices of the primes of A
+    divisors -- factor base indices of the primes to try
+    """
+    q = a*x*x + 2*b*x + c
+    if q == 0:
+        return None
+    u = a*x + b
+    vector = 1 << len(_primes) if q < 0 else 0
+    rest = abs(q)
+    for i in divisors:
+        p = _primes[i]
+        exponent = 1 if i in a_set else 0
+        while rest % p == 0:
+            rest //= p
+            exponent += 1
+        if exponent & 1:
+            vector ^= 1 << i
+    if rest == 1:
+        return int(u), int(a*q), vector, 1
+    if rest < _large_bound and rest > _primes[-1]:
+        return int(u), int(a*q), vector, int(rest)
+    return None
+
+
+class _Relations:
+    """Relations pooled from the workers, with incremental elimination"""
+
+    def __init__(self, n):
+        self.n = mpz(n)
+        self.full = []
+        self.partial = {}
+        self.seen = set()
+        self.pivots = {}
+
+    def add(self, relation):
+        """Add a relation, returning a factor of n if a new dependency
+        yields one
+        """
+        u, v, vector, large = relation
+        if u in self.seen:
+            return None
+        self.seen.add(u)
+        if large != 1:
+            other = self.partial.get(large)
+            if other is None:
+                self.partial[large] = relation
+                return None
+            u2, v2, vector2, _ = other
+            u, v, vector = u*u2 % self.n, v*v2, vector ^ vector2
+
+        index = len(self.full)
+        self.full.append((u, v))
+        history = 1 << index
+        while vector:
+            top = vector.bit_length() - 1
+            pivot = self.pivots.get(top)
+            if pivot is None:
+                self.pivots[top] = (vector, history)
+                return None
+            vector ^= pivot[0]
+            history ^= pivot[1]
+        return self._try(history)
+
+    def _try(self, history):
+        members = [self.full[i] for i in range(history.bit_length()) if history >> i & 1]
+        x = 1
+        for u, _ in members:
+            x = x*u % self.n
+        y = isqrt(abs(product(v for _, v in members))) % self.n
+        g = gcd(x - y, self.n)
+        if 1 < g < self.n:
+            return int(g)
+        return None
+
+
+def siqs(n, jobs=None, progress=None, seed=None):
+    """Find a nontrivial factor of an odd composite number n
+
+    Arguments:
+    n -- integer to factor, neither prime nor a perfect power of a
+         prime is supported (other attacks catch those quickly)
+
+    Keyword arguments:
+    jobs -- number of sieving processes (default: number of CPUs)
+    progress -- function called with the number of full relations and
+                of the relations needed at worst, after every task
+    seed -- seed of the random choice of polynomials
+    """
+    n = mpz(n)
+    if n < 4 or is_prime(n):
+        raise ValueError("n must be composite")
+    if n.bit_length() > MAX_BITS:
+        raise ValueError(f"n is too large for the native sieve (more than {MAX_BITS} bits)")
+    if n % 2 == 0:
+        return 2
+    if is_square(n):
+        return int(isqrt(n))
+
+    size, m = parameters(n)
+    primes, roots = factor_base(n, size)
+    if roots is None:
+        return primes
+
+    jobs = jobs or os.cpu_count() or 1
+    rng = random.Random(seed)
+    relations = _Relations(n)
+    results = queue.Queue()
+    with Pool(jobs, initializer=_init, initargs=(int(n), primes, roots, m)) as pool:
+        def submit():
+            pool.apply_async(
+                    _sieve_task, (rng.getrandbits(64),),
+                    callback=results.put, error_callback=results.put)
+
+        for _ in range(TASKS_PER_JOB*jobs):
+            submit()
+
+        while True:
+            found = results.get()
+            if isinstance(found, BaseException):
+                raise found
+            submit()
+            for relation in found:
+                factor = relations.add(relation)
+                if factor is not None:
+                    return factor
+            if progress is not None:
+                progress(len(relations.full), len(primes) + 1)
@@ -21,10 +21,7 @@
 import os
 import re
 from pathlib import Path
-from importlib import resources
-from importlib.resources import contents, is_resource
-
-from . import builtin_attacks
+from contextlib import nullcontext
 
 
 suffix_re = re.compile(r"\.sage$")
@@ -39,20 +36,55 @@ def attack_name(s):
     return prefix_re.sub("", s).replace("\n", " ")
 
 
-builtin = {
-    attack_name(res): res
-    for res in sorted(contents(builtin_attacks))
-    if is_resource(builtin_attacks, res)
-        and res.endswith(".sage")
-}
+# Attack tables are built the first time they are needed, so commands
+# that never look at attacks don't pay for importlib.resources or for
+# scanning (and creating) attack directories
+_builtin = None
+_installed = None
+_skip_user = False
+_skip_system = False
+
+
+def builtin():
+    """Return a dict mapping builtin attack names to resource names"""
+    global _builtin
+    if _builtin is None:
+        from importlib.resources import contents, is_resource
+        from . import builtin_attacks
+        _builtin = {
+            attack_name(res): res
+            for res in sorted(contents(builtin_attacks))
+            if is_resource(builtin_attacks, res)
+                and res.endswith(".sage")
+        }
+    return _builtin
 
-installed = {}
 
 def load_installed(skip_user, skip_system):
+    """Select the directories installed attacks are searched in
+
+    Directories are scanned lazily, by the first call to installed
+
+    Arguments:
+    skip_user -- ignore the user's attack directory
+    skip_system -- ignore the system-wide attack directory
+    """
+    global _installed, _skip_user, _skip_system
+    _installed = None
+    _skip_user = skip_user
+    _skip_system = skip_system
+
+
+def installed():
+    """Return a dict mapping installed attack names to paths"""
+    global _installed
+    if _installed is not None:
+        return _installed
+
     path = []
 
     if os.name == "posix":
-        if not skip_user:
+        if not _skip_user:
             try:
                 cfg_dir = Path(os.environ["XDG_CONFIG_HOME"])
             except KeyError:
@@ -60,32 +92,33 @@ def load_installed(skip_user, skip_system):
             user_atk_dir = cfg_dir/"rsarmageddon"/"attacks"
             user_atk_dir.mkdir(parents=True, exist_ok=True)
             path.append(user_atk_dir)
-        if not skip_system:
+        if not _skip_system:
             sys_atk_dir = Path("/usr/share/rsarmageddon/attacks")
             path.append(sys_atk_dir)
-    elif os.name == "nt" and not skip_user:
+    elif os.name == "nt" and not _skip_user:
         app_data = Path(os.environ.get("LOCALAPPDATA", os.environ["APPDATA"]))
         user_atk_dir = app_data/"RSArmageddon"/"attacks"
         user_atk_dir.mkdir(parents=True, exist_ok=True)
         path.append(user_atk_dir)
 
-    installed = {
+    _installed = {
         attack_name(f): f
         for d in reversed(path)
         for f in sorted(d.glob("*.sage"))
         if f.is_file()
     }
+    return _installed
 
 
 def attack_path(name):
     try:
-        return installed[name]
+        return nullcontext(installed()[name])
     except KeyError:
         pass
     try:
-        return resources.path(builtin_attacks, builtin[name])
+        from importlib import resources
+        from . import builtin_attacks
+        return resources.path(builtin_attacks, builtin()[name])
     except KeyError:
         pass
     raise ValueError(f"There is no attack named '{name}'")
-
-
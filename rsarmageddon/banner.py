@@ -68,8 +68,8 @@ def print_credits():
 
 
 def print_attacks_short():
-    all_attacks = set(attacks.builtin)
-    all_attacks.update(attacks.installed)
+    all_attacks = set(attacks.builtin())
+    all_attacks.update(attacks.installed())
     for attack in sorted(all_attacks):
         print(attack)
 
@@ -86,10 +86,11 @@ def _print_attacks(header, attacks):
 
 def print_attacks():
     with redirect_stdout(sys.stderr):
-        _print_attacks("Builtin", attacks.builtin)
-        if attacks.installed:
+        _print_attacks("Builtin", attacks.builtin())
+        installed = attacks.installed()
+        if installed:
             print()
-            _print_attacks("Installed", attacks.installed)
+            _print_attacks("Installed", installed)
         print()
 
 
@@ -0,0 +1,157 @@
+##########################################################################
+# RSArmageddon - RSA cryptography and cryptoanalysis toolkit             #
+# Copyright (C) 2020,2021                                                #
+# Vittorio Mignini a.k.a. M1gnus <vittorio.mignini@gmail.com>            #
+# Simone Cimarelli a.k.a. Aquilairreale <aquilairreale@ymail.com>        #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <https://www.gnu.org/licenses/>. #
+##########################################################################
+
+import os
+import atexit
+import shutil
+import hashlib
+
+from pathlib import Path
+from importlib import resources
+from tempfile import TemporaryDirectory, mkdtemp
+
+from .utils import output, copy_resource_module, copy_resource_tree
+
+
+_cache_dir = None
+
+def cache_dir():
+    """Return RSArmageddon's cache directory, creating it if needed
+
+    Falls back to a temporary directory, removed at exit, when the user
+    cache directory is not writable
+    """
+    global _cache_dir
+    if _cache_dir is not None:
+        return _cache_dir
+
+    if os.name == "nt":
+        app_data = Path(os.environ.get("LOCALAPPDATA", os.environ["APPDATA"]))
+        path = app_data/"RSArmageddon"/"cache"
+    else:
+        try:
+            path = Path(os.environ["XDG_CACHE_HOME"])/"rsarmageddon"
+        except KeyError:
+            path = Path.home()/".cache"/"rsarmageddon"
+
+    try:
+        path.mkdir(parents=True, exist_ok=True)
+        if not os.access(path, os.W_OK):
+            raise PermissionError(f"Cannot write to {path}")
+    except OSError as e:
+        output.warning(f"Cannot use cache directory ({e}), caching to a temporary directory")
+        tmp = TemporaryDirectory(prefix="rsarmageddon-cache-")
+        atexit.register(tmp.cleanup)
+        path = Path(tmp.name)
+
+    _cache_dir = path
+    return path
+
+
+def checksum(*parts):
+    """Return the hex SHA-256 digest of a sequence of str or bytes parts
+
+    Arguments:
+    parts -- str or bytes objects
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+    return h.hexdigest()
+
+
+def cached_file(kind, key, suffix, create):
+    """Return the path of a cached file, creating it on a cache miss
+
+    The file is created by create(path) at a temporary path, then moved
+    in place atomically, so concurrent runs never see partial files
+
+    Arguments:
+    kind -- cache subdirectory
+    key -- content address of the file
+    suffix -- file name suffix
+    create -- function writing the file to the path it is given
+    """
+    path = cache_dir()/kind/f"{key}{suffix}"
+    if path.is_file():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(mkdtemp(dir=path.parent, prefix=".tmp-"))
+    try:
+        tmp = tmp_dir/path.name
+        create(tmp)
+        os.replace(tmp, path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return path
+
+
+def cached_dir(kind, key, create):
+    """Return the path of a cached directory, creating it on a cache miss
+
+    The directory is filled by create(path) at a temporary path, then
+    renamed in place; if a concurrent run got there first its copy is kept
+
+    Arguments:
+    kind -- cache subdirectory
+    key -- content address of the directory
+    create -- function filling the directory at the path it is given
+    """
+    path = cache_dir()/kind/key
+    if path.is_dir():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(mkdtemp(dir=path.parent, prefix=".tmp-"))
+    try:
+        create(tmp)
+        os.chmod(tmp, 0o755)
+        os.rename(tmp, path)
+    except OSError:
+        if not path.is_dir():
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return path
+
+
+def staged_libs(modules=(), trees=()):
+    """Return a cached directory holding copies of modules and packages,
+    to be put in the PYTHONPATH of Sage scripts
+
+    Arguments:
+    modules -- iterable of (package, module name) tuples
+    trees -- iterable of packages copied as a whole, keyed by version
+    """
+    modules = list(modules)
+    trees = list(trees)
+    key = checksum(
+            *(resources.read_binary(package, f"{module}.py") for package, module in modules),
+            *(f"{tree.__name__}-{getattr(tree, '__version__', '')}" for tree in trees))
+
+    def create(dest):
+        for package, module in modules:
+            copy_resource_module(package, module, dest)
+        for tree in trees:
+            copy_resource_tree(tree, dest)
+
+    return cached_dir("lib", key, create)
@@ -18,8 +18,10 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>. #
 ##########################################################################
 
+import os
 import sys
 import json
+import binascii
 
 from contextlib import redirect_stdout
 from pathlib import Path
@@ -27,7 +29,7 @@ from pathlib import Path
 from gmpy2 import invert
 from Crypto.PublicKey import RSA
 
-from .utils import output, DEFAULT_E
+from .utils import output, imap_chunked, compute_crt_elements, DEFAULT_E
 
 
 common_formats = {
@@ -79,7 +81,7 @@ def generate_key(e=None):
     return key.n, key.e, key.d, key.p, key.q
 
 
-def print_key(n=None, e=None, d=None, p=None, q=None, dp=None, dq=None, pinv=None, qinv=None):
+def print_key(n=None, e=None, d=None, p=None, q=None, dp=None, dq=None, pinv=None, qinv=None, other_primes=()):
     """Print key elements in a more readable format
 
     Keyword arguments:
@@ -92,6 +94,7 @@ def print_key(n=None, e=None, d=None, p=None, q=None, dp=None, dq=None, pinv=Non
     dq
     pinv
     qinv
+    other_primes -- additional factors of multi-prime keys
     file -- file-like object
     """
     output.primary(f"n: {n}")
@@ -99,6 +102,8 @@ def print_key(n=None, e=None, d=None, p=None, q=None, dp=None, dq=None, pinv=Non
     output.primary(f"d: {d}")
     output.primary(f"p: {p}")
     output.primary(f"q: {q}")
+    for i, r in enumerate(other_primes, 3):
+        output.primary(f"r{i}: {r}")
     output.newline()
     output.secondary(f"dp: {dp}")
     output.secondary(f"dq: {dq}")
@@ -107,8 +112,10 @@ def print_key(n=None, e=None, d=None, p=None, q=None, dp=None, dq=None, pinv=Non
     output.newline()
 
 
-def print_key_json(n=None, e=None, d=None, p=None, q=None, dp=None, dq=None, pinv=None, qinv=None):
-    d = {k: str(v) for k, v in locals().items()}
+def print_key_json(n=None, e=None, d=None, p=None, q=None, dp=None, dq=None, pinv=None, qinv=None, other_primes=()):
+    d = {k: str(v) for k, v in locals().items() if k != "other_primes"}
+    if other_primes:
+        d["other_primes"] = [str(r) for r in other_primes]
     json.dump(d, sys.stdout, indent=4)
     print()
 
@@ -121,8 +128,17 @@ def load_key(path):
     """
 
     # obtain a RsaKey object from the key file: https://pycryptodome.readthedocs.io/en/latest/src/public_key/rsa.html 
-    keyfile = open(path, "rb")
-    key = RSA.importKey(keyfile.read())
+    with open(path, "rb") as keyfile:
+        data = keyfile.read()
+    try:
+        key = RSA.importKey(data)
+    except ValueError:
+        # pycryptodome does not support multi-prime keys
+        try:
+            return parse_multiprime_privkey(data)
+        except ValueError:
+            pass
+        raise
 
     # If the key is a private key dump the private key values
     if key.has_private():
@@ -131,29 +147,439 @@ def load_key(path):
         return key.n, key.e, None, None, None
 
 
-def load_keys(path, exts=("pem", "pub"), recursive=False):
+DER_INTEGER = 0x02
+DER_BIT_STRING = 0x03
+DER_OCTET_STRING = 0x04
+DER_OID = 0x06
+DER_SEQUENCE = 0x30
+
+RSA_ENCRYPTION_OID = bytes.fromhex("2a864886f70d010101") # 1.2.840.113549.1.1.1
+
+
+def der_element(data, offset=0):
+    """Locate the DER element starting at offset
+
+    Returns a (tag, start, end) tuple, where data[start:end] is the
+    element's content
+
+    Arguments:
+    data -- bytes-like object holding DER data
+    offset -- position of the element's tag byte
+    """
+    if offset + 2 > len(data):
+        raise ValueError("Truncated DER element")
+    tag = data[offset]
+    length = data[offset+1]
+    start = offset + 2
+    if tag & 0x1f == 0x1f:
+        raise ValueError("Unsupported DER tag")
+    if length & 0x80:
+        length_size = length & 0x7f
+        if not 0 < length_size <= 8:
+            raise ValueError("Unsupported DER length")
+        length = int.from_bytes(data[start:start+length_size], "big")
+        start += length_size
+    end = start + length
+    if end > len(data):
+        raise ValueError("Truncated DER element")
+    return tag, start, end
+
+
+def der_children(data, start, end):
+    """Return the (tag, start, end) tuples of the elements in data[start:end]
+
+    Arguments:
+    data -- bytes-like object holding DER data
+    start -- position of the first element
+    end -- end of the constructed element's content
+    """
+    children = []
+    while start < end:
+        child = der_element(data, start)
+        children.append(child)
+        start = child[2]
+    return children
+
+
+def der_integer(data, element):
+    """Decode a DER INTEGER element
+
+    Arguments:
+    data -- bytes-like object holding DER data
+    element -- (tag, start, end) tuple as returned by der_element
+    """
+    tag, start, end = element
+    if tag != DER_INTEGER:
+        raise ValueError("Expected a DER INTEGER")
+    return int.from_bytes(data[start:end], "big", signed=True)
+
+
+def parse_pubkey_der(data):
+    """Extract n and e from a DER encoded RSA key without fully importing it
+
+    Understands SubjectPublicKeyInfo, PKCS#1 RSAPublicKey, X.509 Certificate
+    and unencrypted PKCS#1 RSAPrivateKey and PKCS#8 PrivateKeyInfo structures
+
+    Arguments:
+    data -- bytes-like object holding DER data
+    """
+    return _parse_pubkey_element(data, der_element(data))
+
+
+def _parse_pubkey_element(data, element):
+    tag, start, end = element
+    if tag != DER_SEQUENCE:
+        raise ValueError("Expected a DER SEQUENCE")
+    children = der_children(data, start, end)
+    if not children:
+        raise ValueError("Empty DER SEQUENCE")
+
+    first_tag = children[0][0]
+    if first_tag == DER_INTEGER and len(children) == 2:
+        # RSAPublicKey ::= SEQUENCE { modulus, publicExponent }
+        return der_integer(data, children[0]), der_integer(data, children[1])
+    if first_tag == DER_INTEGER and len(children) >= 9:
+        # RSAPrivateKey ::= SEQUENCE { version, modulus, publicExponent, ... }
+        return der_integer(data, children[1]), der_integer(data, children[2])
+    if first_tag == DER_SEQUENCE and len(children) == 3 and children[2][0] == DER_BIT_STRING:
+        # Certificate ::= SEQUENCE { tbsCertificate, signatureAlgorithm, signatureValue }
+        _, tbs_start, tbs_end = children[0]
+        tbs = der_children(data, tbs_start, tbs_end)
+        spki = 6 if tbs and tbs[0][0] == 0xa0 else 5 # skip the optional explicit version
+        if len(tbs) <= spki:
+            raise ValueError("Truncated certificate")
+        return _parse_pubkey_element(data, tbs[spki])
+    if first_tag == DER_INTEGER and len(children) >= 3 and children[2][0] == DER_OCTET_STRING:
+        # PrivateKeyInfo ::= SEQUENCE { version, algorithm, privateKey, ... }
+        algorithm, key = children[1:3]
+    elif first_tag == DER_SEQUENCE and len(children) == 2 and children[1][0] == DER_BIT_STRING:
+        # SubjectPublicKeyInfo ::= SEQUENCE { algorithm, subjectPublicKey }
+        algorithm, key = children
+    else:
+        raise ValueError("Unrecognized DER key structure")
+
+    _, alg_start, alg_end = algorithm
+    alg = der_children(data, alg_start, alg_end)
+    if not alg or alg[0][0] != DER_OID or data[alg[0][1]:alg[0][2]] != RSA_ENCRYPTION_OID:
+        raise ValueError("Not an RSA key")
+
+    key_tag, key_start, key_end = key
+    if key_tag == DER_BIT_STRING:
+        if data[key_start:key_start+1] != b"\x00":
+            raise ValueError("Bad DER BIT STRING")
+        key_start += 1
+    return parse_pubkey_der(memoryview(data)[key_start:key_end])
+
+
+def der_encode(tag, content):
+    """Encode a DER element
+
+    Arguments:
+    tag -- tag byte
+    content -- bytes-like object
+    """
+    length = len(content)
+    if length < 0x80:
+        header = bytes((tag, length))
+    else:
+        length_bytes = length.to_bytes(-(length.bit_length() // -8), "big")
+        header = bytes((tag, 0x80 | len(length_bytes))) + length_bytes
+    return header + bytes(content)
+
+
+def der_encode_integer(x):
+    """Encode a non negative int as a DER INTEGER
+
+    Arguments:
+    x -- int
+    """
+    return der_encode(DER_INTEGER, int(x).to_bytes(x.bit_length() // 8 + 1, "big"))
+
+
+def encode_multiprime_der(n, e, d, primes):
+    """Encode a multi-prime PKCS#1 v2 RSAPrivateKey to DER
+
+    Arguments:
+    n -- RSA modulus
+    e -- RSA public exponent
+    d -- RSA private exponent
+    primes -- list of at least three distinct primes, p and q first
+    """
+    (p, dp, _), (q, dq, qinv), *others = compute_crt_elements(d, primes)
+    other_infos = b"".join(
+            der_encode(DER_SEQUENCE, b"".join(map(der_encode_integer, info)))
+            for info in others)
+    fields = [der_encode_integer(x) for x in (1, n, e, d, p, q, dp, dq, qinv)]
+    fields.append(der_encode(DER_SEQUENCE, other_infos))
+    return der_encode(DER_SEQUENCE, b"".join(fields))
+
+
+def parse_multiprime_privkey(data):
+    """Decode a PEM or DER multi-prime PKCS#1 v2 RSAPrivateKey, optionally
+    wrapped in an unencrypted PKCS#8 PrivateKeyInfo
+
+    Returns a (n, e, d, p, q, *other_primes) tuple
+
+    Arguments:
+    data -- bytes object holding the PEM or DER encoded key
+    """
+    if data.lstrip().startswith(b"-----BEGIN "):
+        blocks = pem_blocks(data.decode("ascii", errors="replace").splitlines())
+        label, body = next(blocks, (None, None))
+        if label not in ("RSA PRIVATE KEY", "PRIVATE KEY"):
+            raise ValueError("Not a private key")
+        data = pem_decode(body)
+    tag, start, end = der_element(data)
+    if tag != DER_SEQUENCE:
+        raise ValueError("Expected a DER SEQUENCE")
+    children = der_children(data, start, end)
+    if len(children) >= 3 and children[1][0] == DER_SEQUENCE and children[2][0] == DER_OCTET_STRING:
+        # PrivateKeyInfo ::= SEQUENCE { version, algorithm, privateKey, ... }
+        _, key_start, key_end = children[2]
+        data = memoryview(data)[key_start:key_end]
+        tag, start, end = der_element(data)
+        if tag != DER_SEQUENCE:
+            raise ValueError("Expected a DER SEQUENCE")
+        children = der_children(data, start, end)
+    if len(children) != 10 or der_integer(data, children[0]) != 1:
+        raise ValueError("Not a multi-prime private key")
+    n, e, d, p, q = (der_integer(data, child) for child in children[1:6])
+    other_primes = []
+    tag, start, end = children[9]
+    for info_tag, info_start, info_end in der_children(data, start, end):
+        info = der_children(data, info_start, info_end)
+        if info_tag != DER_SEQUENCE or len(info) != 3:
+            raise ValueError("Bad OtherPrimeInfo")
+        other_primes.append(der_integer(data, info[0]))
+    product = p*q
+    for r in other_primes:
+        product *= r
+    if not other_primes or product != n:
+        raise ValueError("Inconsistent multi-prime private key")
+    return (n, e, d, p, q, *other_primes)
+
+
+def pem_encode(label, der):
+    """Encode DER data as a PEM block
+
+    Arguments:
+    label -- PEM label
+    der -- bytes-like object
+    """
+    body = binascii.b2a_base64(bytes(der), newline=False).decode("ascii")
+    lines = [f"-----BEGIN {label}-----"]
+    lines.extend(body[i:i+64] for i in range(0, len(body), 64))
+    lines.append(f"-----END {label}-----")
+    return "\n".join(lines).encode("ascii")
+
+
+def pem_blocks(lines):
+    """Yield (label, body) pairs for each PEM block in an iterable of lines
+
+    Body is the undecoded base64 text, headers are returned as part of it
+
+    Arguments:
+    lines -- iterable of str lines
+    """
+    label = None
+    body = []
+    for line in lines:
+        line = line.strip()
+        if label is None:
+            if line.startswith("-----BEGIN ") and line.endswith("-----"):
+                label = line[11:-5]
+                body = []
+        elif line.startswith("-----END "):
+            yield label, "".join(body)
+            label = None
+        else:
+            body.append(line)
+
+
+def pem_decode(body):
+    """Decode the base64 body of a PEM block
+
+    Arguments:
+    body -- base64 text as returned by pem_blocks
+    """
+    if ":" in body:
+        raise ValueError("PEM headers are not supported (encrypted key?)")
+    try:
+        return binascii.a2b_base64(body)
+    except binascii.Error as e:
+        raise ValueError(str(e)) from e
+
+
+def parse_pubkey(data):
+    """Extract n and e from a key file's contents
+
+    Falls back to a full import through pycryptodome for anything the
+    lightweight DER parser does not understand
+
+    Arguments:
+    data -- bytes object holding a PEM or DER encoded key
+    """
+    try:
+        if data.lstrip().startswith(b"-----BEGIN "):
+            blocks = pem_blocks(data.decode("ascii").splitlines())
+            _, body = next(blocks)
+            der = pem_decode(body)
+        else:
+            der = data
+        return parse_pubkey_der(der)
+    except (ValueError, StopIteration):
+        key = RSA.importKey(data)
+        return key.n, key.e
+
+
+def load_pubkey(path):
+    """Load n and e from a key file
+
+    Arguments:
+    path -- path to a key file
+    """
+    with open(path, "rb") as keyfile:
+        return parse_pubkey(keyfile.read())
+
+
+def _load_pubkeys(paths):
+    return [(load_pubkey(path), Path(path).stem) for path in paths]
+
+
+def scan_key_files(path, exts=("pem", "pub"), recursive=False):
+    """Yield paths of key files found in a directory
+
+    Arguments:
+    path -- path to keys directory
+    exts -- iterable of file extensions
+    recursive -- descend into subdirectories
+    """
+    exts = tuple(ext if ext.startswith(".") else f".{ext}" for ext in exts)
+    dirs = [path]
+    while dirs:
+        with os.scandir(dirs.pop()) as it:
+            for entry in it:
+                if entry.is_dir():
+                    if recursive:
+                        dirs.append(entry.path)
+                elif entry.name.endswith(exts) and entry.is_file():
+                    yield entry.path
+
+
+def load_keys(path, exts=("pem", "pub"), recursive=False, jobs=None):
     """Load key elements from keys found in a directory
 
+    Keys are yielded as soon as they are read, files are parsed by a pool
+    of worker processes unless the directory holds only a few of them
+
     Arguments:
     path -- path to keys directory
     exts -- iterable of file extensions
+    recursive -- descend into subdirectories
+    jobs -- number of worker processes (default: number of CPUs)
     """
+    paths = scan_key_files(path, exts, recursive)
+    yield from imap_chunked(_load_pubkeys, paths, jobs=jobs)
+
+
+PEM_KEY_LABELS = {
+    "PUBLIC KEY",
+    "RSA PUBLIC KEY",
+    "RSA PRIVATE KEY",
+    "PRIVATE KEY",
+    "CERTIFICATE",
+    "TRUSTED CERTIFICATE",
+    "X509 CERTIFICATE"
+}
+
+
+def _parse_pem_blocks(blocks):
     keys = []
+    for name, label, body in blocks:
+        try:
+            keys.append((parse_pubkey_der(pem_decode(body)), name))
+        except ValueError as e:
+            output.warning(f"Skipping {label} block {name}: {e}")
+    return keys
+
+
+def load_pem_bundle(path, jobs=None):
+    """Load n and e from every key and certificate in a PEM bundle
+
+    The bundle is read as a stream of concatenated PEM blocks, which are
+    decoded by a pool of worker processes and yielded as ((n, e), name)
+    tuples. Blocks that do not hold an RSA key are skipped with a warning
+
+    Arguments:
+    path -- path to the bundle file
+    jobs -- number of worker processes (default: number of CPUs)
+    """
     path = Path(path)
 
-    for ext in exts:
-        if not ext.startswith("."):
-            ext = f".{ext}"
+    def blocks():
+        with open(path, "r", encoding="ascii", errors="replace") as f:
+            for i, (label, body) in enumerate(pem_blocks(f)):
+                name = f"{path.stem}_{i}"
+                if label not in PEM_KEY_LABELS:
+                    output.warning(f"Skipping {label} block {name}")
+                    continue
+                yield name, label, body
 
-        pattern = f"*{ext}"
-        if recursive:
-            pattern = f"**/{pattern}"
+    yield from imap_chunked(_parse_pem_blocks, blocks(), jobs=jobs)
 
-        for key_file in path.glob(pattern):
-            n, e, _, _, _ = load_key(key_file)
-            keys.append(((n, e), key_file.stem))
 
-    return keys
+SSH_RSA = b"ssh-rsa"
+
+
+def parse_ssh_pubkey(blob):
+    """Extract n and e from an OpenSSH wire format ssh-rsa public key
+
+    Arguments:
+    blob -- decoded base64 blob of an OpenSSH public key
+    """
+    fields = []
+    offset = 0
+    while offset < len(blob) and len(fields) < 3:
+        length = int.from_bytes(blob[offset:offset+4], "big")
+        offset += 4
+        if offset + length > len(blob):
+            raise ValueError("Truncated OpenSSH public key")
+        fields.append(blob[offset:offset+length])
+        offset += length
+    if len(fields) != 3 or fields[0] != SSH_RSA:
+        raise ValueError("Not an ssh-rsa public key")
+    _, e, n = fields
+    return int.from_bytes(n, "big"), int.from_bytes(e, "big")
+
+
+def load_authorized_keys(path):
+    """Load n and e from the ssh-rsa keys in an authorized_keys file
+
+    Works for known_hosts files as well, since the key type is looked up
+    anywhere in the line. Keys of other types are silently skipped. The
+    key comment, if any, is used as key name
+
+    Arguments:
+    path -- path to an authorized_keys file
+    """
+    path = Path(path)
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for lineno, line in enumerate(f, 1):
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            try:
+                i = fields.index(SSH_RSA.decode("ascii"))
+                blob = binascii.a2b_base64(fields[i+1])
+            except (ValueError, IndexError, binascii.Error):
+                continue
+            try:
+                key = parse_ssh_pubkey(blob)
+            except ValueError as e:
+                output.warning(f"Skipping line {lineno} of {path}: {e}")
+                continue
+            comment = " ".join(fields[i+2:])
+            yield key, comment or f"{path.stem}_{lineno}"
 
 
 file_formats = {
@@ -185,8 +611,8 @@ def encode_pubkey(n, e, file_format):
         raise ValueError(f"Cannot create a public key file (key data is incomplete): {(n, e)}") from e
 
 
-def encode_privkey(n, e, d, p, q, file_format):
-    """Encode a public key to file_format
+def encode_privkey(n, e, d, p, q, *other_primes, file_format):
+    """Encode a private key to file_format
 
     Arguments:
     n -- RSA modulus
@@ -194,6 +620,7 @@ def encode_privkey(n, e, d, p, q, file_format):
     d -- RSA private exponent
     p -- RSA first factor
     q -- RSA second factor
+    other_primes -- RSA additional factors of multi-prime keys
     file_format -- file format
     """
     file_format = file_formats[file_format.casefold()]
@@ -205,7 +632,18 @@ def encode_privkey(n, e, d, p, q, file_format):
             "p": str(p),
             "q": str(q)
         }
+        if other_primes:
+            data["other_primes"] = [str(r) for r in other_primes]
         return json.dumps(data, indent=4).encode("ascii")
+    if other_primes:
+        if None in (n, e, d, p, q, *other_primes):
+            raise ValueError(f"Cannot create a private key file (key data is incomplete): {(n, e, d, p, q, *other_primes)}")
+        der = encode_multiprime_der(n, e, d, (p, q, *other_primes))
+        if file_format == "DER":
+            return der
+        if file_format == "PEM":
+            return pem_encode("RSA PRIVATE KEY", der)
+        raise ValueError(f"Multi-prime keys cannot be encoded to {file_format}")
     try:
         return RSA.construct((n, e, d, p, q)).exportKey(format=file_format)
     except NotImplementedError as exc:
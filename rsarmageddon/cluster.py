@@ -0,0 +1,167 @@
+##########################################################################
+# RSArmageddon - RSA cryptography and cryptoanalysis toolkit             #
+# Copyright (C) 2020,2021                                                #
+# Vittorio Mignini a.k.a. M1gnus <vittorio.mignini@gmail.com>            #
+# Simone Cimarelli a.k.a. Aquilairreale <aquilairreale@ymail.com>        #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <https://www.gnu.org/licenses/>. #
+##########################################################################
+
+# Coordinator/worker protocol: JSON objects, one per line, over plain TCP
+#
+#   worker -> coordinator  {"type": "hello", "worker": NAME}
+#   coordinator -> worker  {"type": "shard", "id": ID, "attacks": [...],
+#                           "keys": [[n, e, name], ...],
+#                           "ciphertexts": [[text, name], ...],
+#                           "timeout": SECONDS, "metrics": BOOL}
+#   worker -> coordinator  {"type": "heartbeat"}, while attacking
+#   worker -> coordinator  {"type": "result", "id": ID, "results":
+#                           [{"attack": ..., "returncode": ...,
+#                             "output": ..., "metrics": ...}, ...]}
+#   coordinator -> worker  {"type": "done"}, when there is nothing left
+#
+# Integers are sent as strings, attack outputs as written by the attack
+# scripts. There is no authentication: only run workers and coordinators
+# on trusted networks
+
+import json
+import socket
+
+from threading import Thread, Event, Lock, Condition
+from collections import deque
+
+
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TIMEOUT = 60
+
+
+class Connection:
+    """JSON lines message stream over a socket, safe to send from
+    multiple threads
+    """
+
+    def __init__(self, sock, timeout=None):
+        sock.settimeout(timeout)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.sock = sock
+        self._reader = sock.makefile("r", encoding="utf-8", newline="\n")
+        self._send_lock = Lock()
+
+    def send(self, message):
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        with self._send_lock:
+            self.sock.sendall(data)
+
+    def receive(self):
+        """Return the next message, raising ConnectionError if the peer
+        went away
+        """
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by peer")
+        try:
+            return json.loads(line)
+        except ValueError:
+            raise ConnectionError("Malformed message") from None
+
+    def close(self):
+        self._reader.close()
+        self.sock.close()
+
+
+class Heartbeat:
+    """Send heartbeats on a connection from a background thread, so that
+    the peer can tell a long attack from a dead worker
+    """
+
+    def __init__(self, connection, interval=HEARTBEAT_INTERVAL):
+        self.connection = connection
+        self.interval = interval
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.connection.send({"type": "heartbeat"})
+            except OSError:
+                break
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class ShardQueue:
+    """Hand out shards to workers, taking back the ones of workers that
+    went away
+
+    Shards are drawn lazily from an iterable; requeued shards are handed
+    out first
+    """
+
+    def __init__(self, shards):
+        self._shards = enumerate(shards)
+        self._requeued = deque()
+        self._assigned = {}
+        self._exhausted = False
+        self._cond = Condition()
+        self.requeues = 0
+
+    def get(self):
+        """Return an (id, shard) tuple, blocking while all remaining shards
+        are assigned, or None when every shard has been completed
+        """
+        with self._cond:
+            while True:
+                if self._requeued:
+                    shard_id, shard = self._requeued.popleft()
+                    break
+                if not self._exhausted:
+                    try:
+                        shard_id, shard = next(self._shards)
+                        break
+                    except StopIteration:
+                        self._exhausted = True
+                if not self._assigned:
+                    self._cond.notify_all()
+                    return None
+                self._cond.wait()
+            self._assigned[shard_id] = shard
+            return shard_id, shard
+
+    def complete(self, shard_id):
+        with self._cond:
+            self._assigned.pop(shard_id, None)
+            self._cond.notify_all()
+
+    def requeue(self, shard_id):
+        with self._cond:
+            shard = self._assigned.pop(shard_id)
+            self._requeued.append((shard_id, shard))
+            self.requeues += 1
+            self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """Wait until every shard has been completed or timeout expires,
+        return whether every shard has been completed
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                    lambda: self._exhausted and not self._requeued and not self._assigned,
+                    timeout)
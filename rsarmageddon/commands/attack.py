@@ -19,32 +19,53 @@
 ##########################################################################
 
 import os
+import re
 import sys
+import json
+import queue
+import hashlib
 import colorama
 
 from pathlib import Path
-from tempfile import NamedTemporaryFile, TemporaryDirectory
-from itertools import chain
-from contextlib import redirect_stdout
+from tempfile import NamedTemporaryFile
+from itertools import chain, islice
+from functools import partial
+from contextlib import redirect_stdout, ExitStack
+from threading import Thread
 from subprocess import TimeoutExpired
+from socketserver import ThreadingTCPServer, BaseRequestHandler
 
 from .. import sage
+from .. import cache
 from .. import utils
+from .. import cluster
+from .. import metrics
 from .. import attack_lib
 from ..args import args
-from ..certs import encode_privkey, load_key, load_keys
+from ..certs import encode_privkey, load_pubkey, load_keys, load_pem_bundle, load_authorized_keys
 from ..crypto import uncipher
 from ..attacks import attack_path, builtin, installed
-from ..parsing import parse_n_e_file
+from ..parsing import parse_n_e_file, parse_jsonl_file
+from ..primepool import PrimePool, key_primes
 from ..utils import (
         output, DEFAULT_E, to_bytes_auto, output_text,
         compute_d, complete_privkey, int_from_path,
-        compute_d, copy_resource_module, copy_resource_tree)
+        imap_chunked)
+
+
+def parse_metric(value):
+    for conv in (int, float):
+        try:
+            return conv(value)
+        except ValueError:
+            pass
+    return value
 
 
 def parse_output(s):
     cleartexts = []
     keys = []
+    metrics = {}
     for line in s.splitlines():
         line = line.strip()
         if not line:
@@ -57,12 +78,321 @@ def parse_output(s):
             *key, name = value.split(",")
             key = tuple(int(x) if x else None for x in key)
             keys.append((key, name or None))
+        elif kind == "m":
+            metric, _, metric_value = value.partition(",")
+            metrics[metric] = parse_metric(metric_value)
         else:
             raise ValueError(f"Unexpected return type '{kind}' from sage script")
-    return cleartexts, keys
+    return cleartexts, keys, metrics
 
 
-def run():
+SAFE_TAG = re.compile(r"[A-Za-z0-9_-][A-Za-z0-9._-]{0,63}")
+
+
+attack_status = {
+    None: "timeout",
+    0: "success",
+    1: "failed",
+    2: "bad_key"
+}
+
+
+def run_attack_output(attack, script, input_path, env, metrics_stream=None, profile=None, timeout=None, stderr=None, cancel=None):
+    """Run an attack script
+
+    Returns a (returncode, output) tuple, output being what the script
+    wrote to its standard output (see parse_output); returncode is None
+    if the attack timed out
+
+    Arguments:
+    attack -- attack name
+    script -- path to the attack script
+    input_path -- path to the attack input file
+    env -- environment of the Sage process
+    metrics_stream -- if not None, a JSON lines record with the run's
+                      figures is written to this stream
+    profile -- if not None, path where the attack's cProfile stats are saved
+    timeout -- maximum run time in seconds
+    stderr -- standard error of the attack, as accepted by Popen
+    cancel -- threading.Event terminating the attack when set, in which
+              case sage.Cancelled is raised
+    """
+    stats = {} if metrics_stream is not None else None
+    try:
+        p, script_output = sage.run(script, input_path, env=env, timeout=timeout, stats=stats, profile=profile, stderr=stderr, cancel=cancel)
+        returncode = p.returncode
+    except TimeoutExpired as e:
+        output.warning(f"Timeout expired for attack {attack}")
+        returncode, script_output = None, e.output or ""
+
+    if metrics_stream is not None:
+        _, _, counters = parse_output(script_output)
+        record = {
+            "attack": attack,
+            "status": attack_status.get(returncode, "failed"),
+            **stats,
+            "counters": counters
+        }
+        iterations = counters.get("iterations")
+        start = stats["time_to_first_output"]
+        if isinstance(iterations, (int, float)) and start is not None and stats["wall_time"] > start:
+            record["iterations_per_sec"] = iterations / (stats["wall_time"] - start)
+        metrics.emit(metrics_stream, record)
+
+    return returncode, script_output
+
+
+def run_attack(attack, script, input_path, env, metrics_stream=None, profile=None, timeout=None, stderr=None):
+    """Run an attack script
+
+    Returns a (returncode, cleartexts, keys) tuple, returncode is None
+    if the attack timed out. Arguments are the same of run_attack_output
+    """
+    returncode, script_output = run_attack_output(attack, script, input_path, env, metrics_stream, profile, timeout, stderr)
+    cleartexts, keys, _ = parse_output(script_output)
+    return returncode, cleartexts, keys
+
+
+def iter_keys():
+    """Yield ((n, e), name) for every target key given on the command line
+
+    Key files are read lazily, so large key sets are never held in memory
+    """
+    for n, e in args.keys:
+        if e is None:
+            e = DEFAULT_E
+        yield (n, e), None
+    for path in args.n_e_files:
+        yield from ((key, None) for key in parse_n_e_file(path))
+    for path in args.jsonl_files:
+        yield from parse_jsonl_file(path)
+    for path in args.bundles:
+        yield from load_pem_bundle(path, jobs=args.jobs)
+    for path in args.authorized_keys:
+        yield from load_authorized_keys(path)
+    for path in args.key_paths:
+        if path.is_dir():
+            yield from load_keys(path, recursive=args.recursive, exts=args.exts, jobs=args.jobs)
+        else:
+            yield load_pubkey(path), path.name
+
+
+def iter_inputs():
+    """Yield (ciphertext, name) for every ciphertext given on the command line"""
+    for text, name in args.inputs:
+        if isinstance(text, Path):
+            text = int_from_path(text)
+        elif isinstance(text, bytes):
+            text = int.from_bytes(text, "big")
+        yield text, name
+
+
+def write_input(f, keys, ciphertexts, color, cyg_runtime=None, *, state_dir=None, non_interactive=False):
+    """Write an attack input file
+
+    Returns the number of keys written and a tag identifying the key set,
+    fit for file names: the key name for a single named key whose name is
+    a plain file name, a digest of the keys otherwise
+
+    Arguments:
+    f -- text file object
+    keys -- iterable of ((n, e), name) tuples
+    ciphertexts -- iterable of (ciphertext, name) tuples, name being True
+                   for unnamed ciphertexts
+    color -- color setting for the attacks' output
+    cyg_runtime -- Cygwin runtime directory (Windows only)
+
+    Keyword arguments:
+    state_dir -- directory where attacks save their checkpoints
+    non_interactive -- make attacks use default values instead of prompting
+    """
+    n_keys = 0
+    key_name = None
+    keys_digest = hashlib.sha256()
+    with redirect_stdout(f):
+        print(f"C:{color}")
+        if state_dir is not None:
+            print(f"S:{sage.cyg_path(Path(state_dir).resolve(), cyg_runtime)}")
+        if non_interactive:
+            print("N:")
+        for (n, e), name in keys:
+            print(f"k:{n},{e},{name if name is not None else ''}")
+            n_keys += 1
+            key_name = name
+            keys_digest.update(f"{n},{e}\n".encode("ascii"))
+        for text, name in ciphertexts:
+            print(f"c:{text},{name if name is not True else ''}")
+    f.flush()
+
+    if n_keys == 1 and key_name is not None and SAFE_TAG.fullmatch(key_name):
+        keys_tag = key_name
+    else:
+        keys_tag = keys_digest.hexdigest()[:16]
+    return n_keys, keys_tag
+
+
+def read_input_keys(path):
+    """Yield ((n, e), name) for every key of an attack input file
+
+    Arguments:
+    path -- path of a file written by write_input
+    """
+    with open(path, "r", encoding="ascii") as f:
+        for line in f:
+            kind, _, value = line.strip().partition(":")
+            if kind == "k":
+                n, e, name = value.split(",", maxsplit=2)
+                yield (int(n), int(e)), name or None
+
+
+def update_key_status(status, returncode, keys, first_key):
+    """Record the keys an attack recovered or found bad
+
+    Returns the number of keys whose status changed, those keys should
+    not be passed to later attacks
+
+    Arguments:
+    status -- dict mapping (n, e) to "recovered" or "bad", updated in place
+    returncode -- attack exit status, None if it timed out
+    keys -- recovered keys, as returned by run_attack
+    first_key -- (n, e) of the first key of the attack input, the one
+                 attacks judge when they exit with the bad key status
+    """
+    changed = 0
+    if returncode == 2:
+        if first_key not in status:
+            status[first_key] = "bad"
+            changed += 1
+    elif returncode == 0:
+        for key, _ in keys:
+            n, e, *_ = key
+            if (n, e) not in status:
+                status[n, e] = "recovered"
+                changed += 1
+    return changed
+
+
+def propagate_primes(pool, status, keys, all_keys):
+    """Add the primes of recovered keys to a prime pool and factor the
+    keys left with it, until no new prime is found
+
+    Returns the keys factored, as returned by run_attack, which are
+    marked as recovered in status
+
+    Arguments:
+    pool -- PrimePool
+    status -- dict of key status, as updated by update_key_status
+    keys -- recovered keys, as returned by run_attack
+    all_keys -- function returning an iterable of ((n, e), name) for
+                every target key
+    """
+    primes = []
+    for key, name in keys:
+        try:
+            primes.extend(key_primes(key))
+        except ValueError as e:
+            output.warning(f"Cannot add the primes of key {name} to the prime pool: {e}")
+
+    factored = []
+    primes = pool.add(primes)
+    while primes:
+        pending = ((key, name) for key, name in all_keys() if key not in status)
+        found, primes = pool.sweep(primes, pending)
+        update_key_status(status, 0, found, None)
+        factored.extend(found)
+        primes = pool.add(primes)
+    return factored
+
+
+def stage_attack_lib():
+    """Return a cached directory holding the modules needed by attack scripts"""
+    return cache.staged_libs([
+        (attack_lib, "attack"),
+        (attack_lib, "batchgcd"),
+        (attack_lib, "siqs"),
+        (utils, "output")
+    ], [colorama])
+
+
+def attack_env(attack_lib_dir, cyg_runtime=None):
+    """Return the environment for attack scripts using the given library directory
+
+    Arguments:
+    attack_lib_dir -- directory returned by stage_attack_lib
+    cyg_runtime -- Cygwin runtime directory (Windows only)
+    """
+    env = os.environ.copy()
+    env["PYTHONPATH"] = str(sage.cyg_path(attack_lib_dir, cyg_runtime))
+    return env
+
+
+def complete_keys(encode, keys):
+    """Complete recovered keys, optionally encoding them to PEM
+
+    Returns a list of (key, name, pem, error) tuples, where key, pem and
+    error are None when not applicable
+
+    Arguments:
+    encode -- whether to PEM encode completed keys
+    keys -- list of (key, name) tuples as returned by run_attack
+    """
+    results = []
+    for key, name in keys:
+        try:
+            key = complete_privkey(*key)
+            pem = encode_privkey(*key, file_format="PEM") if encode else None
+        except ValueError as err:
+            results.append((None, name, None, str(err)))
+        else:
+            results.append((key, name, pem, None))
+    return results
+
+
+def key_record(key, name):
+    """Return a JSON serializable record of a complete private key
+
+    Arguments:
+    key -- (n, e, d, p, q, *other_primes) tuple
+    name -- key name
+    """
+    n, e, d, p, q, *other_primes = key
+    record = {"name": name, "n": str(n), "e": str(e), "d": str(d), "p": str(p), "q": str(q)}
+    if other_primes:
+        record["other_primes"] = [str(r) for r in other_primes]
+    return record
+
+
+def export_keys(keys, bundle=None, jsonl=None):
+    """Complete recovered keys in a pool of worker processes and write
+    them to --output-key-dir, a PEM bundle and/or a JSON lines stream
+
+    Arguments:
+    keys -- list of (key, name) tuples as returned by run_attack
+    bundle -- binary file object to append PEM keys to
+    jsonl -- text file object to append JSON records to
+    """
+    encode = args.output_key_dir is not None or bundle is not None
+    results = imap_chunked(
+            partial(complete_keys, encode), keys,
+            jobs=args.jobs, chunk_size=64)
+    for key, name, pem, error in results:
+        if error is not None:
+            output.error(f"Cannot complete key {name}: {error}")
+            continue
+        if args.output_key_dir is not None:
+            with open(args.output_key_dir/f"{name}.pem", "wb") as f:
+                f.write(pem)
+        if bundle is not None:
+            bundle.write(pem)
+            bundle.write(b"\n")
+        if jsonl is not None:
+            print(json.dumps(key_record(key, name)), file=jsonl)
+
+
+def resolve_attacks():
+    """Return the list of attacks to run, expanding "all" to every attack
+    not explicitly listed
+    """
     attacks = list(dict.fromkeys(args.attacks))
     if len(attacks) != len(args.attacks):
         output.warning("Attacks specified more than once are ignored")
@@ -74,54 +404,282 @@ def run():
         l = attacks[:i]
         r = attacks[i+1:]
         all_attacks = {
-            **installed,
-            **builtin
+            **installed(),
+            **builtin()
         }
         for attack in chain(l, r):
             all_attacks.pop(attack, None)
         attacks = [*l, *all_attacks, *r]
+    return attacks
+
+
+def report_attack(returncode, cleartexts, keys, bundle=None, jsonl=None, target=True):
+    """Output the plaintexts and keys recovered by an attack
+
+    Returns whether no further attacks should be run on the same keys
+
+    Arguments:
+    returncode -- attack exit status, None if it timed out
+    cleartexts -- recovered plaintexts, as returned by run_attack
+    keys -- recovered keys, as returned by run_attack
+    bundle -- binary file object to append PEM keys to
+    jsonl -- text file object to append JSON records to
+    target -- whether the attack was run on the only target key, which
+              is then output with --output-key(-file) and used to decrypt
+              --input; other keys are only exported
+    """
+    if returncode is None: # attack timed out
+        return False
+
+    if returncode == 2: # attack determined the key is bad (i.e. not an RSA key)
+        return True
+
+    if returncode: # attack failed for other reasons
+        return False
+
+    if cleartexts:
+        output.info("Plaintext recovered")
+        for text, file in cleartexts:
+            output_text("plaintext", text, file, encoding=args.encoding, json_output=args.json)
+            if file is True:
+                print()
+
+    if target and len(keys) == 1:
+        key, _ = keys[0]
+        n, e, d, p, q, *other_primes = key
+        if d is None:
+            d = compute_d(*key)
+            key = (n, e, d, p, q, *other_primes)
+
+        if args.output_key_file is None and args.output_key:
+            args.output_key_file = True
+
+        if args.output_key_file is True:
+            sys.stdout.buffer.write(encode_privkey(*key, file_format=args.file_format))
+            print()
+        elif args.output_key_file:
+            with open(args.output_key_file, "wb") as f:
+                f.write(encode_privkey(*key, file_format=args.file_format))
+
+        for text, filename in args.inputs:
+            if isinstance(text, Path):
+                with open(text, "rb") as f:
+                    text_bytes = f.read()
+                    text = int.from_bytes(text_bytes, "big")
+            else:
+                text_bytes = to_bytes_auto(text)
+            for std in args.encryption_standard:
+                output.newline()
+                output.info(f"Decrypting 0x{text_bytes.hex()} with encryption standard {std}")
+                try:
+                    cleartext = uncipher(text, n, e, d, std, p, q, tuple(other_primes))
+                except ValueError as err:
+                    output.error(err)
+                else:
+                    output_text("plaintext", cleartext, filename, encoding=args.encoding, json_output=args.json)
+                if filename is True:
+                    print()
+
+    if args.output_key_dir is not None or bundle is not None or jsonl is not None:
+        export_keys(keys, bundle, jsonl)
+
+    return bool(keys)
+
+
+class WorkerHandler(BaseRequestHandler):
+    """Feed shards to a worker connected to the coordinator, putting back
+    in the queue the shard of a worker that disconnects or stops sending
+    heartbeats
+    """
+
+    def handle(self):
+        server = self.server
+        connection = cluster.Connection(self.request, cluster.HEARTBEAT_TIMEOUT)
+        try:
+            try:
+                hello = connection.receive()
+            except OSError:
+                return
+            host, port, *_ = self.client_address
+            worker = str(hello.get("worker") or f"{host}:{port}")
+            output.info(f"Worker {worker} connected")
+            server.workers.add(worker)
+
+            while True:
+                item = server.shards.get()
+                if item is None:
+                    try:
+                        connection.send({"type": "done"})
+                    except OSError:
+                        pass
+                    return
+
+                shard_id, keys = item
+                try:
+                    connection.send({
+                        "type": "shard",
+                        "id": shard_id,
+                        "attacks": server.attacks,
+                        "keys": [[str(n), str(e), str(name) if name is not None else None] for (n, e), name in keys],
+                        "ciphertexts": server.ciphertexts,
+                        "timeout": args.timeout,
+                        "metrics": args.metrics is not None
+                    })
+                    while True:
+                        message = connection.receive()
+                        if message.get("type") == "result" and message.get("id") == shard_id:
+                            break
+                except OSError as e:
+                    output.warning(f"Lost worker {worker} ({e}), reassigning shard {shard_id}")
+                    server.shards.requeue(shard_id)
+                    return
+
+                names = {name for _, name in keys if name is not None}
+                server.results.put((worker, shard_id, names, message.get("results", [])))
+                server.shards.complete(shard_id)
+        finally:
+            connection.close()
 
-    keys = []
-    for n, e in args.keys:
-        if e is None:
-            e = DEFAULT_E
-        keys.append(((n, e), None))
-    for path in args.n_e_files:
-        keys.extend((key, None) for key in parse_n_e_file(path))
-    for path in args.key_paths:
-        if path.is_dir():
-            keys.extend(load_keys(path, recursive=args.recursive, exts=args.exts))
-        else:
-            n, e, _, _, _ = load_key(path)
-            keys.append(((n, e), path.name))
 
-    if not keys:
+class CoordinatorServer(ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def iter_shards(keys, size):
+    """Split an iterable of keys into lists of at most size keys"""
+    it = iter(keys)
+    return iter(lambda: list(islice(it, size)), [])
+
+
+def coordinate(attacks, metrics_stream=None, bundle=None, jsonl=None):
+    """Serve shards of the target keys to workers until all of them have
+    been attacked, and report the merged results
+
+    Arguments:
+    attacks -- list of attack names
+    metrics_stream -- stream receiving the workers' metrics records
+    bundle -- binary file object to append PEM keys to
+    jsonl -- text file object to append JSON records to
+    """
+    ciphertexts = [
+        [str(text), str(name) if name is not True else None]
+        for text, name in iter_inputs()
+    ]
+
+    shards = iter_shards(iter_keys(), args.shard_size)
+    first_shard = next(shards, None)
+    if first_shard is None:
         output.error("please provide at least one key")
         return
 
-    with TemporaryDirectory() as attack_lib_dir, \
-            NamedTemporaryFile("w", encoding="ascii") as input_file:
-        with redirect_stdout(input_file):
-            print(f"C:{args.color}")
-            for (n, e), name in keys:
-                print(f"k:{n},{e},{name if name is not None else ''}")
-            for text, name in args.inputs:
-                if isinstance(text, Path):
-                    text = int_from_path(text)
-                elif isinstance(text, bytes):
-                    text = int.from_bytes(text, "big")
-                print(f"c:{text},{name if name is not True else ''}")
-        input_file.flush()
-
-        copy_resource_module(attack_lib, "attack", attack_lib_dir)
-        copy_resource_module(utils, "output", attack_lib_dir)
-        copy_resource_tree(colorama, attack_lib_dir)
-
-        _, cyg_runtime = sage.get_sage()
-
-        env = os.environ.copy()
-        env["PYTHONPATH"] = str(sage.cyg_path(attack_lib_dir, cyg_runtime))
+    server = CoordinatorServer(args.coordinate, WorkerHandler)
+    server.attacks = attacks
+    server.ciphertexts = ciphertexts
+    server.shards = cluster.ShardQueue(chain([first_shard], shards))
+    server.results = queue.Queue()
+    server.workers = set()
+
+    host, port, *_ = server.server_address
+    output.info(f"Waiting for workers on {host}:{port}")
+
+    n_shards = 0
+    n_keys = 0
+    with server:
+        Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            while True:
+                try:
+                    worker, shard_id, names, results = server.results.get(timeout=1)
+                except queue.Empty:
+                    if server.shards.wait(0) and server.results.empty():
+                        break
+                    continue
+                n_shards += 1
+                for result in results:
+                    attack = result.get("attack")
+                    returncode = result.get("returncode")
+                    for record in result.get("metrics") or ():
+                        metrics.emit(metrics_stream, {**record, "worker": worker, "shard": shard_id})
+                    if returncode is None:
+                        output.warning(f"Timeout expired for attack {attack} on shard {shard_id}")
+                    cleartexts, keys, _ = parse_output(result.get("output", ""))
+                    # Names the attack made up for unnamed keys restart in every shard
+                    keys = [
+                        (key, name if name is None or name in names else f"{name}_shard{shard_id}")
+                        for key, name in keys
+                    ]
+                    if returncode == 0 and keys:
+                        output.success(f"Attack {attack} recovered {len(keys)} keys from shard {shard_id} on worker {worker}")
+                        n_keys += len(keys)
+                    report_attack(returncode, cleartexts, keys, bundle, jsonl, target=False)
+        finally:
+            server.shutdown()
+
+    output.info(f"{n_shards} shards attacked by {len(server.workers)} workers, {server.shards.requeues} reassigned, {n_keys} keys recovered")
+
+
+def run():
+    attacks = resolve_attacks()
+
+    if args.coordinate is not None:
+        if args.state_dir is not None or args.profile is not None:
+            raise ValueError("--state-dir and --profile cannot be used with --coordinate")
+        if args.output_key or args.output_key_file is not None:
+            raise ValueError("--output-key and --output-key-file cannot be used with --coordinate, use --output-key-dir, --output-key-bundle or --output-key-jsonl")
+        if args.shard_size <= 0:
+            raise ValueError("Shard size must be a positive number")
+        with metrics.open_stream(args.metrics) as metrics_stream, \
+                ExitStack() as outputs:
+            bundle = None
+            if args.output_key_bundle is not None:
+                bundle = outputs.enter_context(open(args.output_key_bundle, "wb"))
+            jsonl = outputs.enter_context(metrics.open_stream(args.output_key_jsonl))
+            coordinate(attacks, metrics_stream, bundle, jsonl)
+        return
 
+    _, cyg_runtime = sage.get_sage()
+
+    if args.state_dir is not None:
+        args.state_dir.mkdir(parents=True, exist_ok=True)
+
+    with NamedTemporaryFile("w", encoding="ascii") as input_file, \
+            metrics.open_stream(args.metrics) as metrics_stream, \
+            ExitStack() as outputs:
+        bundle = None
+        if args.output_key_bundle is not None:
+            bundle = outputs.enter_context(open(args.output_key_bundle, "wb"))
+        jsonl = outputs.enter_context(metrics.open_stream(args.output_key_jsonl))
+
+        write = partial(
+                write_input, color=args.color, cyg_runtime=cyg_runtime,
+                state_dir=args.state_dir, non_interactive=args.non_interactive)
+
+        total_keys, keys_tag = write(input_file, iter_keys(), iter_inputs())
+        n_keys = total_keys
+
+        if not n_keys:
+            output.error("please provide at least one key")
+            return
+
+        # Keys of several targets are only exported, so that they do not
+        # overwrite each other
+        target = total_keys == 1
+        if not target and (args.output_key or args.output_key_file is not None):
+            raise ValueError("--output-key and --output-key-file need a single target key, use --output-key-dir, --output-key-bundle or --output-key-jsonl")
+
+        if args.profile is not None:
+            args.profile.mkdir(parents=True, exist_ok=True)
+
+        env = attack_env(stage_attack_lib(), cyg_runtime)
+
+        # Keys recovered or found bad are left out of the input of later
+        # attacks, which go on until every key is dealt with. The primes
+        # of recovered keys are tried on the others straight away.
+        # Attacks working on the first key only are run again on every
+        # pending key, one at a time
+        status = {}
+        pool = PrimePool()
         for attack in attacks:
             try:
                 script_manager = attack_path(attack)
@@ -129,69 +687,53 @@ def run():
                 output.error(e)
                 continue
 
-            with script_manager as script:
-                try:
-                    p, script_output = sage.run(script, input_file.name, env=env, timeout=args.timeout)
-                except TimeoutExpired:
-                    output.warning(f"Timeout expired for attack {attack}")
-                    continue
+            attempted = set()
+            candidates = (
+                (key, name) for key, name in read_input_keys(input_file.name)
+                if key not in status and key not in attempted
+            )
+            with script_manager as script, ExitStack() as replaced:
+                attack_input, tag = input_file, keys_tag
+                while True:
+                    first_key, _ = next(read_input_keys(attack_input.name))
+                    attempted.add(first_key)
+                    profile = args.profile/f"{attack}-{tag}.pstats" if args.profile is not None else None
+                    returncode, script_output = run_attack_output(attack, script, attack_input.name, env, metrics_stream, profile, args.timeout)
+                    cleartexts, keys, counters = parse_output(script_output)
+                    if attack_input is not input_file:
+                        attack_input.close()
 
-                if p.returncode == 2: # attack determined the key is bad (i.e. not an RSA key)
-                    break
+                    report_attack(returncode, cleartexts, keys, bundle, jsonl, target)
 
-                if p.returncode: # attack failed for other reasons
-                    continue
+                    if update_key_status(status, returncode, keys, first_key):
+                        if returncode == 0:
+                            factored = propagate_primes(pool, status, keys, partial(read_input_keys, input_file.name))
+                            if factored:
+                                output.success(f"{len(factored)} more keys factored with the primes recovered so far")
+                                report_attack(0, [], factored, bundle, jsonl, target=False)
+
+                        pending = (
+                            (key, name) for key, name in read_input_keys(input_file.name)
+                            if key not in status
+                        )
+                        pending_file = outputs.enter_context(NamedTemporaryFile("w", encoding="ascii"))
+                        n_keys, keys_tag = write(pending_file, pending, iter_inputs())
+                        # Closed once the attack is done, candidates may still be reading it
+                        replaced.callback(input_file.close)
+                        input_file = pending_file
+
+                    if not n_keys or not counters.get("single_key"):
+                        break
+                    candidate = next(candidates, None)
+                    if candidate is None:
+                        break
+                    attack_input = NamedTemporaryFile("w", encoding="ascii")
+                    _, tag = write(attack_input, [candidate], iter_inputs())
+
+            if not n_keys:
+                break
 
-                cleartexts, keys = parse_output(script_output)
-
-                if cleartexts:
-                    output.info("Plaintext recovered")
-                    for text, file in cleartexts:
-                        output_text("plaintext", text, file, encoding=args.encoding, json_output=args.json)
-                        if file is True:
-                            print()
-
-                if len(keys) == 1:
-                    key, _ = keys[0]
-                    n, e, d, p, q = key
-                    if d is None:
-                        d = compute_d(*key)
-                        key = (n, e, d, p, q)
-
-                    if args.output_key_file is None and args.output_key:
-                        args.output_key_file = True
-
-                    if args.output_key_file is True:
-                        sys.stdout.buffer.write(encode_privkey(*key, args.file_format))
-                        print()
-                    elif args.output_key_file:
-                        with open(args.output_key_file, "wb") as f:
-                            f.write(encode_privkey(*key, args.file_format))
-
-                    for text, filename in args.inputs:
-                        if isinstance(text, Path):
-                            with open(text, "rb") as f:
-                                text_bytes = f.read()
-                                text = int.from_bytes(text_bytes, "big")
-                        else:
-                            text_bytes = to_bytes_auto(text)
-                        for std in args.encryption_standard:
-                            output.newline()
-                            output.info(f"Decrypting 0x{text_bytes.hex()} with encryption standard {std}")
-                            try:
-                                cleartext = uncipher(text, n, e, d, std)
-                            except ValueError as err:
-                                output.error(err)
-                            else:
-                                output_text("plaintext", cleartext, filename, encoding=args.encoding, json_output=args.json)
-                            if filename is True:
-                                print()
-
-                if args.output_key_dir is not None:
-                    for key, name in keys:
-                        key = complete_privkey(*key)
-                        with open(args.output_key_dir/f"{name}.pem", "wb") as f:
-                            f.write(encode_privkey(*key, "PEM"))
-
-                if keys:
-                    break
+        if total_keys > 1:
+            recovered = sum(1 for s in status.values() if s == "recovered")
+            bad = len(status) - recovered
+            output.info(f"{recovered} of {total_keys} keys recovered, {bad} bad, {n_keys} left")
@@ -0,0 +1,267 @@
+##########################################################################
+# RSArmageddon - RSA cryptography and cryptoanalysis toolkit             #
+# Copyright (C) 2020,2021                                                #
+# Vittorio Mignini a.k.a. M1gnus <vittorio.mignini@gmail.com>            #
+# Simone Cimarelli a.k.a. Aquilairreale <aquilairreale@ymail.com>        #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <https://www.gnu.org/licenses/>. #
+##########################################################################
+
+import sys
+import json
+import time
+import random
+
+from statistics import mean
+from subprocess import DEVNULL
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+
+from .. import sage
+from .. import microbench
+from .. import __version__
+from ..args import args
+from ..utils import output
+from ..attacks import attack_path
+from ..weakkeys import (
+        close_primes_key, small_d_key, smooth_p_1_key, unbalanced_key,
+        shared_prime_keys, hastad_set)
+from .attack import run_attack, write_input, stage_attack_lib, attack_env
+
+
+def fermat_case(bits, rng):
+    return [close_primes_key(bits, rng)], [], None
+
+
+def wiener_case(bits, rng):
+    return [small_d_key(bits, bits // 4 - 8, rng)], [], None
+
+
+def boneh_durfee_case(bits, rng):
+    # Within the attack's default hypothesis on d (delta = 0.18)
+    return [small_d_key(bits, int(bits * 0.17), rng)], [], None
+
+
+def p_1_case(bits, rng):
+    return [smooth_p_1_key(bits, rng=rng)], [], None
+
+
+def ecm_case(bits, rng):
+    # A 20 digits factor, found by the first B1 levels
+    return [unbalanced_key(bits, 64, rng)], [], None
+
+
+def common_factor_case(bits, rng):
+    return shared_prime_keys(bits, 2, rng), [], None
+
+
+def hastad_case(bits, rng):
+    return hastad_set(bits, 3, rng)
+
+
+cases = {
+    "fermat": fermat_case,
+    "wiener": wiener_case,
+    "boneh_durfee": boneh_durfee_case,
+    "p-1": p_1_case,
+    "ecm": ecm_case,
+    "common_factor": common_factor_case,
+    "hastad": hastad_case
+}
+
+
+def is_solved(keys, found_keys, cleartexts, message):
+    """Check an attack's results against the ground truth
+
+    Arguments:
+    keys -- private keys given to the attack
+    found_keys -- keys returned by the attack
+    cleartexts -- cleartexts returned by the attack
+    message -- expected cleartext, None if the attack should recover keys
+    """
+    if message is not None:
+        return any(text == message for text, _ in cleartexts)
+    solved = set()
+    for (n, e, d, p, q, *_), _ in found_keys:
+        if n is None:
+            continue
+        if p is not None and q is not None and p*q == n:
+            solved.add(n)
+        elif d is not None and pow(2, e*d, n) == 2:
+            solved.add(n)
+    return all(n in solved for n, *_ in keys)
+
+
+def run_case(attack, bits, rng, env, cyg_runtime):
+    keys, ciphertexts, message = cases[attack](bits, rng)
+    with NamedTemporaryFile("w", encoding="ascii") as input_file, \
+            attack_path(attack) as script:
+        write_input(
+                input_file,
+                (((n, e), f"{attack}_{i}") for i, (n, e, *_) in enumerate(keys)),
+                ((c, True) for c in ciphertexts),
+                "never", cyg_runtime, non_interactive=True)
+        start = time.monotonic()
+        returncode, cleartexts, found_keys = run_attack(
+                attack, script, input_file.name, env,
+                timeout=args.benchmark_timeout, stderr=DEVNULL)
+        wall_time = time.monotonic() - start
+    solved = returncode == 0 and is_solved(keys, found_keys, cleartexts, message)
+    return solved, wall_time
+
+
+def compare(results, baseline):
+    """Return a list of messages describing regressions against baseline
+
+    Arguments:
+    results -- list of benchmark records
+    baseline -- list of benchmark records
+    """
+    baseline = {(r["attack"], r["bits"]): r for r in baseline}
+    regressions = []
+    for r in results:
+        try:
+            b = baseline[r["attack"], r["bits"]]
+        except KeyError:
+            continue
+        what = f"{r['attack']} ({r['bits']} bits)"
+        if r["success_rate"] < b["success_rate"]:
+            regressions.append(f"{what}: success rate dropped from {b['success_rate']:.0%} to {r['success_rate']:.0%}")
+        if b["wall_time"]["mean"] and r["wall_time"]["mean"] > b["wall_time"]["mean"] * args.tolerance:
+            regressions.append(f"{what}: mean wall time rose from {b['wall_time']['mean']:.2f}s to {r['wall_time']['mean']:.2f}s")
+    return regressions
+
+
+def compare_micro(results, baseline):
+    """Return a list of messages describing micro-benchmark regressions
+    against baseline
+
+    Arguments:
+    results -- list of micro-benchmark records
+    baseline -- list of micro-benchmark records
+    """
+    baseline = {r["name"]: r for r in baseline}
+    regressions = []
+    for r in results:
+        try:
+            b = baseline[r["name"]]
+        except KeyError:
+            continue
+        if r["per_op"] > b["per_op"] * args.tolerance:
+            regressions.append(f"{r['name']}: time per operation rose from {b['per_op']*1e3:.3f}ms to {r['per_op']*1e3:.3f}ms")
+    return regressions
+
+
+def load_baseline(key):
+    if args.baseline is None:
+        return None
+    with open(args.baseline, "r") as f:
+        return json.load(f).get(key, [])
+
+
+def run_attacks():
+    attacks = args.benchmark_attacks or list(cases)
+    for attack in attacks:
+        if attack not in cases:
+            raise ValueError(f"No benchmark available for attack '{attack}' (available: {', '.join(cases)})")
+
+    baseline = load_baseline("results")
+
+    rng = random.Random(args.seed)
+    _, cyg_runtime = sage.get_sage()
+
+    env = attack_env(stage_attack_lib(), cyg_runtime)
+
+    results = []
+    for bits in args.sizes:
+        for attack in attacks:
+            wall_times = []
+            successes = 0
+            for _ in range(args.trials):
+                solved, wall_time = run_case(attack, bits, rng, env, cyg_runtime)
+                successes += solved
+                wall_times.append(wall_time)
+            record = {
+                "attack": attack,
+                "bits": bits,
+                "trials": args.trials,
+                "successes": successes,
+                "success_rate": successes / args.trials,
+                "wall_time": {
+                    "mean": mean(wall_times),
+                    "min": min(wall_times),
+                    "max": max(wall_times)
+                }
+            }
+            results.append(record)
+            output.primary(f"{attack} ({bits} bits): {successes}/{args.trials} solved, {record['wall_time']['mean']:.2f}s mean wall time")
+
+    report = {
+        "version": __version__,
+        "time": time.time(),
+        "timeout": args.benchmark_timeout,
+        "results": results
+    }
+    regressions = compare(results, baseline) if baseline is not None else None
+    return report, regressions
+
+
+def run_micro():
+    names = args.micro or list(microbench.benchmarks)
+    for name in names:
+        if name not in microbench.benchmarks:
+            raise ValueError(f"No micro-benchmark named '{name}' (available: {', '.join(microbench.benchmarks)})")
+
+    baseline = load_baseline("micro")
+    baseline_records = {r["name"]: r for r in baseline or []}
+
+    results = []
+    with TemporaryDirectory() as workdir:
+        for record in microbench.run(workdir, names, args.scale, args.trials, args.seed or 0):
+            results.append(record)
+            message = f"{record['name']}: {record['ops']} ops in {record['seconds']:.3f}s, {record['per_op']*1e3:.3f}ms per op"
+            b = baseline_records.get(record["name"])
+            if b is not None:
+                message += f" ({record['per_op'] / b['per_op']:.2f}x baseline)"
+            output.primary(message)
+
+    report = {
+        "version": __version__,
+        "time": time.time(),
+        "scale": args.scale,
+        "micro": results
+    }
+    regressions = compare_micro(results, baseline) if baseline is not None else None
+    return report, regressions
+
+
+def run():
+    if args.micro is not None:
+        report, regressions = run_micro()
+    else:
+        report, regressions = run_attacks()
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=4)
+
+    if regressions is not None:
+        for regression in regressions:
+            output.error(regression)
+        if regressions:
+            raise RuntimeError(f"{len(regressions)} regressions found against baseline {args.baseline}")
+        output.success("No regressions found against baseline")
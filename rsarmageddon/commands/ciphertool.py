@@ -19,31 +19,175 @@
 ##########################################################################
 
 import sys
+import json
 
 from pathlib import Path
 from functools import partial
+from collections import Counter
+from contextlib import nullcontext
 
 from ..args import args
-from ..utils import output
-from ..crypto import cipher, uncipher
-from ..utils import int_from_path, output_text, compute_d, compute_n, compute_pubkey, complete_privkey, DEFAULT_E
+from ..utils import output, imap_chunked
+from ..certs import load_key, scan_key_files
+from ..crypto import cipher, uncipher, encrypt_stream, decrypt_stream
+from ..metrics import open_stream
+from ..parsing import parse_input_manifest
+from ..utils import int_from_path, output_text, to_bytes_auto, compute_d, compute_n, compute_pubkey, complete_privkey, DEFAULT_E
+
+
+def key_file_name(key_dir, path):
+    """Return the name of a key file in batch mode: its path relative to
+    the keys directory, without extension
+
+    Arguments:
+    key_dir -- path to keys directory
+    path -- path of the key file
+    """
+    return Path(path).relative_to(key_dir).with_suffix("").as_posix()
+
+
+def process_key_files(command, inputs, stds, key_dir, paths):
+    """Encrypt or decrypt inputs with each key file in paths
+
+    Returns a list of (key_name, input_name, std, result, error) tuples,
+    where exactly one of result and error is None. Errors affecting a
+    whole key have None input_name and std
+
+    Arguments:
+    command -- "encrypt" or "decrypt"
+    inputs -- list of (name, text, key_name) tuples
+    stds -- list of encryption standards
+    key_dir -- path to keys directory, key names are relative to it
+    paths -- list of key file paths
+    """
+    results = []
+    for path in paths:
+        key_name = key_file_name(key_dir, path)
+        try:
+            n, e, d, p, q, *other_primes = load_key(path)
+            other_primes = tuple(other_primes)
+            if command == "decrypt":
+                d = compute_d(n, e, d, p, q, *other_primes)
+        except ValueError as err:
+            results.append((key_name, None, None, None, str(err)))
+            continue
+        for input_name, text, input_key in inputs:
+            if input_key is not None and input_key != key_name:
+                continue
+            for std in stds:
+                try:
+                    if command == "encrypt":
+                        result = cipher(text, n, e, std)
+                    else:
+                        result = uncipher(text, n, e, d, std, p, q, other_primes)
+                except ValueError as err:
+                    results.append((key_name, input_name, std, None, str(err)))
+                else:
+                    results.append((key_name, input_name, std, result, None))
+    return results
+
+
+def run_batch():
+    if args.key_dir is None or args.input_manifest is None:
+        raise ValueError("Batch mode needs both --key-dir and --input-manifest")
+    if args.output_dir is None and args.output_jsonl is None:
+        raise ValueError("Batch mode needs --output-dir or --output-jsonl")
+
+    inputs = list(parse_input_manifest(args.input_manifest))
+    stds = args.encryption_standard
+    if args.output_dir is not None:
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    paths = list(scan_key_files(args.key_dir, args.exts, args.recursive))
+    names = Counter(key_file_name(args.key_dir, path) for path in paths)
+    duplicates = sorted(name for name, count in names.items() if count > 1)
+    if duplicates:
+        raise ValueError(f"Key files with the same name and different extensions: {', '.join(duplicates)}")
+    results = imap_chunked(
+            partial(process_key_files, args.command, inputs, stds, args.key_dir), paths,
+            jobs=args.jobs, chunk_size=16)
+
+    done = 0
+    errors = 0
+    with open_stream(args.output_jsonl) as stream:
+        for key_name, input_name, std, result, error in results:
+            if error is not None:
+                errors += 1
+                what = key_name if input_name is None else f"{key_name}, {input_name} ({std})"
+                output.error(f"{what}: {error}")
+            else:
+                done += 1
+            if stream is not None:
+                record = {"key": key_name, "input": input_name, "std": std}
+                if error is not None:
+                    record["error"] = error
+                else:
+                    record["result"] = str(result)
+                print(json.dumps(record), file=stream)
+            if args.output_dir is not None and error is None:
+                filename = f"{key_name}.{input_name}"
+                if len(stds) > 1:
+                    filename = f"{filename}.{std}"
+                path = args.output_dir/filename
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(to_bytes_auto(result))
+
+    output.info(f"{done} results, {errors} errors")
+
+
+def run_stream(n, e, d, p, q, other_primes):
+    for text, base_filename in args.inputs:
+        if not isinstance(text, Path):
+            raise ValueError("--stream only applies to input files")
+        if args.command == "decrypt":
+            stds = [None] # Read from the stream header
+        else:
+            stds = args.encryption_standard
+        for std in stds:
+            filename = base_filename
+            if filename is not True and len(stds) > 1:
+                filename = f"{filename}.{std}"
+            with open(text, "rb") as infile, \
+                    open(filename, "wb") if filename is not True else nullcontext(sys.stdout.buffer) as outfile:
+                if args.command == "encrypt":
+                    encrypt_stream(infile, outfile, n, e, std, jobs=args.jobs)
+                else:
+                    decrypt_stream(infile, outfile, n, e, d, p, q, other_primes, jobs=args.jobs)
+            if filename is not True:
+                output.success(f"{text} {args.command}ed to {filename}")
 
 
 def run():
+    if args.key_dir is not None or args.input_manifest is not None:
+        run_batch()
+        return
+
     n, e, d, p, q, phi = args.n, args.e, args.d, args.p, args.q, args.phi
+    other_primes = tuple(args.other_primes)
+    if other_primes:
+        if e is None and d is None:
+            e = DEFAULT_E
+        n, e, d, p, q, *_ = complete_privkey(n, e, d, p, q, *other_primes)
     if args.command == "encrypt":
-        n, e = compute_pubkey(n, e, d, p, q, phi)
+        if not other_primes:
+            n, e = compute_pubkey(n, e, d, p, q, phi)
         f = partial(cipher, n=n, e=e)
     else:
         if e is None:
             e = DEFAULT_E
-        d = compute_d(n, e, d, p, q, phi)
-        n = compute_n(n, e, d, p, q, phi)
-        f = partial(uncipher, n=n, e=e, d=d)
+        if not other_primes:
+            d = compute_d(n, e, d, p, q, phi=phi)
+            n = compute_n(n, e, d, p, q, phi)
+        f = partial(uncipher, n=n, e=e, d=d, p=p, q=q, other_primes=other_primes)
 
     if not args.inputs:
         output.error("Nothing to do")
 
+    if args.stream:
+        run_stream(n, e, d, p, q, other_primes)
+        return
+
     for text, base_filename in args.inputs: # TODO: implement args.inputs parsing func
         if isinstance(text, Path):
             text = int_from_path(text)
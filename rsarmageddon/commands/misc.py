@@ -20,18 +20,160 @@
 
 import os
 import sys
+import json
 import subprocess
 import colorama
 
 from importlib import resources
-from tempfile import TemporaryDirectory
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 
 from .. import sage
+from .. import cache
 from .. import scripts
 from .. import utils
 
 from ..args import args
-from ..utils import copy_resource_module, copy_resource_tree
+from ..parsing import parse_int_arg
+from ..utils import output
+
+
+def iter_numbers(path):
+    """Yield (line, number) for every non-empty line of a file, number
+    being None if the line cannot be parsed
+
+    Arguments:
+    path -- path of the file, True for standard input
+    """
+    f = sys.stdin if path is True else open(path, "r")
+    try:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line, parse_int_arg(line)
+            except ValueError:
+                yield line, None
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def fast_result(command, n):
+    """Compute a command's result in process, in the format of
+    batch.sage, or return None if Sage is needed
+
+    Primality is checked with gmpy2's probabilistic tests, numbers are
+    factored if trial division and a short Pollard rho are enough
+
+    Arguments:
+    command -- command name
+    n -- input number
+    """
+    from gmpy2 import is_prime
+    from ..factoring import factorize, euler_phi
+
+    if command == "isprime":
+        return {"prime": n > 1 and bool(is_prime(n))}
+    if command not in ("factor", "eulerphi") or n < 1:
+        return None
+    factors = factorize(n)
+    if factors is None:
+        return None
+    if command == "factor":
+        return {"factors": [[str(p), k] for p, k in factors]}
+    return {"phi": str(euler_phi(factors))}
+
+
+def print_result(command, n, result):
+    """Output a result of fast_result as the command's Sage script would
+
+    Arguments:
+    command -- command name
+    n -- input number
+    result -- dict returned by fast_result
+    """
+    if command == "isprime":
+        output.success("Start Primality test")
+        if result["prime"]:
+            output.info("The number is prime")
+        else:
+            output.info("The number is not prime")
+    elif command == "factor":
+        output.success("Start Factorization")
+        output.success("Factorization complete")
+        for p, k in result["factors"]:
+            output.primary(f"{p}^{k}")
+    else:
+        output.success(f"Start calculating euler's phi of {n}")
+        output.success("Done")
+        output.primary(result["phi"])
+
+
+def sage_env():
+    """Return the environment of the commands' Sage scripts"""
+    libs_dir = cache.staged_libs([(utils, "output")], [colorama])
+
+    _, cyg_runtime = sage.get_sage()
+
+    env = os.environ.copy()
+    env["PYTHONPATH"] = str(sage.cyg_path(libs_dir, cyg_runtime))
+    return env
+
+
+def batch(script):
+    """Compute the command's operation on every number of the --batch
+    file, spreading the numbers that need Sage over up to --jobs Sage
+    sessions, started when first needed
+
+    Arguments:
+    script -- path to batch.sage
+    """
+    numbers = iter_numbers(args.batch)
+    lock = Lock()
+    env = None
+
+    def write(line):
+        with lock:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+    def session():
+        nonlocal env
+        p = None
+        try:
+            while True:
+                with lock:
+                    line, n = next(numbers, (None, None))
+                if line is None:
+                    break
+                if n is None:
+                    write(json.dumps({"input": line, "error": "Invalid number"}) + "\n")
+                    continue
+                result = fast_result(args.command, n)
+                if result is not None:
+                    write(json.dumps({"n": str(n), **result}) + "\n")
+                    continue
+                if p is None:
+                    with lock:
+                        if env is None:
+                            env = sage_env()
+                    p = sage.spawn(script, args.command, args.color, env=env)
+                p.stdin.write(f"{n}\n")
+                result = p.stdout.readline()
+                if not result:
+                    raise RuntimeError(f"Sage session exited unexpectedly while processing {line}")
+                write(result)
+        finally:
+            if p is not None:
+                p.stdin.close()
+                p.wait()
+
+    with ThreadPoolExecutor(args.jobs) as executor:
+        sessions = [executor.submit(session) for _ in range(args.jobs)]
+        for s in sessions:
+            s.result()
 
 
 def run():
@@ -42,16 +184,20 @@ def run():
         "isprime":  "isprime.sage"
     }
 
-    script_name = script_names[args.command]
-
-    with resources.path(scripts, script_name) as script, \
-            TemporaryDirectory() as libs_dir:
-        copy_resource_module(utils, "output", libs_dir)
-        copy_resource_tree(colorama, libs_dir)
+    if args.batch is None and args.n is None:
+        raise ValueError("please provide a number or a --batch file")
+    if args.jobs <= 0:
+        raise ValueError("Number of jobs must be a positive number")
 
-        _, cyg_runtime = sage.get_sage()
+    if args.batch is not None:
+        with resources.path(scripts, "batch.sage") as script:
+            batch(script)
+        return
 
-        env = os.environ.copy()
-        env["PYTHONPATH"] = str(sage.cyg_path(libs_dir, cyg_runtime))
+    result = fast_result(args.command, args.n)
+    if result is not None:
+        print_result(args.command, args.n, result)
+        return
 
-        sage.run(script, str(args.n), args.color, env=env)
+    with resources.path(scripts, script_names[args.command]) as script:
+        sage.run(script, str(args.n), args.color, env=sage_env())
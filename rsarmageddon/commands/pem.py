@@ -19,16 +19,73 @@
 ##########################################################################
 
 import sys
+import json
+import random
+
+from functools import partial
+from itertools import islice
 
 from ..args import args
-from ..utils import output
+from ..utils import output, imap_chunked
+from ..weakkeys import corpus_weaknesses, corpus_tasks, generate_corpus_groups
 from ..certs import print_key, print_key_json, generate_key, encode_pubkey, encode_privkey, load_key
 from ..utils import compute_extra_key_elements, compute_pubkey, complete_privkey
 
 
+def generate_corpus():
+    for weakness in args.weaknesses:
+        if weakness not in corpus_weaknesses:
+            names = ", ".join(w for w in corpus_weaknesses if w is not None)
+            raise ValueError(f"Unknown weakness '{weakness}' (available: {names})")
+
+    bundle_path = args.corpus_output
+    manifest_path = bundle_path.with_suffix(".jsonl")
+    rng = random.Random(args.seed)
+    # Every group holds at least one key, so this many tasks is always enough
+    tasks = islice(corpus_tasks(args.weaknesses, rng), args.generate_corpus)
+    groups = imap_chunked(
+            partial(generate_corpus_groups, args.bits), tasks,
+            jobs=args.jobs, chunk_size=16)
+
+    i = 0
+    with open(bundle_path, "wb") as bundle, open(manifest_path, "w") as manifest:
+        for group, (weakness, keys) in enumerate(groups):
+            for n, e, d, p, q in keys:
+                # Same naming as PEM bundles loaded by the attack command
+                name = f"{bundle_path.stem}_{i}"
+                bundle.write(encode_pubkey(n, e, "PEM"))
+                bundle.write(b"\n")
+                record = {
+                    "name": name,
+                    "n": str(n),
+                    "e": str(e),
+                    "d": str(d),
+                    "p": str(p),
+                    "q": str(q),
+                    "weakness": weakness,
+                    "group": group
+                }
+                print(json.dumps(record), file=manifest)
+                i += 1
+                if i == args.generate_corpus:
+                    break
+            if i == args.generate_corpus:
+                break
+
+    output.success(f"{i} keys written to {bundle_path}, manifest written to {manifest_path}")
+
+
 def run():
+    if args.generate_corpus is not None:
+        generate_corpus()
+        return
+
+    other_primes = ()
     if args.generate:
         n, e, d, p, q = generate_key()
+    elif args.other_primes:
+        n, e, d, p, q, *other_primes = complete_privkey(
+                args.n, args.e, args.d, args.p, args.q, *args.other_primes)
     else:
         n, e, d, p, q = args.n, args.e, args.d, args.p, args.q
 
@@ -41,9 +98,9 @@ def run():
     if args.dump_values:
         dp, dq, pinv, qinv = compute_extra_key_elements(d, p, q)
         if args.json:
-            print_key_json(n, e, d, p, q, dp, dq, pinv, qinv)
+            print_key_json(n, e, d, p, q, dp, dq, pinv, qinv, other_primes)
         else:
-            print_key(n, e, d, p, q, dp, dq, pinv, qinv)
+            print_key(n, e, d, p, q, dp, dq, pinv, qinv, other_primes)
 
     if args.create_public:
         key = encode_pubkey(n, e, args.file_format)
@@ -55,7 +112,7 @@ def run():
                 f.write(key)
 
     if args.create_private:
-        key = encode_privkey(n, e, d, p, q, args.file_format)
+        key = encode_privkey(n, e, d, p, q, *other_primes, file_format=args.file_format)
         if args.create_private is True:
             sys.stdout.buffer.write(key)
             print()
@@ -0,0 +1,72 @@
+##########################################################################
+# RSArmageddon - RSA cryptography and cryptoanalysis toolkit             #
+# Copyright (C) 2020,2021                                                #
+# Vittorio Mignini a.k.a. M1gnus <vittorio.mignini@gmail.com>            #
+# Simone Cimarelli a.k.a. Aquilairreale <aquilairreale@ymail.com>        #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <https://www.gnu.org/licenses/>. #
+##########################################################################
+
+import sys
+import json
+import pstats
+
+from ..args import args
+from ..utils import output
+
+
+sort_fields = {
+    "cumulative": lambda entry: entry[1][3],
+    "tottime": lambda entry: entry[1][2],
+    "calls": lambda entry: entry[1][1]
+}
+
+
+def run():
+    paths = []
+    for path in args.profiles:
+        if path.is_dir():
+            paths.extend(sorted(path.glob("*.pstats")))
+        else:
+            paths.append(path)
+
+    if not paths:
+        output.error("No profiles found")
+        return
+
+    try:
+        stats = pstats.Stats(*map(str, paths), stream=sys.stdout)
+    except (TypeError, EOFError) as e:
+        raise ValueError(f"Bad profile file ({e})") from e
+    stats.strip_dirs()
+
+    output.info(f"Merged {len(paths)} profiles")
+
+    if args.json:
+        entries = sorted(stats.stats.items(), key=sort_fields[args.sort], reverse=True)
+        json.dump([
+            {
+                "file": file,
+                "line": line,
+                "function": function,
+                "primitive_calls": cc,
+                "calls": nc,
+                "tottime": tt,
+                "cumtime": ct
+            }
+            for (file, line, function), (cc, nc, tt, ct, _) in entries[:args.top]
+        ], sys.stdout, indent=4)
+        print()
+    else:
+        stats.sort_stats(args.sort).print_stats(args.top)
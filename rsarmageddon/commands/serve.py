@@ -0,0 +1,512 @@
+##########################################################################
+# RSArmageddon - RSA cryptography and cryptoanalysis toolkit             #
+# Copyright (C) 2020,2021                                                #
+# Vittorio Mignini a.k.a. M1gnus <vittorio.mignini@gmail.com>            #
+# Simone Cimarelli a.k.a. Aquilairreale <aquilairreale@ymail.com>        #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <https://www.gnu.org/licenses/>. #
+##########################################################################
+
+# JSON API:
+#
+#   POST   /jobs          submit a job, returns {"id": ..., "status": ...}
+#                         {"attacks": ["wiener", ...] or "wiener,...",
+#                          "keys": [{"n": ..., "e": ..., "name": ...}, ...],
+#                          "ciphertexts": [{"text": ..., "name": ...}, ...],
+#                          "encryption_standards": ["pkcs", ...],
+#                          "priority": 0, "timeout": "5m"}
+#   GET    /jobs          list jobs, without their results
+#   GET    /jobs/ID       job status and results, ?wait=SECONDS blocks
+#                         until the job is finished or SECONDS elapse
+#   DELETE /jobs/ID       cancel a queued or running job
+#   GET    /attacks       list available attacks
+#
+# Numbers are accepted as JSON numbers or strings in any format understood
+# by the command line, and returned as decimal strings. Jobs with higher
+# priority run first, jobs with the same priority in submission order
+
+import sys
+import json
+import time
+import heapq
+import signal
+import socket
+
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from subprocess import DEVNULL
+from itertools import count
+from threading import Thread, Event, Condition
+from urllib.parse import urlsplit, parse_qs
+from socketserver import ThreadingMixIn, UnixStreamServer
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from http import HTTPStatus
+
+from .. import sage
+from .. import attacks
+from ..args import args
+from ..crypto import uncipher
+from ..parsing import parse_json_int, parse_list, parse_std_list, parse_time
+from ..primepool import PrimePool
+from ..utils import output, DEFAULT_E, complete_privkey, to_bytes_auto
+from .attack import (
+        run_attack_output, parse_output, write_input,
+        update_key_status, propagate_primes, stage_attack_lib, attack_env,
+        key_record, attack_status)
+
+
+JOB_HISTORY = 1000
+MAX_REQUEST_SIZE = 64 << 20
+
+
+class Job:
+    """A set of keys and ciphertexts to run a list of attacks on"""
+
+    def __init__(self, job_id, request):
+        self.id = job_id
+        self.attacks = request["attacks"]
+        self.keys = request["keys"]
+        self.ciphertexts = request["ciphertexts"]
+        self.standards = request["encryption_standards"]
+        self.priority = request["priority"]
+        self.timeout = request["timeout"]
+        self.status = "queued"
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.results = []
+        self.recovered_keys = []
+        self.plaintexts = []
+        self.cancel = Event()
+        self.done = Event()
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "attacks": self.attacks,
+            "keys": len(self.keys),
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished
+        }
+
+    def report(self):
+        return {
+            **self.summary(),
+            "error": self.error,
+            "results": self.results,
+            "recovered_keys": self.recovered_keys,
+            "plaintexts": self.plaintexts
+        }
+
+
+def parse_job_request(body):
+    """Validate a job submission and normalize its fields
+
+    Arguments:
+    body -- decoded JSON object
+    """
+    if not isinstance(body, dict):
+        raise ValueError("Job must be a JSON object")
+
+    job_attacks = body.get("attacks")
+    if isinstance(job_attacks, str):
+        job_attacks = parse_list(job_attacks)
+    if not isinstance(job_attacks, list) or not job_attacks or not all(isinstance(a, str) for a in job_attacks):
+        raise ValueError("Job must have a non-empty list of attacks")
+    for attack in job_attacks:
+        if attack not in attacks.installed() and attack not in attacks.builtin():
+            raise ValueError(f"There is no attack named '{attack}'")
+
+    if not isinstance(body.get("keys") or [], list):
+        raise ValueError("Keys must be a list")
+    keys = []
+    for key in body.get("keys") or []:
+        try:
+            n = parse_json_int(key["n"])
+            e = parse_json_int(key["e"]) if key.get("e") is not None else DEFAULT_E
+        except (KeyError, TypeError) as exc:
+            raise ValueError(f"Bad key {key!r}") from exc
+        name = key.get("name")
+        keys.append(((n, e), str(name) if name is not None else None))
+    if not keys:
+        raise ValueError("Job must have at least one key")
+
+    if not isinstance(body.get("ciphertexts") or [], list):
+        raise ValueError("Ciphertexts must be a list")
+    ciphertexts = []
+    for ciphertext in body.get("ciphertexts") or []:
+        try:
+            text = parse_json_int(ciphertext["text"])
+        except (KeyError, TypeError) as exc:
+            raise ValueError(f"Bad ciphertext {ciphertext!r}") from exc
+        name = ciphertext.get("name")
+        ciphertexts.append((text, str(name) if name is not None else True))
+
+    standards = body.get("encryption_standards") or ["pkcs"]
+    if isinstance(standards, list) and all(isinstance(std, str) for std in standards):
+        standards = ",".join(standards)
+    if not isinstance(standards, str):
+        raise ValueError("Encryption standards must be a list of names")
+    standards = parse_std_list(standards)
+
+    priority = body.get("priority", 0)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        raise ValueError("Priority must be an integer")
+
+    timeout = body.get("timeout", args.timeout)
+    if isinstance(timeout, str):
+        timeout = parse_time(timeout)
+    if timeout is not None and (not isinstance(timeout, (int, float)) or timeout <= 0):
+        raise ValueError("Timeout must be a positive number of seconds")
+
+    return {
+        "attacks": job_attacks,
+        "keys": keys,
+        "ciphertexts": ciphertexts,
+        "encryption_standards": standards,
+        "priority": priority,
+        "timeout": timeout
+    }
+
+
+class JobQueue:
+    """Priority queue of jobs, keeping finished jobs around for their
+    results to be retrieved
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self._heap = []
+        self._ids = count(1)
+        self._seq = count()
+        self._finished = []
+        self._cond = Condition()
+
+    def submit(self, request):
+        with self._cond:
+            job = Job(str(next(self._ids)), request)
+            self.jobs[job.id] = job
+            heapq.heappush(self._heap, (-job.priority, next(self._seq), job))
+            output.info(f"Job {job.id} queued ({len(job.keys)} keys, priority {job.priority})")
+            self._cond.notify()
+            return job
+
+    def get(self):
+        """Return the next queued job, blocking until there is one"""
+        with self._cond:
+            while True:
+                while self._heap:
+                    _, _, job = heapq.heappop(self._heap)
+                    if job.status == "queued":
+                        job.status = "running"
+                        job.started = time.time()
+                        return job
+                self._cond.wait()
+
+    def cancel(self, job):
+        """Cancel a job, returning False if it was already finished"""
+        with self._cond:
+            if job.status == "queued":
+                self._finish(job, "cancelled")
+            elif job.status == "running":
+                job.cancel.set()
+            else:
+                return False
+            return True
+
+    def shutdown(self, timeout):
+        """Cancel running jobs and wait up to timeout seconds for them to
+        terminate
+        """
+        with self._cond:
+            running = [job for job in self.jobs.values() if job.status == "running"]
+        for job in running:
+            job.cancel.set()
+        deadline = time.monotonic() + timeout
+        for job in running:
+            job.done.wait(max(deadline - time.monotonic(), 0))
+
+    def finish(self, job, status):
+        with self._cond:
+            self._finish(job, status)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished = time.time()
+        job.done.set()
+        self._finished.append(job)
+        while len(self._finished) > JOB_HISTORY:
+            del self.jobs[self._finished.pop(0).id]
+
+
+def decrypt_ciphertexts(job, key):
+    """Decrypt a job's ciphertexts with a recovered key"""
+    n, e, d, p, q, *other_primes = key
+    for text, name in job.ciphertexts:
+        for std in job.standards:
+            try:
+                plaintext = uncipher(text, n, e, d, std, p, q, tuple(other_primes))
+            except ValueError:
+                continue
+            job.plaintexts.append({
+                "ciphertext": name if name is not True else None,
+                "encryption_standard": std,
+                "plaintext": to_bytes_auto(plaintext).hex()
+            })
+
+
+def record_keys(job, keys):
+    """Complete keys recovered for a job and add them to its results
+
+    Arguments:
+    job -- Job the keys belong to
+    keys -- recovered keys, as returned by run_attack
+    """
+    for key, name in keys:
+        try:
+            key = complete_privkey(*key)
+        except ValueError as e:
+            output.error(f"Cannot complete key {name}: {e}")
+            continue
+        job.recovered_keys.append(key_record(key, name))
+        if len(keys) == 1:
+            decrypt_ciphertexts(job, key)
+
+
+def run_job(job, env, cyg_runtime=None):
+    """Run a job's attacks, leaving keys out of later attacks once
+    recovered and running single key attacks on every key as the attack
+    command does
+
+    Arguments:
+    job -- Job to run
+    env -- environment of the Sage processes
+    cyg_runtime -- Cygwin runtime directory (Windows only)
+    """
+    stderr = DEVNULL if args.quiet else None
+
+    keys = job.keys
+    status = {}
+    pool = PrimePool()
+    for attack in job.attacks:
+        try:
+            script_manager = attacks.attack_path(attack)
+        except ValueError as e:
+            job.results.append({"attack": attack, "status": "failed", "error": str(e)})
+            continue
+
+        # Attacks working on the first key only are run again on every
+        # pending key, one at a time
+        attempted = set()
+        candidates = (
+            (key, name) for key, name in keys
+            if key not in status and key not in attempted
+        )
+        with script_manager as script:
+            attack_keys = keys
+            while True:
+                if job.cancel.is_set():
+                    raise sage.Cancelled()
+                first_key, _ = attack_keys[0]
+                attempted.add(first_key)
+                with NamedTemporaryFile("w", encoding="ascii") as input_file:
+                    write_input(input_file, attack_keys, job.ciphertexts, "never", cyg_runtime, non_interactive=True)
+                    returncode, script_output = run_attack_output(
+                            attack, script, input_file.name, env,
+                            timeout=job.timeout, stderr=stderr,
+                            cancel=job.cancel)
+
+                cleartexts, recovered, counters = parse_output(script_output)
+                job.results.append({"attack": attack, "status": attack_status.get(returncode, "failed")})
+
+                for text, file in cleartexts:
+                    job.plaintexts.append({
+                        "ciphertext": str(file) if file is not True else None,
+                        "plaintext": to_bytes_auto(text).hex()
+                    })
+
+                record_keys(job, recovered)
+
+                if update_key_status(status, returncode, recovered, first_key):
+                    if returncode == 0:
+                        record_keys(job, propagate_primes(pool, status, recovered, lambda: keys))
+                    keys = [(key, name) for key, name in keys if key not in status]
+
+                if not keys or not counters.get("single_key"):
+                    break
+                candidate = next(candidates, None)
+                if candidate is None:
+                    break
+                attack_keys = [candidate]
+
+        if not keys:
+            break
+
+
+def job_runner(jobs, env, cyg_runtime=None):
+    while True:
+        job = jobs.get()
+        output.info(f"Job {job.id} started")
+        try:
+            run_job(job, env, cyg_runtime)
+        except sage.Cancelled:
+            jobs.finish(job, "cancelled")
+            output.info(f"Job {job.id} cancelled")
+        except Exception as e:
+            job.error = str(e)
+            jobs.finish(job, "failed")
+            output.error(f"Job {job.id} failed: {e}")
+        else:
+            jobs.finish(job, "done")
+            output.info(f"Job {job.id} done, {len(job.recovered_keys)} keys recovered")
+
+
+class APIHandler(BaseHTTPRequestHandler):
+    server_version = "RSArmageddon"
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else "local"
+
+    def log_message(self, format, *log_args):
+        pass
+
+    def send_json(self, status, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_json(status, {"error": message})
+
+    def route(self):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        return parts, parse_qs(url.query)
+
+    def find_job(self, parts):
+        if len(parts) != 2 or parts[0] != "jobs":
+            self.send_error_json(HTTPStatus.NOT_FOUND, "Not found")
+            return None
+        job = self.server.jobs.jobs.get(parts[1])
+        if job is None:
+            self.send_error_json(HTTPStatus.NOT_FOUND, f"No job with id {parts[1]}")
+        return job
+
+    def do_GET(self):
+        parts, query = self.route()
+        if parts == ["attacks"]:
+            self.send_json(HTTPStatus.OK, {"attacks": sorted({*attacks.installed(), *attacks.builtin()})})
+        elif parts == ["jobs"]:
+            self.send_json(HTTPStatus.OK, {"jobs": [job.summary() for job in list(self.server.jobs.jobs.values())]})
+        else:
+            job = self.find_job(parts)
+            if job is None:
+                return
+            try:
+                wait = float(query.get("wait", ["0"])[0])
+            except ValueError:
+                self.send_error_json(HTTPStatus.BAD_REQUEST, "Bad wait value")
+                return
+            if wait > 0:
+                job.done.wait(wait)
+            self.send_json(HTTPStatus.OK, job.report())
+
+    def do_POST(self):
+        parts, _ = self.route()
+        if parts != ["jobs"]:
+            self.send_error_json(HTTPStatus.NOT_FOUND, "Not found")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if not 0 < length <= MAX_REQUEST_SIZE:
+            self.send_error_json(HTTPStatus.BAD_REQUEST, "Missing or bad Content-Length")
+            return
+        try:
+            request = parse_job_request(json.loads(self.rfile.read(length)))
+        except ValueError as e:
+            self.send_error_json(HTTPStatus.BAD_REQUEST, str(e))
+            return
+        job = self.server.jobs.submit(request)
+        self.send_json(HTTPStatus.CREATED, job.summary())
+
+    def do_DELETE(self):
+        parts, _ = self.route()
+        job = self.find_job(parts)
+        if job is None:
+            return
+        if not self.server.jobs.cancel(job):
+            self.send_error_json(HTTPStatus.CONFLICT, f"Job {job.id} is already {job.status}")
+            return
+        self.send_json(HTTPStatus.OK, job.summary())
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        UnixStreamServer.server_bind(self)
+        self.server_name = socket.gethostname()
+        self.server_port = 0
+
+
+def run():
+    if args.concurrency <= 0:
+        raise ValueError("Concurrency must be a positive number")
+
+    # Warm state shared by every job
+    _, cyg_runtime = sage.get_sage()
+    env = attack_env(stage_attack_lib(), cyg_runtime)
+
+    if args.unix_socket is not None:
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError("Unix sockets are not supported on this platform")
+        path = Path(args.unix_socket)
+        if path.is_socket():
+            path.unlink()
+        server = ThreadingUnixHTTPServer(str(path), APIHandler)
+        where = str(path)
+    else:
+        server = ThreadingHTTPServer(args.listen, APIHandler)
+        host, port, *_ = server.server_address
+        where = f"http://{host}:{port}"
+
+    server.jobs = JobQueue()
+    for _ in range(args.concurrency):
+        Thread(target=job_runner, args=(server.jobs, env, cyg_runtime), daemon=True).start()
+
+    # Shut down cleanly when terminated, not leaving attacks running
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    output.info(f"Serving on {where}, running up to {args.concurrency} jobs at once")
+    with server:
+        try:
+            server.serve_forever()
+        finally:
+            server.jobs.shutdown(sage.TERMINATE_GRACE + sage.CANCEL_POLL_INTERVAL)
+            if args.unix_socket is not None:
+                Path(args.unix_socket).unlink()
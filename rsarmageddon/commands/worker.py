@@ -0,0 +1,157 @@
+##########################################################################
+# RSArmageddon - RSA cryptography and cryptoanalysis toolkit             #
+# Copyright (C) 2020,2021                                                #
+# Vittorio Mignini a.k.a. M1gnus <vittorio.mignini@gmail.com>            #
+# Simone Cimarelli a.k.a. Aquilairreale <aquilairreale@ymail.com>        #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <https://www.gnu.org/licenses/>. #
+##########################################################################
+
+import io
+import os
+import json
+import time
+import socket
+
+from tempfile import NamedTemporaryFile
+
+from .. import sage
+from .. import cluster
+from ..args import args
+from ..attacks import attack_path
+from ..utils import output
+from .attack import (
+        run_attack_output, parse_output, write_input, update_key_status,
+        stage_attack_lib, attack_env)
+
+
+CONNECT_RETRY_INTERVAL = 2
+
+
+def connect(address, wait):
+    """Connect to the coordinator, retrying for up to wait seconds
+
+    Arguments:
+    address -- (host, port) tuple
+    wait -- seconds to keep retrying for
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            return socket.create_connection(address)
+        except OSError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(CONNECT_RETRY_INTERVAL)
+
+
+def attack_shard(shard, env, cyg_runtime=None):
+    """Run the attacks requested by the coordinator on a shard of keys,
+    leaving keys out of later attacks once recovered and running single
+    key attacks on every key as attack does
+
+    Returns the list of result records sent back to the coordinator
+
+    Arguments:
+    shard -- shard message received from the coordinator
+    env -- environment of the Sage processes
+    cyg_runtime -- Cygwin runtime directory (Windows only)
+    """
+    keys = [((int(n), int(e)), name) for n, e, name in shard["keys"]]
+    ciphertexts = [
+        (int(text), name if name is not None else True)
+        for text, name in shard["ciphertexts"]
+    ]
+
+    results = []
+    status = {}
+    for attack in shard["attacks"]:
+        try:
+            script_manager = attack_path(attack)
+        except ValueError as e:
+            output.error(e)
+            results.append({"attack": attack, "returncode": 1, "output": ""})
+            continue
+
+        # Attacks working on the first key only are run again on every
+        # pending key, one at a time
+        attempted = set()
+        candidates = (
+            (key, name) for key, name in keys
+            if key not in status and key not in attempted
+        )
+        with script_manager as script:
+            attack_keys = keys
+            while True:
+                first_key, _ = attack_keys[0]
+                attempted.add(first_key)
+                metrics_stream = io.StringIO() if shard.get("metrics") else None
+                with NamedTemporaryFile("w", encoding="ascii") as input_file:
+                    write_input(input_file, attack_keys, ciphertexts, args.color, cyg_runtime, non_interactive=True)
+                    returncode, script_output = run_attack_output(
+                            attack, script, input_file.name, env,
+                            metrics_stream, timeout=shard.get("timeout"))
+
+                records = []
+                if metrics_stream is not None:
+                    records = [json.loads(line) for line in metrics_stream.getvalue().splitlines()]
+                results.append({
+                    "attack": attack,
+                    "returncode": returncode,
+                    "output": script_output,
+                    "metrics": records
+                })
+
+                _, recovered, counters = parse_output(script_output)
+                if update_key_status(status, returncode, recovered, first_key):
+                    keys = [(key, name) for key, name in keys if key not in status]
+
+                if not keys or not counters.get("single_key"):
+                    break
+                candidate = next(candidates, None)
+                if candidate is None:
+                    break
+                attack_keys = [candidate]
+
+        if not keys:
+            break
+
+    return results
+
+
+def run():
+    _, cyg_runtime = sage.get_sage()
+    env = attack_env(stage_attack_lib(), cyg_runtime)
+
+    name = args.worker_name or f"{socket.gethostname()}-{os.getpid()}"
+    host, port = args.coordinator
+
+    connection = cluster.Connection(connect((host, port), args.connect_wait))
+    try:
+        connection.send({"type": "hello", "worker": name})
+        output.info(f"Connected to coordinator {host}:{port} as {name}")
+        while True:
+            message = connection.receive()
+            if message.get("type") == "done":
+                break
+            if message.get("type") != "shard":
+                continue
+            output.info(f"Attacking shard {message['id']} ({len(message['keys'])} keys)")
+            with cluster.Heartbeat(connection):
+                results = attack_shard(message, env, cyg_runtime)
+            connection.send({"type": "result", "id": message["id"], "results": results})
+    finally:
+        connection.close()
+
+    output.success("No shards left, exiting")
@@ -19,15 +19,21 @@
 ##########################################################################
 
 import sys
+import struct
+import hashlib
 import binascii
 
 from pathlib import Path
-from functools import partial
-from gmpy2 import invert
+from operator import mul
+from itertools import count
+from functools import partial, reduce, lru_cache
+from gmpy2 import invert, powmod
 from Crypto.Cipher import PKCS1_OAEP, PKCS1_v1_5
 from Crypto.PublicKey import RSA
 
-from .utils import to_bytes_auto, DEFAULT_E
+from .utils import (
+        to_bytes_auto, byte_length, imap_chunked, recover_pq,
+        compute_extra_key_elements, compute_crt_elements, DEFAULT_E)
 
 
 standards = {
@@ -66,7 +72,177 @@ def cipher(m, n, e=None, std="pkcs"):
     return int.from_bytes(encryptor.encrypt(to_bytes_auto(m)), "big")
 
 
-def uncipher(c, n, e=None, d=None, std="pkcs"):
+PREPARED_KEYS_CACHE = 256
+
+
+def mgf1(seed, length, hash_factory=hashlib.sha1):
+    """PKCS#1 mask generation function MGF1
+
+    Arguments:
+    seed -- bytes object
+    length -- mask length
+    hash_factory -- hashlib constructor
+    """
+    mask = bytearray()
+    for counter in count():
+        if len(mask) >= length:
+            break
+        mask += hash_factory(seed + counter.to_bytes(4, "big")).digest()
+    return bytes(mask[:length])
+
+
+def unpad_pkcs1_v15(em):
+    """Remove PKCS#1 v1.5 encryption padding, return None if invalid
+
+    Arguments:
+    em -- encoded message, as long as the modulus
+    """
+    if em[:2] != b"\x00\x02":
+        return None
+    sep = em.find(b"\x00", 2)
+    if sep < 10: # Less than 8 bytes of padding, or no separator
+        return None
+    return em[sep+1:]
+
+
+def unpad_oaep(em, hash_factory=hashlib.sha1, label=b""):
+    """Remove OAEP encryption padding, return None if invalid
+
+    Arguments:
+    em -- encoded message, as long as the modulus
+    hash_factory -- hashlib constructor
+    label -- OAEP label
+    """
+    h_len = hash_factory().digest_size
+    if len(em) < 2*h_len + 2 or em[0] != 0:
+        return None
+    masked_seed = em[1:1+h_len]
+    masked_db = em[1+h_len:]
+    seed = bytes(a ^ b for a, b in zip(masked_seed, mgf1(masked_db, h_len, hash_factory)))
+    db = bytes(a ^ b for a, b in zip(masked_db, mgf1(seed, len(masked_db), hash_factory)))
+    if db[:h_len] != hash_factory(label).digest():
+        return None
+    rest = db[h_len:].lstrip(b"\x00")
+    if rest[:1] != b"\x01":
+        return None
+    return rest[1:]
+
+
+unpadders = {
+    "oaep": unpad_oaep,
+    "pkcs": unpad_pkcs1_v15
+}
+
+
+class PreparedKey:
+    """RSA private key with precomputed CRT elements
+
+    Recovering p and q from d is expensive, so a prepared key should be
+    reused for every ciphertext and standard (see prepare_key). Keys
+    whose factors cannot be recovered fall back to plain exponentiation.
+    Multi-prime keys are decrypted with Garner's algorithm over all of
+    their factors, and unpadded here since pycryptodome cannot handle
+    them
+    """
+
+    def __init__(self, n, e, d, p=None, q=None, other_primes=()):
+        if other_primes and (p is None or q is None):
+            raise ValueError("Multi-prime keys need all of their factors")
+        if p is None or q is None:
+            try:
+                p, q = recover_pq(n, e, d)
+            except ValueError:
+                p, q = None, None
+        primes = (p, q, *other_primes)
+        if p is not None and (reduce(mul, primes) != n or p in (1, n)):
+            if other_primes:
+                raise ValueError("n is not equal to the product of primes")
+            p, q = None, None
+
+        self.n, self.e, self.d, self.p, self.q = n, e, d, p, q
+        self.other_primes = tuple(other_primes)
+        if p is not None:
+            self.dp, self.dq, _, self.qinv = compute_extra_key_elements(d, p, q)
+            self.other_crt = compute_crt_elements(d, primes)[2:]
+        self._decryptors = {}
+
+    def decrypt_raw(self, c):
+        """Decrypt a ciphertext with textbook RSA
+
+        Arguments:
+        c -- ciphertext, reduced modulo n
+        """
+        if self.p is None:
+            return int(powmod(c, self.d, self.n))
+        m1 = powmod(c, self.dp, self.p)
+        m2 = powmod(c, self.dq, self.q)
+        h = self.qinv * (m1 - m2) % self.p
+        m = m2 + h*self.q
+        product = self.p * self.q
+        for r, dr, t in self.other_crt:
+            mr = powmod(c, dr, r)
+            m += product * ((mr - m) * t % r)
+            product *= r
+        return int(m)
+
+    def decryptor(self, std):
+        """Return a cached pycryptodome decryptor for an encryption standard
+
+        Arguments:
+        std -- encryption standard
+        """
+        try:
+            return self._decryptors[std]
+        except KeyError:
+            pass
+
+        if self.p is None:
+            key = RSA.construct((self.n, self.e, self.d))
+        else:
+            key = RSA.construct((self.n, self.e, self.d, self.p, self.q))
+        standard = standards[std]
+
+        decryptor = standard.new(key)
+
+        if standard is PKCS1_v1_5:
+            decryptor.decrypt = partial(decryptor.decrypt, sentinel=None)
+
+        self._decryptors[std] = decryptor
+        return decryptor
+
+    def decrypt(self, c, std):
+        """Decrypt a ciphertext, return None if its padding is invalid
+
+        Arguments:
+        c -- ciphertext, reduced modulo n
+        std -- encryption standard
+        """
+        if std == "raw":
+            return self.decrypt_raw(c)
+        k = byte_length(self.n)
+        if self.other_primes:
+            dec = unpadders[std](self.decrypt_raw(c).to_bytes(k, "big"))
+        else:
+            dec = self.decryptor(std).decrypt(int(c).to_bytes(k, "big"))
+        return int.from_bytes(dec, "big") if dec is not None else None
+
+
+@lru_cache(maxsize=PREPARED_KEYS_CACHE)
+def prepare_key(n, e, d, p=None, q=None, other_primes=()):
+    """Return a PreparedKey, cached for the most recently used keys
+
+    Arguments:
+    n -- RSA modulus
+    e -- RSA public exponent
+    d -- RSA private exponent
+    p -- RSA first factor, recovered from d if missing
+    q -- RSA second factor, recovered from d if missing
+    other_primes -- tuple of RSA additional factors of multi-prime keys
+    """
+    return PreparedKey(n, e, d, p, q, other_primes)
+
+
+def uncipher(c, n, e=None, d=None, std="pkcs", p=None, q=None, other_primes=()):
     """Decrypt a plaintext using RSA
 
     Arguments:
@@ -74,6 +250,9 @@ def uncipher(c, n, e=None, d=None, std="pkcs"):
     n -- RSA modulus
     d -- RSA private exponent
     std -- encryption standard
+    p -- RSA first factor, speeds up decryption if given
+    q -- RSA second factor, speeds up decryption if given
+    other_primes -- tuple of RSA additional factors of multi-prime keys
     """
 
     if e is None:
@@ -81,18 +260,145 @@ def uncipher(c, n, e=None, d=None, std="pkcs"):
 
     c %= n
 
-    if std == "raw":
-        return pow(c, d, n)
+    key = prepare_key(n, e, d, p, q, tuple(other_primes))
 
-    key = RSA.construct((n, e, d))
-    standard = standards[std]
+    dec = key.decrypt(c, std)
+    if dec is None:
+        raise ValueError(f"Invalid ciphertext (encryption standard: {std})")
+    return dec
 
-    decryptor = standard.new(key)
 
-    if standard is PKCS1_v1_5:
-        decryptor.decrypt = partial(decryptor.decrypt, sentinel=None)
+# Framed stream layout: STREAM_MAGIC, a version byte, the encryption
+# standard name preceded by its length, the block size (modulus byte
+# length), then one record per block: plaintext length followed by a
+# block size long ciphertext
+STREAM_MAGIC = b"RSAF"
+STREAM_VERSION = 1
+STREAM_CHUNK_BLOCKS = 64
 
-    dec = decryptor.decrypt(to_bytes_auto(c))
-    if dec is None:
-        raise ValueError(f"Invalid ciphertext (encryption standard: {std})")
-    return int.from_bytes(dec, "big")
+# Bytes taken by padding in every block
+stream_overhead = {
+    "raw": 1,
+    "pkcs": 11,
+    "oaep": 42 # 2 SHA-1 digests + 2
+}
+
+
+def stream_block_size(n, std):
+    """Return the number of plaintext bytes encrypted in each block
+
+    Arguments:
+    n -- RSA modulus
+    std -- encryption standard
+    """
+    size = byte_length(n) - stream_overhead[std]
+    if size < 1:
+        raise ValueError(f"Modulus too small for encryption standard {std}")
+    return size
+
+
+def _encrypt_blocks(n, e, std, blocks):
+    return [(len(block), cipher(int.from_bytes(block, "big"), n, e, std)) for block in blocks]
+
+
+def _decrypt_blocks(n, e, d, p, q, other_primes, std, records):
+    blocks = []
+    for length, c in records:
+        try:
+            blocks.append(uncipher(c, n, e, d, std, p, q, other_primes).to_bytes(length, "big"))
+        except OverflowError as err:
+            raise ValueError("Plaintext block longer than its recorded length") from err
+    return blocks
+
+
+def encrypt_stream(infile, outfile, n, e=None, std="pkcs", jobs=None):
+    """Encrypt a binary stream block by block into a framed stream
+
+    Blocks are encrypted by a pool of worker processes, and only a
+    bounded number of them is held in memory at any time
+
+    Arguments:
+    infile -- binary file object to read plaintext from
+    outfile -- binary file object to write the framed stream to
+
+    Keyword arguments:
+    n -- RSA modulus
+    e -- RSA public exponent
+    std -- encryption standard
+    jobs -- number of worker processes (default: number of CPUs)
+    """
+    if e is None:
+        e = DEFAULT_E
+    size = stream_block_size(n, std)
+    k = byte_length(n)
+
+    std_name = std.encode("ascii")
+    outfile.write(STREAM_MAGIC)
+    outfile.write(struct.pack(">BB", STREAM_VERSION, len(std_name)))
+    outfile.write(std_name)
+    outfile.write(struct.pack(">I", k))
+
+    blocks = iter(partial(infile.read, size), b"")
+    records = imap_chunked(
+            partial(_encrypt_blocks, n, e, std), blocks,
+            jobs=jobs, chunk_size=STREAM_CHUNK_BLOCKS)
+    for length, c in records:
+        outfile.write(struct.pack(">I", length))
+        outfile.write(c.to_bytes(k, "big"))
+
+
+def _read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated framed stream")
+    return data
+
+
+def decrypt_stream(infile, outfile, n, e=None, d=None, p=None, q=None, other_primes=(), jobs=None):
+    """Decrypt a framed stream written by encrypt_stream
+
+    The encryption standard is read from the stream header
+
+    Arguments:
+    infile -- binary file object to read the framed stream from
+    outfile -- binary file object to write plaintext to
+
+    Keyword arguments:
+    n -- RSA modulus
+    e -- RSA public exponent
+    d -- RSA private exponent
+    p -- RSA first factor, speeds up decryption if given
+    q -- RSA second factor, speeds up decryption if given
+    other_primes -- tuple of RSA additional factors of multi-prime keys
+    jobs -- number of worker processes (default: number of CPUs)
+    """
+    if e is None:
+        e = DEFAULT_E
+
+    if infile.read(len(STREAM_MAGIC)) != STREAM_MAGIC:
+        raise ValueError("Not a framed stream")
+    version, std_len = struct.unpack(">BB", _read_exactly(infile, 2))
+    if version != STREAM_VERSION:
+        raise ValueError(f"Unsupported framed stream version {version}")
+    std = _read_exactly(infile, std_len).decode("ascii")
+    if std not in stream_overhead:
+        raise ValueError(f"Unknown encryption standard {std!r} in framed stream")
+    k, = struct.unpack(">I", _read_exactly(infile, 4))
+    if k != byte_length(n):
+        raise ValueError(f"Framed stream block size ({k}) does not match the key ({byte_length(n)})")
+
+    def records():
+        while True:
+            header = infile.read(4)
+            if not header:
+                return
+            if len(header) != 4:
+                raise ValueError("Truncated framed stream")
+            length, = struct.unpack(">I", header)
+            yield length, int.from_bytes(_read_exactly(infile, k), "big")
+
+    blocks = imap_chunked(
+            partial(_decrypt_blocks, n, e, d, p, q, tuple(other_primes), std), records(),
+            jobs=jobs, chunk_size=STREAM_CHUNK_BLOCKS)
+    for block in blocks:
+        outfile.write(block)
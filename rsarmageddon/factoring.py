@@ -0,0 +1,126 @@
+##########################################################################
+# RSArmageddon - RSA cryptography and cryptoanalysis toolkit             #
+# Copyright (C) 2020,2021                                                #
+# Vittorio Mignini a.k.a. M1gnus <vittorio.mignini@gmail.com>            #
+# Simone Cimarelli a.k.a. Aquilairreale <aquilairreale@ymail.com>        #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <https://www.gnu.org/licenses/>. #
+##########################################################################
+
+# In-process factorization of numbers whose factors are small enough for
+# trial division and a short Pollard rho, so that the factor and
+# eulerphi commands only need Sage for the hard ones
+
+from gmpy2 import mpz, gcd, is_prime, next_prime
+
+
+TRIAL_BOUND = 1 << 16
+RHO_ITERATIONS = 1 << 16
+RHO_CONSTANTS = (1, 3, 5)
+
+
+def rho(n, c, iterations=RHO_ITERATIONS):
+    """Look for a factor of a composite number with Pollard's rho
+    (Brent's variant)
+
+    Returns a factor, n itself if the sequence cycled without splitting
+    n (another c may work), or None after iterations steps
+
+    Arguments:
+    n -- odd composite number
+    c -- constant of the polynomial x^2 + c
+    iterations -- maximum number of steps
+    """
+    n = mpz(n)
+    y = x = ys = mpz(2)
+    q = g = mpz(1)
+    r = 1
+    m = 128
+    while g == 1:
+        if r > iterations:
+            return None
+        x = y
+        for _ in range(r):
+            y = (y*y + c) % n
+        k = 0
+        while k < r and g == 1:
+            ys = y
+            for _ in range(min(m, r - k)):
+                y = (y*y + c) % n
+                q = q*abs(x - y) % n
+            g = gcd(q, n)
+            k += m
+        r *= 2
+    if g == n:
+        # The batched product hit 0 mod n, step back one at a time
+        g = mpz(1)
+        while g == 1:
+            ys = (ys*ys + c) % n
+            g = gcd(abs(x - ys), n)
+    return int(g)
+
+
+def factorize(n, trial_bound=TRIAL_BOUND, rho_iterations=RHO_ITERATIONS):
+    """Factor a positive integer by trial division and Pollard's rho
+
+    Returns a sorted list of (prime, exponent) tuples, or None if some
+    factor could not be found within the given effort. Primality of the
+    factors is checked with probabilistic tests
+
+    Arguments:
+    n -- positive integer
+    trial_bound -- largest trial divisor
+    rho_iterations -- maximum number of rho steps for each constant
+    """
+    if n < 1:
+        raise ValueError("Only positive integers can be factored")
+
+    factors = {}
+    n = mpz(n)
+    p = mpz(2)
+    while p <= trial_bound and p*p <= n:
+        while n % p == 0:
+            n //= p
+            factors[int(p)] = factors.get(int(p), 0) + 1
+        p = next_prime(p)
+
+    composites = [n] if n > 1 else []
+    while composites:
+        m = composites.pop()
+        if is_prime(m):
+            factors[int(m)] = factors.get(int(m), 0) + 1
+            continue
+        for c in RHO_CONSTANTS:
+            d = rho(m, c, rho_iterations)
+            if d is None:
+                return None
+            if d != m:
+                composites.extend((mpz(d), m // d))
+                break
+        else:
+            return None
+
+    return sorted(factors.items())
+
+
+def euler_phi(factors):
+    """Return Euler's phi of a number given its factorization
+
+    Arguments:
+    factors -- list of (prime, exponent) tuples, as returned by factorize
+    """
+    phi = 1
+    for p, k in factors:
+        phi *= (p - 1) * p**(k - 1)
+    return phi
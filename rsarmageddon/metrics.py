@@ -0,0 +1,111 @@
+##########################################################################
+# RSArmageddon - RSA cryptography and cryptoanalysis toolkit             #
+# Copyright (C) 2020,2021                                                #
+# Vittorio Mignini a.k.a. M1gnus <vittorio.mignini@gmail.com>            #
+# Simone Cimarelli a.k.a. Aquilairreale <aquilairreale@ymail.com>        #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <https://www.gnu.org/licenses/>. #
+##########################################################################
+
+import sys
+import json
+import time
+
+from threading import Thread, Event
+from contextlib import contextmanager
+from psutil import Process, NoSuchProcess, AccessDenied
+
+
+SAMPLE_INTERVAL = 0.1
+
+
+class ProcessMonitor:
+    """Sample memory and CPU usage of a process tree in a background thread
+
+    Values are approximate: CPU time spent by a process after its last
+    sample and memory peaks shorter than the sample interval are missed
+    """
+
+    def __init__(self, pid, interval=SAMPLE_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._cpu_times = {}
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def cpu_time(self):
+        return sum(self._cpu_times.values())
+
+    def _sample(self):
+        try:
+            root = Process(self.pid)
+            procs = [root, *root.children(recursive=True)]
+        except NoSuchProcess:
+            return
+        rss = 0
+        for proc in procs:
+            try:
+                with proc.oneshot():
+                    mem = proc.memory_info()
+                    cpu = proc.cpu_times()
+            except (NoSuchProcess, AccessDenied):
+                continue
+            rss += mem.rss
+            self._cpu_times[proc.pid] = cpu.user + cpu.system
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def _run(self):
+        while True:
+            self._sample()
+            if self._stop.wait(self.interval):
+                break
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+@contextmanager
+def open_stream(path):
+    """Open a JSON lines metrics stream
+
+    Arguments:
+    path -- path of the file to append records to, True for standard
+            output, None to discard records
+    """
+    if path is None:
+        yield None
+    elif path is True:
+        yield sys.stdout
+    else:
+        with open(path, "a") as f:
+            yield f
+
+
+def emit(stream, record):
+    """Write a record to a metrics stream
+
+    Arguments:
+    stream -- file-like object as returned by open_stream, or None
+    record -- dict of JSON serializable values
+    """
+    if stream is None:
+        return
+    record = {"time": time.time(), **record}
+    stream.write(json.dumps(record))
+    stream.write("\n")
+    stream.flush()
@@ -0,0 +1,157 @@
+##########################################################################
+# RSArmageddon - RSA cryptography and cryptoanalysis toolkit             #
+# Copyright (C) 2020,2021                                                #
+# Vittorio Mignini a.k.a. M1gnus <vittorio.mignini@gmail.com>            #
+# Simone Cimarelli a.k.a. Aquilairreale <aquilairreale@ymail.com>        #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <https://www.gnu.org/licenses/>. #
+##########################################################################
+
+import os
+import random
+
+from timeit import Timer
+from base64 import b64encode
+from pathlib import Path
+from contextlib import redirect_stderr
+
+from .certs import load_key, load_keys, encode_pubkey, encode_privkey
+from .crypto import cipher, uncipher
+from .parsing import parse_int_arg, parse_n_e_file
+from .utils import complete_privkey, recover_pq, output_text, to_bytes_auto
+from .weakkeys import random_key
+
+
+KEYS = 10**5
+BITS = 8192
+KEY_FILE_BITS = 2048
+
+
+def scaled(count, scale):
+    return max(1, int(count * scale))
+
+
+def bench_load_key(workdir, big_key, small_key, scale):
+    path = workdir/"private.pem"
+    path.write_bytes(encode_privkey(*big_key, file_format="PEM"))
+    ops = scaled(5, scale)
+    return lambda: [load_key(path) for _ in range(ops)], ops
+
+
+def bench_load_keys(workdir, big_key, small_key, scale):
+    keys_dir = workdir/"keys"
+    keys_dir.mkdir()
+    data = encode_pubkey(*small_key[:2], "PEM")
+    ops = scaled(KEYS, scale)
+    for i in range(ops):
+        (keys_dir/f"{i}.pem").write_bytes(data)
+    return lambda: sum(1 for _ in load_keys(keys_dir)), ops
+
+
+def bench_parse_int_arg(workdir, big_key, small_key, scale):
+    n = big_key[0]
+    b64 = b64encode(to_bytes_auto(n)).decode("ascii")
+    texts = [str(n), hex(n), f"{b64}:b64"] * scaled(1000, scale)
+    return lambda: [parse_int_arg(s) for s in texts], len(texts)
+
+
+def bench_parse_n_e_file(workdir, big_key, small_key, scale):
+    path = workdir/"n_e.txt"
+    n, e, *_ = small_key
+    ops = scaled(KEYS, scale)
+    with open(path, "w") as f:
+        for _ in range(ops):
+            print(f"{n},{e}", file=f)
+    return lambda: sum(1 for _ in parse_n_e_file(path)), ops
+
+
+def bench_uncipher_raw(workdir, big_key, small_key, scale):
+    n, e, d, p, q = big_key
+    c = cipher(random.Random(0).randrange(n), n, e, "raw")
+    ops = scaled(3, scale)
+    return lambda: [uncipher(c, n, e, d, "raw") for _ in range(ops)], ops
+
+
+def bench_uncipher_pkcs(workdir, big_key, small_key, scale):
+    n, e, d, p, q = big_key
+    c = cipher(int.from_bytes(b"micro-benchmark", "big"), n, e, "pkcs")
+    ops = scaled(3, scale)
+    return lambda: [uncipher(c, n, e, d, "pkcs") for _ in range(ops)], ops
+
+
+def bench_complete_privkey(workdir, big_key, small_key, scale):
+    n, e, _, p, _ = big_key
+    ops = scaled(100, scale)
+    return lambda: [complete_privkey(n, e, None, p, None) for _ in range(ops)], ops
+
+
+def bench_recover_pq(workdir, big_key, small_key, scale):
+    n, e, d, _, _ = big_key
+    ops = scaled(3, scale)
+    return lambda: [recover_pq(n, e, d) for _ in range(ops)], ops
+
+
+def bench_output_text(workdir, big_key, small_key, scale):
+    text = big_key[0]
+    ops = scaled(1000, scale)
+    def f():
+        with open(os.devnull, "w") as devnull, redirect_stderr(devnull):
+            for _ in range(ops):
+                output_text("plaintext", text, True)
+    return f, ops
+
+
+benchmarks = {
+    "load_key": bench_load_key,
+    "load_keys": bench_load_keys,
+    "parse_int_arg": bench_parse_int_arg,
+    "parse_n_e_file": bench_parse_n_e_file,
+    "uncipher_raw": bench_uncipher_raw,
+    "uncipher_pkcs": bench_uncipher_pkcs,
+    "complete_privkey": bench_complete_privkey,
+    "recover_pq": bench_recover_pq,
+    "output_text": bench_output_text
+}
+
+
+def run(workdir, names=None, scale=1.0, repeat=3, seed=0):
+    """Run micro-benchmarks, yielding one record per benchmark
+
+    Every benchmark is timed repeat times and the best time is kept
+
+    Arguments:
+    workdir -- directory for the benchmarks' files
+
+    Keyword arguments:
+    names -- benchmarks to run (default: all)
+    scale -- factor applied to every benchmark's number of operations
+    repeat -- number of timed runs per benchmark
+    seed -- seed used to generate the benchmark keys
+    """
+    rng = random.Random(seed)
+    big_key = random_key(BITS, rng=rng)
+    small_key = random_key(KEY_FILE_BITS, rng=rng)
+    workdir = Path(workdir)
+
+    for name in names or benchmarks:
+        bench_dir = workdir/name
+        bench_dir.mkdir()
+        f, ops = benchmarks[name](bench_dir, big_key, small_key, scale)
+        seconds = min(Timer(f).repeat(repeat=repeat, number=1))
+        yield {
+            "name": name,
+            "ops": ops,
+            "seconds": seconds,
+            "per_op": seconds / ops
+        }
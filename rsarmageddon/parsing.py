@@ -18,15 +18,15 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>. #
 ##########################################################################
 
+import os
 import re
 import sys
+import json
 import binascii
-import subprocess
 
 from base64 import b64decode, b85decode
 from pathlib import Path
 
-from .crypto import standards
 from .utils import DEFAULT_E
 
 
@@ -123,6 +123,7 @@ def parse_int_list(s):
 
 
 def parse_std_list(s):
+    from .crypto import standards # imports pycryptodome
     all_standards = ["raw", *standards.keys()]
     allowed = {*all_standards, "all"}
     l = [x.strip().casefold() for x in s.split(",") if x.strip()]
@@ -135,12 +136,54 @@ def parse_std_list(s):
     return l
 
 
+def parse_fraction_list(s):
+    """Take a comma-separated list of name=fraction items and return
+    the corresponding dict
+
+    Arguments:
+    s -- string to convert
+    """
+    ret = {}
+    for item in (x for x in s.split(",") if x.strip()):
+        name, sep, fraction = item.partition("=")
+        if not sep:
+            raise ValueError(f"Missing fraction for '{name}'")
+        fraction = float(fraction)
+        if not 0 <= fraction <= 1:
+            raise ValueError(f"Fraction out of range for '{name}': {fraction}")
+        ret[name.strip()] = fraction
+    if sum(ret.values()) > 1:
+        raise ValueError("Fractions add up to more than 1")
+    return ret
+
+
+def parse_address(s):
+    """Parse a [HOST:]PORT string into a (host, port) tuple, host
+    defaulting to localhost
+    """
+    host, _, port = s.rpartition(":")
+    host = host.strip("[]") or "localhost"
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError(f"Bad port number '{port}'") from None
+    if not 0 <= port <= 65535:
+        raise ValueError(f"Bad port number '{port}'")
+    return host, port
+
+
 def path_or_stdout(s):
     if s == "-":
         return True
     return Path(s)
 
 
+def path_or_stdin(s):
+    if s == "-":
+        return True
+    return Path(s)
+
+
 def parse_n_e_file(filename):
     with open(filename, "r") as f:
         for line in f:
@@ -149,3 +192,81 @@ def parse_n_e_file(filename):
                 continue
             n, _, e = line.partition(",")
             yield (parse_int_arg(n), parse_int_arg(e) if e else DEFAULT_E)
+
+
+def parse_json_int(x):
+    """Convert a JSON number or a string in any format understood by
+    parse_int_arg to int
+
+    Arguments:
+    x -- int or str
+    """
+    if isinstance(x, int) and not isinstance(x, bool):
+        return x
+    if isinstance(x, str):
+        return parse_int_arg(x)
+    raise ValueError(f"Bad number {x!r}")
+
+
+def parse_jsonl_file(filename):
+    """Read public keys from a JSON lines file
+
+    Every line holds an object with an "n" field and optional "e" and
+    "name" fields, numbers can either be JSON numbers or strings
+
+    Arguments:
+    filename -- path to the JSON lines file
+    """
+    with open(filename, "r") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+                n = parse_json_int(obj["n"])
+                e = parse_json_int(obj["e"]) if obj.get("e") is not None else DEFAULT_E
+            except (ValueError, KeyError, TypeError) as exc:
+                raise ValueError(f"Bad key at line {lineno} of {filename}: {exc}") from exc
+            name = obj.get("name")
+            yield (n, e), str(name) if name is not None else None
+
+
+def parse_input_manifest(filename):
+    """Read batch inputs from a JSON lines file
+
+    Every line holds an object with either a "text" field, a number in
+    any format understood by parse_json_int, or a "file" field, a path to
+    a binary file relative to the manifest. Optional fields are "name",
+    which defaults to the line number and is used in output file names,
+    so it must be unique and cannot contain path separators, and "key",
+    the name of the only key the input is meant for. Yields (name, text,
+    key) tuples
+
+    Arguments:
+    filename -- path to the JSON lines file
+    """
+    base = Path(filename).parent
+    names = set()
+    with open(filename, "r") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+                if "file" in obj:
+                    with open(base/obj["file"], "rb") as text_file:
+                        text = int.from_bytes(text_file.read(), "big")
+                else:
+                    text = parse_json_int(obj["text"])
+            except (ValueError, KeyError, TypeError, OSError) as exc:
+                raise ValueError(f"Bad input at line {lineno} of {filename}: {exc}") from exc
+            name = str(obj.get("name", lineno))
+            if name in ("", ".", "..") or any(sep and sep in name for sep in (os.sep, os.altsep, "/")):
+                raise ValueError(f"Bad input at line {lineno} of {filename}: name must be a plain file name")
+            if name in names:
+                raise ValueError(f"Bad input at line {lineno} of {filename}: name '{name}' is already used")
+            names.add(name)
+            key = obj.get("key")
+            yield name, text, str(key) if key is not None else None
@@ -0,0 +1,165 @@
+##########################################################################
+# RSArmageddon - RSA cryptography and cryptoanalysis toolkit             #
+# Copyright (C) 2020,2021                                                #
+# Vittorio Mignini a.k.a. M1gnus <vittorio.mignini@gmail.com>            #
+# Simone Cimarelli a.k.a. Aquilairreale <aquilairreale@ymail.com>        #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <https://www.gnu.org/licenses/>. #
+##########################################################################
+
+# Pool of the primes recovered by attacks, tested against the moduli of
+# the keys not recovered yet. Reused primes are common among keys made
+# with poor randomness, and a modulus sharing a prime with the pool
+# falls without running any attack.
+#
+# Moduli are tested in batches: a product tree of the batch is built,
+# the product of the new primes is reduced down the tree to get its
+# remainder modulo every modulus, and gcd(remainder, n) is the product
+# of the new primes dividing n. Only primes added since the last sweep
+# are tested, so each prime is tested once against every pending key.
+
+from gmpy2 import mpz, gcd, is_prime
+
+from .utils import recover_pq
+
+
+SWEEP_BATCH = 4096
+
+
+def product_tree(values):
+    """Return the levels of the product tree of values, leaves first
+
+    Arguments:
+    values -- non-empty list of integers
+    """
+    tree = [[mpz(v) for v in values]]
+    while len(tree[-1]) > 1:
+        level = tree[-1]
+        tree.append([
+            level[i]*level[i+1] if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)
+        ])
+    return tree
+
+
+def remainders(value, moduli):
+    """Return value modulo every modulus, using a remainder tree
+
+    Arguments:
+    value -- integer
+    moduli -- non-empty list of integers
+    """
+    tree = product_tree(moduli)
+    rems = [mpz(value) % tree[-1][0]]
+    for level in reversed(tree[:-1]):
+        rems = [rems[i//2] % node for i, node in enumerate(level)]
+    return rems
+
+
+def key_primes(key):
+    """Return the primes of a recovered key
+
+    Arguments:
+    key -- (n, e, d, p, q, *other_primes) tuple as output by attacks,
+           where at most one prime, or both p and q, may be missing
+    """
+    n, e, d, p, q, *other_primes = key
+    if p is None and q is None:
+        if other_primes or d is None:
+            raise ValueError("Not enough key elements to recover its primes")
+        p, q = recover_pq(n, e, d)
+    primes = [r for r in (p, q, *other_primes) if r is not None]
+    product = 1
+    for r in primes:
+        product *= r
+    if n is not None and product != n:
+        primes.append(n // product)
+    return primes
+
+
+class PrimePool:
+    """Set of known primes, to factor moduli with"""
+
+    def __init__(self):
+        self.primes = set()
+        self._auto_names = 0
+
+    def add(self, primes):
+        """Add primes to the pool, returning the set of those that were
+        not in it yet
+        """
+        new = {int(r) for r in primes} - self.primes
+        self.primes |= new
+        return new
+
+    def _factor(self, n, g, primes):
+        """Return the sorted primes of n given the product g of the new
+        primes dividing it, or None if n is not fully factored
+
+        The cofactor left after dividing n by the known primes is
+        accepted if prime, and becomes a new prime for the pool
+        """
+        found = [r for r in primes if g % r == 0]
+        cofactor = n
+        for r in found:
+            cofactor //= r
+        if cofactor != 1:
+            if not is_prime(cofactor):
+                return None
+            found.append(int(cofactor))
+        return sorted(found)
+
+    def _sweep_batch(self, value, primes, batch, factored, cofactors):
+        rems = remainders(value, [n for (n, _), _ in batch])
+        for ((n, e), name), rem in zip(batch, rems):
+            g = gcd(rem, n)
+            if g == 1:
+                continue
+            factors = self._factor(n, g, primes)
+            if factors is None or len(factors) < 2:
+                continue
+            if name is None:
+                name = f"prime_pool_{self._auto_names}"
+                self._auto_names += 1
+            p, q, *other_primes = factors
+            factored.append(((n, e, None, p, q, *other_primes), name))
+            cofactors.update(r for r in factors if r not in self.primes)
+
+    def sweep(self, primes, keys):
+        """Test primes against keys
+
+        Returns a list of ((n, e, None, *primes), name) tuples for the
+        keys fully factored, as returned by run_attack, and the set of
+        primes found as cofactors of those keys which are not in the pool
+
+        Arguments:
+        primes -- primes to test, already in the pool
+        keys -- iterable of ((n, e), name) tuples
+        """
+        primes = sorted(primes)
+        value = mpz(1)
+        for r in primes:
+            value *= r
+
+        factored = []
+        cofactors = set()
+        batch = []
+        for key in keys:
+            batch.append(key)
+            if len(batch) >= SWEEP_BATCH:
+                self._sweep_batch(value, primes, batch, factored, cofactors)
+                batch = []
+        if batch:
+            self._sweep_batch(value, primes, batch, factored, cofactors)
+        return factored, cofactors
@@ -21,6 +21,8 @@
 import os
 import sys
 import re
+import json
+import time
 import shutil
 import subprocess
 
@@ -28,10 +30,14 @@ from textwrap import dedent
 from pathlib import Path, PurePosixPath
 from tempfile import TemporaryDirectory
 from itertools import count, chain
+from threading import Thread
 from subprocess import Popen, PIPE, TimeoutExpired
-from psutil import Process, wait_procs
+from psutil import Process, NoSuchProcess, wait_procs
 
-from .utils import output
+from . import cache
+from . import attack_lib
+from .utils import output, file_checksum
+from .metrics import ProcessMonitor
 
 
 if os.name == "nt":
@@ -48,6 +54,20 @@ NO_JAVA = "This program will not run on Jython and other Java based execution en
 
 SUPPORTED_VMAJ = 9
 
+# Time given to attacks to save their progress when timing out
+TERMINATE_GRACE = 5
+CANCEL_POLL_INTERVAL = 0.5
+
+
+class Cancelled(Exception):
+    """Raised by run when a script is cancelled, with the output read so
+    far in its output attribute
+    """
+
+    def __init__(self):
+        super().__init__("Script cancelled")
+        self.output = ""
+
 
 def best_version(versions):
     supported = [(vmaj, vmin) for vmaj, vmin in versions if vmaj == SUPPORTED_VMAJ]
@@ -149,11 +169,84 @@ def get_sage_java():
     raise RuntimeError(NO_JAVA)
 
 
+SAGE_CACHE = "sage.json"
+
+
+def sage_fingerprint(sage, cyg_runtime):
+    """Return the values a cached Sage discovery is valid for
+
+    Arguments:
+    sage -- path to the sage executable
+    cyg_runtime -- Cygwin runtime directory (Windows only)
+    """
+    if cyg_runtime is None:
+        # which is cheap, the version probe is what is being saved
+        if shutil.which("sage") != sage:
+            return None
+        exe = Path(sage)
+    else:
+        exe = Path(cyg_runtime)
+    try:
+        mtime = exe.stat().st_mtime_ns
+    except OSError:
+        return None
+    return {"path": os.environ.get("PATH", ""), "mtime": mtime}
+
+
+def load_cached_sage():
+    """Return the (version, sage, cyg_runtime) tuple saved by
+    save_cached_sage, or None if missing or stale
+    """
+    try:
+        with open(cache.cache_dir()/SAGE_CACHE, "r") as f:
+            cached = json.load(f)
+        version = tuple(cached["version"])
+        sage, cyg_runtime = cached["sage"], cached["cyg_runtime"]
+        if sage_fingerprint(sage, cyg_runtime) != cached["fingerprint"]:
+            return None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if cyg_runtime is not None:
+        sage, cyg_runtime = PurePosixPath(sage), Path(cyg_runtime)
+    return version, sage, cyg_runtime
+
+
+def save_cached_sage(version, sage, cyg_runtime):
+    """Save the result of a Sage discovery, along with the values it
+    depends on, to the cache directory
+
+    Arguments:
+    version -- (major, minor) tuple
+    sage -- path to the sage executable
+    cyg_runtime -- Cygwin runtime directory (Windows only)
+    """
+    sage = str(sage)
+    cyg_runtime = str(cyg_runtime) if cyg_runtime is not None else None
+    fingerprint = sage_fingerprint(sage, cyg_runtime)
+    if fingerprint is None:
+        return
+    cached = {
+        "version": list(version),
+        "sage": sage,
+        "cyg_runtime": cyg_runtime,
+        "fingerprint": fingerprint
+    }
+    path = cache.cache_dir()/SAGE_CACHE
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "w") as f:
+            json.dump(cached, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
 sage = None
 cyg_runtime = None
+sage_version = None
 
 def get_sage():
-    global sage, cyg_runtime
+    global sage, cyg_runtime, sage_version
     if sage is not None:
         return sage, cyg_runtime
     get_sage_by_platform = {
@@ -161,8 +254,13 @@ def get_sage():
         "nt": get_sage_nt,
         "java": get_sage_java
     }
-    version, sage, cyg_runtime = get_sage_by_platform[os.name]()
-    vmaj, vmin = version
+    cached = load_cached_sage()
+    if cached is not None:
+        sage_version, sage, cyg_runtime = cached
+    else:
+        sage_version, sage, cyg_runtime = get_sage_by_platform[os.name]()
+        save_cached_sage(sage_version, sage, cyg_runtime)
+    vmaj, vmin = sage_version
     if vmaj != SUPPORTED_VMAJ:
         output.warning(f"Using unsupported SageMath version {vmaj}.{vmin}")
         output.warning(f"RSArmageddon is not supposed to work with versions other than {SUPPORTED_VMAJ}.x,")
@@ -170,22 +268,192 @@ def get_sage():
     return sage, cyg_runtime
 
 
-def run(script_path, *args, env=None, timeout=None):
-    script_path = Path(script_path).resolve()
+def preparse(script_path):
+    """Preparse a Sage script, returns the path to the resulting Python file
+
+    Arguments:
+    script_path -- path to the .sage script
+    """
     sage, cyg_runtime = get_sage()
-    with TemporaryDirectory() as writeable_dir:
-        new_path = Path(writeable_dir)/script_path.name
-        shutil.copy(script_path, new_path)
-        p = Popen(
-                [*cyg_bash(cyg_runtime), str(sage), str(cyg_path(new_path, cyg_runtime)), *args],
-                stdout=PIPE, env=env, text=True)
+    p = subprocess.run(
+            [*cyg_bash(cyg_runtime), str(sage), "--preparse", str(cyg_path(script_path, cyg_runtime))])
+    preparsed = script_path.with_name(f"{script_path.name}.py")
+    if p.returncode or not preparsed.is_file():
+        raise RuntimeError(f"Could not preparse Sage script {script_path.name}")
+    return preparsed
+
+
+def preparsed_script(script_path):
+    """Return the path to the cached preparsed version of a Sage script
+
+    Scripts are preparsed once per content and Sage version
+
+    Arguments:
+    script_path -- path to the .sage script
+    """
+    script_path = Path(script_path)
+    get_sage()
+    key = cache.checksum(file_checksum(script_path), "{}.{}".format(*sage_version))
+
+    def create(dest):
+        with TemporaryDirectory() as writeable_dir:
+            new_path = Path(writeable_dir)/script_path.name
+            shutil.copy(script_path, new_path)
+            shutil.copy(preparse(new_path), dest)
+
+    return cache.cached_file("preparsed", key, ".py", create)
+
+
+def terminate_tree(pid):
+    """Terminate a process and its children, killing the ones still
+    alive after TERMINATE_GRACE seconds
+
+    Arguments:
+    pid -- process id
+    """
+    try:
+        pp = Process(pid)
+        subprocesses = [pp, *pp.children(recursive=True)]
+    except NoSuchProcess:
+        return
+    for subp in subprocesses:
+        try:
+            subp.terminate()
+        except NoSuchProcess:
+            pass
+    _, alive = wait_procs(subprocesses, timeout=TERMINATE_GRACE)
+    for subp in alive:
         try:
-            output, _ = p.communicate(timeout=timeout)
-        except TimeoutExpired as e:
-            pp = Process(p.pid)
-            subprocesses = [pp, *pp.children(recursive=True)]
-            for subp in subprocesses:
-                subp.terminate()
-            wait_procs(subprocesses)
-            raise e
-    return p, output
+            subp.kill()
+        except NoSuchProcess:
+            pass
+
+
+def wait(p, timeout=None, cancel=None):
+    """Wait for a process to terminate
+
+    Raises TimeoutExpired after timeout seconds, or Cancelled as soon as
+    cancel is set
+
+    Arguments:
+    p -- Popen object
+    timeout -- maximum time to wait in seconds
+    cancel -- threading.Event, or None
+    """
+    if cancel is None:
+        p.wait(timeout=timeout)
+        return
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    while True:
+        interval = CANCEL_POLL_INTERVAL
+        if deadline is not None:
+            interval = min(interval, max(deadline - time.monotonic(), 0))
+        try:
+            p.wait(timeout=interval)
+            return
+        except TimeoutExpired:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutExpired(p.args, timeout) from None
+        if cancel.is_set():
+            raise Cancelled()
+
+
+def run(script_path, *args, env=None, timeout=None, stats=None, profile=None, stderr=None, cancel=None):
+    """Run a Sage script and return its process and standard output
+
+    The script is preparsed once and cached (see preparsed_script), then
+    run with Sage's Python interpreter. Raises TimeoutExpired if the
+    script does not terminate in time, with the output read so far in
+    its output attribute
+
+    Arguments:
+    script_path -- path to the script
+    args -- command line arguments for the script
+
+    Keyword arguments:
+    env -- environment of the Sage process
+    timeout -- maximum run time in seconds
+    stats -- if a dict is given, it is filled with timing and resource
+             usage figures of the run
+    profile -- if not None, the script is run under cProfile and the
+               collected stats are dumped to this path
+    stderr -- standard error of the Sage process, as accepted by Popen
+    cancel -- threading.Event, the script is terminated and Cancelled is
+              raised as soon as it is set
+    """
+    script_path = Path(script_path).resolve()
+    sage, cyg_runtime = get_sage()
+    script = preparsed_script(script_path)
+
+    if profile is None:
+        command = [str(sage), "-python", str(cyg_path(script, cyg_runtime))]
+    else:
+        profiler_dir = cache.staged_libs([(attack_lib, "profiler")])
+        command = [
+            str(sage), "-python",
+            str(cyg_path(profiler_dir/"profiler.py", cyg_runtime)),
+            str(cyg_path(Path(profile).resolve(), cyg_runtime)),
+            str(cyg_path(script, cyg_runtime))
+        ]
+
+    start = time.monotonic()
+    p = Popen(
+            [*cyg_bash(cyg_runtime), *command, *args],
+            stdout=PIPE, stderr=stderr, env=env, text=True)
+    spawned = time.monotonic()
+    monitor = ProcessMonitor(p.pid) if stats is not None else None
+
+    lines = []
+    first_output = None
+    def read_output():
+        nonlocal first_output
+        for line in p.stdout:
+            if first_output is None:
+                first_output = time.monotonic()
+            lines.append(line)
+    reader = Thread(target=read_output, daemon=True)
+    reader.start()
+
+    try:
+        wait(p, timeout, cancel)
+        reader.join()
+    except (TimeoutExpired, Cancelled) as e:
+        terminate_tree(p.pid)
+        reader.join(TERMINATE_GRACE)
+        e.output = "".join(lines)
+        raise e
+    finally:
+        end = time.monotonic()
+        if monitor is not None:
+            monitor.stop()
+            stats.update({
+                "spawn_time": spawned - start,
+                "time_to_first_output": first_output - start if first_output is not None else None,
+                "wall_time": end - start,
+                "cpu_time": monitor.cpu_time,
+                "peak_rss": monitor.peak_rss,
+                "returncode": p.returncode
+            })
+    return p, "".join(lines)
+
+
+def spawn(script_path, *args, env=None, stderr=None):
+    """Start a Sage script with pipes to its standard input and output,
+    in text mode and line buffered, and return its process
+
+    The script is preparsed once and cached, as by run
+
+    Arguments:
+    script_path -- path to the script
+    args -- command line arguments for the script
+
+    Keyword arguments:
+    env -- environment of the Sage process
+    stderr -- standard error of the Sage process, as accepted by Popen
+    """
+    script_path = Path(script_path).resolve()
+    sage, cyg_runtime = get_sage()
+    script = preparsed_script(script_path)
+    return Popen(
+            [*cyg_bash(cyg_runtime), str(sage), "-python", str(cyg_path(script, cyg_runtime)), *args],
+            stdin=PIPE, stdout=PIPE, stderr=stderr, env=env, text=True, bufsize=1)
@@ -18,32 +18,121 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>. #
 ##########################################################################
 
+import os
 import sys
 import json
+import signal
 import random
-import hashlib
 import importlib
 import importlib.machinery
 
 from pathlib import Path
 from shutil import copyfileobj
+from collections import deque
+from itertools import islice, chain
 from functools import partial
 from contextlib import redirect_stdout
-from importlib import resources, import_module
+from importlib import import_module
 from base64 import b64encode, urlsafe_b64encode
-from gmpy2 import invert, isqrt, gcd
 
 from . import output
 
+# gmpy2, multiprocessing, hashlib and importlib.resources are imported by
+# the functions that use them: this module is loaded by every invocation,
+# including the ones that only print a version or a list of attacks
+
 
 DEFAULT_E = 65537
 
 
+def Pool(*args, **kwargs):
+    """Create a multiprocessing.Pool whose workers ignore SIGINT"""
+    import multiprocessing
+    old_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    pool = multiprocessing.Pool(*args, **kwargs)
+    signal.signal(signal.SIGINT, old_handler)
+    return pool
+
+
+def imap_chunked(func, iterable, jobs=None, chunk_size=256):
+    """Lazily map func over chunks of iterable using a pool of processes
+
+    func takes a list of items and returns a list of results. Results are
+    yielded in order as soon as they are ready, and only a bounded number
+    of chunks is read ahead. Inputs smaller than one chunk are processed
+    in the calling process
+
+    Arguments:
+    func -- picklable function taking and returning a list
+    iterable -- items to process
+
+    Keyword arguments:
+    jobs -- number of worker processes (default: number of CPUs)
+    chunk_size -- number of items sent to a worker at once
+    """
+    it = iter(iterable)
+    chunks = iter(lambda: list(islice(it, chunk_size)), [])
+
+    first_chunk = next(chunks, [])
+    if len(first_chunk) < chunk_size or jobs == 1:
+        yield from func(first_chunk)
+        for chunk in chunks:
+            yield from func(chunk)
+        return
+
+    with Pool(jobs) as pool:
+        max_pending = 2 * (jobs or os.cpu_count() or 1)
+        pending = deque([pool.apply_async(func, (first_chunk,))])
+        for chunk in chunks:
+            pending.append(pool.apply_async(func, (chunk,)))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
 def carmichael_lcm(p, q):
+    from gmpy2 import gcd
     phi = (p-1)*(q-1)
     return phi // gcd(p-1, q-1)
 
 
+def carmichael_lambda(primes):
+    """Carmichael's function of the product of distinct primes
+
+    Arguments:
+    primes -- iterable of distinct primes
+    """
+    from gmpy2 import gcd
+    lam = 1
+    for r in primes:
+        lam = lam * (r-1) // gcd(lam, r-1)
+    return int(lam)
+
+
+def compute_crt_elements(d, primes):
+    """Compute multi-prime CRT elements as defined by PKCS#1 v2.2
+
+    Returns a list of (prime, exponent, coefficient) tuples: the first
+    prime has no coefficient, the second one's is q^-1 mod p, then each
+    prime's is the inverse of the product of the preceding primes
+
+    Arguments:
+    d -- RSA private exponent
+    primes -- list of distinct primes, p and q first
+    """
+    from gmpy2 import invert
+    elements = [(primes[0], d % (primes[0]-1), None)]
+    if len(primes) > 1:
+        p, q = primes[:2]
+        elements.append((q, d % (q-1), int(invert(q, p))))
+    product = primes[0] * primes[1] if len(primes) > 1 else primes[0]
+    for r in primes[2:]:
+        elements.append((r, d % (r-1), int(invert(product, r))))
+        product *= r
+    return elements
+
+
 def byte_length(n):
     """Return byte length of the given integer
 
@@ -75,6 +164,7 @@ def compute_extra_key_elements(d, p, q):
     p -- RSA first factor
     q -- RSA second factor
     """
+    from gmpy2 import invert
     if d is not None:
         dp = d%(p-1)
         dq = d%(q-1)
@@ -99,6 +189,7 @@ def compute_pubkey(n, e, d, p, q, phi=None):
     p -- RSA first factor
     q -- RSA second factor
     """
+    from gmpy2 import invert, gcd
 
     tup = (n, e, d, p, q)
 
@@ -138,41 +229,108 @@ def compute_pubkey(n, e, d, p, q, phi=None):
     return pks.pop()
 
 
+RECOVER_PQ_WITNESSES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)
+RECOVER_PQ_TRIALS = 100
+
+
 def recover_pq(n, e, d):
+    """Factor n given a matching pair of exponents
+
+    Small primes are tried as witnesses first, as each one splits n
+    with probability at least 1/2, and then random witnesses are drawn
+
+    Arguments:
+    n -- RSA modulus
+    e -- RSA public exponent
+    d -- RSA private exponent
+    """
+    from gmpy2 import powmod, gcd
     k = d*e - 1
 
     if k % 2 != 0:
         raise ValueError(f"p and q cannot be recovered from these parameters {(n, e, d)}")
 
-    factor = 1
+    t = 0
     while k % 2 == 0:
-        factor *= 2
+        t += 1
         k //= 2
 
-    for i in range(100):
-        b = 0
-        g = random.randint(0, n)
-        y = pow(g, k, n)
-        if y == 1 or y == (n - 1):
+    witnesses = chain(
+            RECOVER_PQ_WITNESSES,
+            (random.randint(2, n-2) for _ in range(RECOVER_PQ_TRIALS)))
+    for g in witnesses:
+        y = powmod(g, k, n)
+        if y == 1 or y == n-1:
             continue
-        for j in range(1, factor):
-            x = pow(y, 2, n)
-            if x in (1, n-1):
+        for _ in range(t):
+            x = powmod(y, 2, n)
+            if x == 1:
+                # y is a nontrivial square root of 1
+                p = int(gcd(y-1, n))
+                return p, n // p
+            if x == n-1:
                 break
             y = x
-        else:
-            x = pow(y, 2, n)
-        if x == 1:
-            break
+    raise ValueError(f"p and q cannot be recovered (not enough iterations?)")
+
+
+def complete_multiprime_privkey(n, e, d, p, q, *other_primes, use_lcm=True):
+    """Compute missing private key elements of a multi-prime key
+
+    At most one of p and q can be missing, along with either n, e or d
+
+    Arguments:
+    n -- RSA modulus
+    e -- RSA public exponent
+    d -- RSA private exponent
+    p -- RSA first factor
+    q -- RSA second factor
+    other_primes -- RSA additional factors
+    """
+    from gmpy2 import invert
+
+    tup = (n, e, d, p, q, *other_primes)
+
+    if e is None and d is None:
+        raise ValueError(f"You have to provide e or d in tuple '{tup}'")
+    if None in other_primes or (p is None and q is None):
+        raise ValueError(f"You have to provide all primes but one of p and q in tuple '{tup}'")
+
+    known = [r for r in (p, q, *other_primes) if r is not None]
+    product = 1
+    for r in known:
+        product *= r
+    if p is None or q is None:
+        if n is None:
+            raise ValueError(f"You have to provide n or all primes in tuple '{tup}'")
+        missing = n // product
+        p, q = (missing, q) if p is None else (p, missing)
+        product *= missing
+    elif n is None:
+        n = product
+
+    primes = (p, q, *other_primes)
+    if n != product:
+        raise ValueError(f"n is not equal to the product of primes in tuple '{tup}'")
+    if len(set(primes)) != len(primes):
+        raise ValueError(f"Primes are not distinct in tuple '{tup}'")
+
+    if use_lcm:
+        phi = carmichael_lambda(primes)
     else:
-        raise ValueError(f"p and q cannot be recovered (not enough iterations?)")
+        phi = 1
+        for r in primes:
+            phi *= r-1
+
+    if e is None:
+        e = int(invert(d, phi))
+    elif d is None:
+        d = int(invert(e, phi))
 
-    p = int(gcd(y-1, n))
-    q = n // p
-    return p, q
+    return (n, e, d, *primes)
 
 
-def complete_privkey(n, e, d, p, q, phi=None, use_lcm=True):
+def complete_privkey(n, e, d, p, q, *other_primes, phi=None, use_lcm=True):
     """Compute missing private key elements
 
     Arguments:
@@ -181,8 +339,14 @@ def complete_privkey(n, e, d, p, q, phi=None, use_lcm=True):
     d -- RSA private exponent
     p -- RSA first factor
     q -- RSA second factor
+    other_primes -- RSA additional factors of multi-prime keys
     """
 
+    if other_primes:
+        return complete_multiprime_privkey(n, e, d, p, q, *other_primes, use_lcm=use_lcm)
+
+    from gmpy2 import invert, isqrt
+
     tup = (n, e, d, p, q, phi)
 
     if n is None and (p is None or q is None):
@@ -220,7 +384,7 @@ def complete_privkey(n, e, d, p, q, phi=None, use_lcm=True):
 
     return n, e, d, p, q
 
-def compute_d(n, e, d, p, q, phi=None):
+def compute_d(n, e, d, p, q, *other_primes, phi=None):
     """Compute d from available parameters
 
     Arguments:
@@ -229,8 +393,15 @@ def compute_d(n, e, d, p, q, phi=None):
     d -- RSA private exponent
     p -- RSA first factor
     q -- RSA second factor
+    other_primes -- RSA additional factors of multi-prime keys
     """
 
+    if other_primes:
+        _, _, d, *_ = complete_multiprime_privkey(n, e, d, p, q, *other_primes)
+        return d
+
+    from gmpy2 import invert
+
     tup = (n, e, d, p, q, phi)
 
     ds = set()
@@ -339,6 +510,7 @@ def output_text(label, text, filename, encoding=None, json_output=False):
 
 # From a tip I saw here: https://stackoverflow.com/questions/3431825/generating-an-md5-checksum-of-a-file
 def file_checksum(filename):
+    import hashlib
     hash_sha256 = hashlib.sha256()
     with open(filename, "rb") as f:
         for chunk in iter(partial(f.read, 4096), b""):
@@ -354,12 +526,14 @@ def module_root(m):
 
 
 def copy_resource(package, res, dest):
+    from importlib import resources
     with resources.open_binary(package, res) as src, \
             open(Path(dest)/res, "wb") as dst:
         copyfileobj(src, dst)
 
 
 def copy_resource_module(package, module, dest):
+    from importlib import resources
     suffs = importlib.machinery.all_suffixes()
     for res in resources.contents(package):
         if not resources.is_resource(package, res):
@@ -379,6 +553,7 @@ def copy_resource_tree(package, dest):
     package_name = package.__name__.split(".")[-1]
     dest_subdir = Path(dest)/package_name
     dest_subdir.mkdir(mode=0o755, exist_ok=True)
+    from importlib import resources
     for x in resources.contents(package):
         if resources.is_resource(package, x):
             copy_resource(package, x, dest_subdir)
@@ -0,0 +1,281 @@
+##########################################################################
+# RSArmageddon - RSA cryptography and cryptoanalysis toolkit             #
+# Copyright (C) 2020,2021                                                #
+# Vittorio Mignini a.k.a. M1gnus <vittorio.mignini@gmail.com>            #
+# Simone Cimarelli a.k.a. Aquilairreale <aquilairreale@ymail.com>        #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <https://www.gnu.org/licenses/>. #
+##########################################################################
+
+import random
+
+from gmpy2 import next_prime, is_prime, invert, gcd
+
+from .utils import DEFAULT_E, carmichael_lcm
+
+
+def random_prime(bits, rng=random):
+    """Generate a random prime of exactly the given bit length
+
+    Arguments:
+    bits -- bit length of the prime
+    rng -- random.Random instance
+    """
+    while True:
+        p = next_prime(rng.getrandbits(bits) | (1 << (bits - 1)))
+        if p.bit_length() == bits:
+            return int(p)
+
+
+def private_key(p, q, e=DEFAULT_E):
+    """Build a full private key tuple from its factors
+
+    Arguments:
+    p -- RSA first factor
+    q -- RSA second factor
+    e -- RSA public exponent
+    """
+    d = int(invert(e, carmichael_lcm(p, q)))
+    return p*q, e, d, p, q
+
+
+def random_key(bits, e=DEFAULT_E, rng=random):
+    """Generate a random key with no deliberate weakness
+
+    Arguments:
+    bits -- modulus bit length
+    e -- RSA public exponent
+    rng -- random.Random instance
+    """
+    while True:
+        p = random_prime(bits // 2, rng)
+        q = random_prime(bits - bits // 2, rng)
+        if p != q and gcd(e, (p-1) * (q-1)) == 1:
+            return private_key(p, q, e)
+
+
+def close_primes_key(bits, rng=random):
+    """Generate a key whose factors are close enough for Fermat factorization
+
+    Arguments:
+    bits -- modulus bit length
+    rng -- random.Random instance
+    """
+    while True:
+        p = random_prime(bits // 2, rng)
+        q = int(next_prime(p + rng.getrandbits(bits // 4)))
+        if q.bit_length() == p.bit_length() and gcd(DEFAULT_E, (p-1) * (q-1)) == 1:
+            return private_key(p, q)
+
+
+def small_d_key(bits, d_bits, rng=random):
+    """Generate a key with a private exponent of the given bit length
+
+    Wiener's attack works for d_bits below a quarter of bits, Boneh-Durfee
+    up to about 0.29 * bits
+
+    Arguments:
+    bits -- modulus bit length
+    d_bits -- private exponent bit length
+    rng -- random.Random instance
+    """
+    while True:
+        p = random_prime(bits // 2, rng)
+        q = random_prime(bits - bits // 2, rng)
+        phi = (p-1) * (q-1)
+        d = rng.getrandbits(d_bits) | (1 << (d_bits - 1)) | 1
+        if p != q and gcd(d, phi) == 1:
+            e = int(invert(d, phi))
+            return p*q, e, d, p, q
+
+
+def unbalanced_key(bits, small_bits, rng=random):
+    """Generate a key with a factor small enough for ECM to find
+
+    Arguments:
+    bits -- modulus bit length
+    small_bits -- bit length of the smaller factor
+    rng -- random.Random instance
+    """
+    while True:
+        p = random_prime(small_bits, rng)
+        q = random_prime(bits - small_bits, rng)
+        if gcd(DEFAULT_E, (p-1) * (q-1)) == 1:
+            return private_key(p, q)
+
+
+SMOOTH_PRIMES = None
+
+def smooth_prime(bits, bound=10000, rng=random):
+    """Generate a prime p such that p-1 is squarefree and bound-smooth
+
+    Arguments:
+    bits -- bit length of the prime
+    bound -- smoothness bound
+    rng -- random.Random instance
+    """
+    global SMOOTH_PRIMES
+    if SMOOTH_PRIMES is None or SMOOTH_PRIMES[1] != bound:
+        primes = []
+        k = 2
+        while True:
+            k = int(next_prime(k))
+            if k >= bound:
+                break
+            primes.append(k)
+        SMOOTH_PRIMES = primes, bound
+    odd_primes = SMOOTH_PRIMES[0][1:]
+
+    while True:
+        factors = rng.sample(odd_primes, len(odd_primes))
+        m = 2
+        for k in factors:
+            if (m * k).bit_length() > bits:
+                continue
+            m *= k
+            if m.bit_length() >= bits - 1:
+                break
+        p = m + 1
+        if p.bit_length() == bits and is_prime(p):
+            return p
+
+
+def smooth_p_1_key(bits, bound=10000, rng=random):
+    """Generate a key vulnerable to Pollard's p-1 factorization
+
+    Arguments:
+    bits -- modulus bit length
+    bound -- smoothness bound of p-1
+    rng -- random.Random instance
+    """
+    while True:
+        p = smooth_prime(bits // 2, bound, rng)
+        q = random_prime(bits - bits // 2, rng)
+        if gcd(DEFAULT_E, (p-1) * (q-1)) == 1:
+            return private_key(p, q)
+
+
+def shared_prime_keys(bits, count=2, rng=random):
+    """Generate keys all sharing one prime factor
+
+    Arguments:
+    bits -- modulus bit length
+    count -- number of keys
+    rng -- random.Random instance
+    """
+    while True:
+        p = random_prime(bits // 2, rng)
+        if gcd(DEFAULT_E, p-1) == 1:
+            break
+    keys = []
+    while len(keys) < count:
+        q = random_prime(bits - bits // 2, rng)
+        if q != p and gcd(DEFAULT_E, q-1) == 1:
+            keys.append(private_key(p, q))
+    return keys
+
+
+def reused_modulus_keys(bits, count=2, rng=random):
+    """Generate keys sharing the same modulus with different public exponents
+
+    Arguments:
+    bits -- modulus bit length
+    count -- number of keys
+    rng -- random.Random instance
+    """
+    while True:
+        p = random_prime(bits // 2, rng)
+        q = random_prime(bits - bits // 2, rng)
+        if p != q:
+            break
+    lam = carmichael_lcm(p, q)
+    keys = []
+    e = DEFAULT_E
+    while len(keys) < count:
+        if gcd(e, lam) == 1:
+            keys.append(private_key(p, q, e))
+        e = int(next_prime(e))
+    return keys
+
+
+def hastad_set(bits, e=3, rng=random):
+    """Generate e keys with public exponent e and a message broadcast to them
+
+    Returns a (keys, ciphertexts, message) tuple
+
+    Arguments:
+    bits -- modulus bit length
+    e -- RSA public exponent, also the number of keys
+    rng -- random.Random instance
+    """
+    keys = []
+    while len(keys) < e:
+        key = random_key(bits, e, rng)
+        if all(gcd(key[0], n) == 1 for n, *_ in keys):
+            keys.append(key)
+    min_n = min(n for n, *_ in keys)
+    # Large enough that m^e wraps around every modulus
+    while True:
+        m = rng.randrange(min_n)
+        if m**e > min_n * 2**64:
+            break
+    ciphertexts = [pow(m, e, n) for n, *_ in keys]
+    return keys, ciphertexts, m
+
+
+CORPUS_GROUP_SIZE = 2
+
+corpus_weaknesses = {
+    None: (1, lambda bits, rng: [random_key(bits, rng=rng)]),
+    "shared": (CORPUS_GROUP_SIZE, lambda bits, rng: shared_prime_keys(bits, CORPUS_GROUP_SIZE, rng)),
+    "close": (1, lambda bits, rng: [close_primes_key(bits, rng)]),
+    "small_d": (1, lambda bits, rng: [small_d_key(bits, bits // 4 - 8, rng)]),
+    "smooth": (1, lambda bits, rng: [smooth_p_1_key(bits, rng=rng)]),
+    "reused": (CORPUS_GROUP_SIZE, lambda bits, rng: reused_modulus_keys(bits, CORPUS_GROUP_SIZE, rng))
+}
+
+
+def corpus_tasks(weaknesses, rng=random):
+    """Endlessly yield (weakness, seed) tasks for generate_corpus_groups
+
+    Weaknesses are picked at random so that on average the given fraction
+    of keys has each of them, the remaining keys have no deliberate
+    weakness
+
+    Arguments:
+    weaknesses -- dict mapping weakness names to fractions of keys
+    rng -- random.Random instance
+    """
+    fractions = {None: 1 - sum(weaknesses.values()), **weaknesses}
+    # Weaknesses are injected in groups of keys: weigh groups by size
+    names = list(fractions)
+    weights = [fractions[w] / corpus_weaknesses[w][0] for w in names]
+    while True:
+        weakness, = rng.choices(names, weights)
+        yield weakness, rng.getrandbits(64)
+
+
+def generate_corpus_groups(bits, tasks):
+    """Generate the groups of keys described by tasks
+
+    Each task is seeded independently, so results do not depend on how
+    tasks are split across processes. Returns a list of
+    (weakness, keys) tuples
+
+    Arguments:
+    bits -- modulus bit length
+    tasks -- list of (weakness, seed) tuples as yielded by corpus_tasks
+    """
+    return [(weakness, corpus_weaknesses[weakness][1](bits, random.Random(seed)))
+            for weakness, seed in tasks]